@@ -6,22 +6,26 @@ from fastapi import (
     APIRouter,
     File,
     Header,
+    Query,
+    Request,
+    Response,
     UploadFile,
     status,
     HTTPException,
     Form,
 )
 from auth import get_current_user, o_auth_schemes
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from admin_schemas import (
     AttributeCreate,
     Brands,
     BrandOut,
     CategoryCreate,
     CategoryOut,
+    CouponBulkCreate,
     CouponCreate,
     CouponResponse,
     CouponUpdate,
@@ -32,35 +36,45 @@ from admin_schemas import (
     Variants,
     TermCreate,
 )
-from database import get_db
+from database import SessionLocal, get_db
 from models import (
     Brand,
     Coupon,
+    CouponUsage,
     UserSession,
     Users,
     Category,
     SubCategory,
     Variant,
+    VariantStockShard,
     Attribute,
     ProductAssignment,
     Product,
     Term,
-    BlackListedToken,
 )
-from auth import create_access_token, admin_required
+from auth import create_access_token, admin_required, invalidate_user
 import os
+import cart_expiry
+import cart_summary
+import coupons
+import facet_index
+import passwords
+import price_index
+import read_model
+import revocation
+import search_index
+import session_log
+import stock_counters
+from catalog_cache import cache_key, catalog_cache, not_modified
 
 # from utils import save_uploaded_files
 from pathlib import Path
 from uuid import uuid4
 
-
 UPLOAD_DIR = "/uploads/brand_images/"
 
 admin_router = APIRouter(tags=["admin"])
 
-pw_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 UPLOAD_BRAND_DIR = "uploads/product/images"
 
 
@@ -92,7 +106,6 @@ def create_user(
     request: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
 ):
     username = request.username
-    hashed_password = pw_context.hash(request.password)
 
     # Check if user already exists
     found_user = db.query(Users).filter(Users.email == username).first()
@@ -105,6 +118,8 @@ def create_user(
     is_first_user = db.query(Users).count() == 0
     role = "admin" if is_first_user else "user"
 
+    hashed_password = passwords.hash_password(request.password)
+
     # Create new user
     new_user = Users(email=username, password=hashed_password, role=role)
     db.add(new_user)
@@ -130,29 +145,54 @@ def login_user(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found, create one"
         )
 
-    if not pw_context.verify(password, found_user.password):
+    verified, new_hash = passwords.verify_password(password, found_user.password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE, detail="Incorrect password"
         )
-
-    token = create_access_token({"sub": found_user.email, "role": found_user.role})
+    if new_hash is not None:
+        # Stored with an older BCRYPT_ROUNDS
+        found_user.password = new_hash
+        db.commit()
+
+    token = create_access_token(
+        {
+            "sub": found_user.email,
+            "role": found_user.role,
+            "user_id": found_user.user_id,
+        }
+    )
 
     # Extract IP (if behind proxy use x-forwarded-for)
     ip_address = x_forwarded_for.split(",")[0] if x_forwarded_for else None
 
-    # Create session record
-    new_session = UserSession(
-        user_id=found_user.user_id,
-        token=token,
-        ip_address=ip_address,
-        user_agent=user_agent,
-    )
-    db.add(new_session)
-    db.commit()
+    # Session record, written by the session log's background batches
+    session_log.record_login(found_user.user_id, token, ip_address, user_agent)
 
     return {"access_token": token, "token_type": "bearer"}
 
 
+@admin_router.put("/users/{user_id}/role")
+def change_user_role(
+    user_id: int,
+    role: str = Query(pattern="^(admin|user)$"),
+    current_user=Depends(admin_required),
+    db: Session = Depends(get_db),
+):
+    found_user = db.get(Users, user_id)
+    if not found_user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+
+    found_user.role = role
+    db.commit()
+    # Other workers' cached copies keep the old role for up to
+    # AUTH_USER_CACHE_TTL
+    invalidate_user(user_id)
+    return {"user_id": user_id, "role": role}
+
+
 @admin_router.post("/logout")
 def logout(
     token: str = Depends(o_auth_schemes),
@@ -160,31 +200,35 @@ def logout(
     user=Depends(get_current_user),
 ):
     # 1️⃣ Find the active session
-    session = (
-        db.query(UserSession)
-        .filter(
-            UserSession.user_id == user.user_id,
-            UserSession.is_active,
-            UserSession.token == token,
-        )
-        .first()
+    active_session = db.query(UserSession).filter(
+        UserSession.user_id == user.user_id,
+        UserSession.is_active,
+        UserSession.token == token,
     )
-
-    if not session:
-        raise HTTPException(status_code=404, detail="Active session not found")
+    session = active_session.first()
+    if not session and session_log.session_log.queue:
+        # Logged in moments ago: the row may still be queued
+        session_log.flush()
+        session = active_session.first()
 
     # 2️⃣ Mark as logged out
-    session.is_active = False
-    session.logout_at = datetime.utcnow()
+    payload = jwt.get_unverified_claims(token)
+    logout_time = datetime.utcnow()
+    if session:
+        session.is_active = False
+        session.logout_time = logout_time
+
+    # 3️⃣ Revoke the JWT whether or not the session row exists yet: denylisted
+    # in this commit, rejected from now on
+    revocation.revoke(db, token, payload)
     db.commit()
 
-    # 3️⃣ Blacklist the JWT (optional security step)
-    expires_at = datetime.utcfromtimestamp(
-        jwt.decode(token, options={"verify_signature": False})["exp"]
-    )
-    blacklist_entry = BlackListedToken(token=token, expires_at=expires_at)
-    db.add(blacklist_entry)
-    db.commit()
+    if not session:
+        # Queued on the worker that handled the login; this worker's session
+        # log closes the row once it lands
+        session_log.record_logout(
+            user.user_id, token, logout_time, revocation.token_expiry(payload)
+        )
 
     return {"message": "Successfully logged out"}
 
@@ -221,13 +265,31 @@ def add_brand(
     db.add(new_brand)
     db.commit()
     db.refresh(new_brand)
+    search_index.refresh_taxonomy(db, "brand", new_brand.brand_id)
+    catalog_cache.invalidate("brands")
     return new_brand
 
 
 @admin_router.get("/brand", response_model=list[BrandOut])
-def get_all_brands(db: Session = Depends(get_db), cuurent_user=Depends(admin_required)):
-    brands = db.query(Brand).all()
-    return brands
+def get_all_brands(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    cuurent_user=Depends(admin_required),
+):
+    key = cache_key("brands")
+    cached = not_modified(request, response, key, ["brands"])
+    if cached:
+        return cached
+
+    return catalog_cache.get_or_load(
+        key,
+        ["brands"],
+        lambda: [
+            BrandOut.model_validate(brand).model_dump()
+            for brand in db.query(Brand).all()
+        ],
+    )
 
 
 @admin_router.get("/brand/{id}", response_model=BrandOut)
@@ -270,7 +332,10 @@ def update_brand(
     found_brand.short_description = short_description
     found_brand.long_description = long_description
 
+    read_model.sync_products(db, Product.brand_id == id)
     db.commit()
+    search_index.refresh_taxonomy(db, "brand", id)
+    catalog_cache.invalidate("brands", "products")
     return {"message": "Updated sucessfully", "brand": found_brand.brand_name}
 
 
@@ -284,8 +349,17 @@ def delete_brand(
             status_code=status.HTTP_404_NOT_FOUND,
             content={"detail": "Brand not found"},
         )
+    # The flush nulls the products' brand_id, so select them beforehand
+    affected = Product.product_id.in_(
+        read_model.product_ids(db, Product.brand_id == id)
+    )
     db.delete(found_brand)
+    read_model.sync_products(db, affected)
     db.commit()
+    search_index.refresh_taxonomy(db, "brand", id)
+    search_index.reindex_products(db, affected)
+    facet_index.reindex_products(db, affected)
+    catalog_cache.invalidate("brands", "products")
     return {"message": "Brand Deleted Successfully"}
 
 
@@ -316,6 +390,8 @@ def add_category(
     db.add(new_category)
     db.commit()
     db.refresh(new_category)
+    search_index.refresh_taxonomy(db, "category", new_category.category_id)
+    catalog_cache.invalidate("categories")
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content={
@@ -331,10 +407,24 @@ def add_category(
 
 @admin_router.get("/category", response_model=list[CategoryOut])
 def get_all_categories(
-    current_user=Depends(admin_required), db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user=Depends(admin_required),
+    db: Session = Depends(get_db),
 ):
-    all_categories = db.query(Category).all()
-    return all_categories
+    key = cache_key("categories")
+    cached = not_modified(request, response, key, ["categories"])
+    if cached:
+        return cached
+
+    return catalog_cache.get_or_load(
+        key,
+        ["categories"],
+        lambda: [
+            CategoryOut.model_validate(category, from_attributes=True).model_dump()
+            for category in db.query(Category).all()
+        ],
+    )
 
 
 @admin_router.get("/category/{id}", response_model=CategoryOut)
@@ -366,8 +456,11 @@ def update_category(
 
     found_category.brand_id = request.brand_id
     found_category.category_name = request.category_name
+    read_model.sync_products(db, Product.category_id == id)
     db.commit()
     db.refresh(found_category)
+    search_index.refresh_taxonomy(db, "category", id)
+    catalog_cache.invalidate("categories", "products")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -389,8 +482,17 @@ def delete_category(
             content={"detail": "Category not found"},
         )
 
+    # The flush nulls the products' category_id, so select them beforehand
+    affected = Product.product_id.in_(
+        read_model.product_ids(db, Product.category_id == id)
+    )
     db.delete(found_category)
+    read_model.sync_products(db, affected)
     db.commit()
+    search_index.refresh_taxonomy(db, "category", id)
+    search_index.reindex_products(db, affected)
+    facet_index.reindex_products(db, affected)
+    catalog_cache.invalidate("categories", "products")
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={"message": "Category deleted successfully"},
@@ -427,6 +529,8 @@ def add_sub_category(
     db.add(new_sub_category)
     db.commit()
     db.refresh(new_sub_category)
+    search_index.refresh_taxonomy(db, "subcategory", new_sub_category.sub_category_id)
+    catalog_cache.invalidate("subcategories")
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
         content={
@@ -483,8 +587,11 @@ def update_subcategory(
     found_category.sub_category_name = request.sub_category_name
     found_category.category_id = request.category_id
     found_category.brand_id = request.brand_id
+    read_model.sync_products(db, Product.sub_category_id == id)
     db.commit()
     db.refresh(found_category)
+    search_index.refresh_taxonomy(db, "subcategory", id)
+    catalog_cache.invalidate("subcategories", "products")
 
     return found_category
 
@@ -502,8 +609,17 @@ def delete_subcategory(
             content={"detail": "Sub Category not found"},
         )
 
+    # The flush nulls the products' sub_category_id, so select them beforehand
+    affected = Product.product_id.in_(
+        read_model.product_ids(db, Product.sub_category_id == id)
+    )
     db.delete(found_category)
+    read_model.sync_products(db, affected)
     db.commit()
+    search_index.refresh_taxonomy(db, "subcategory", id)
+    search_index.reindex_products(db, affected)
+    facet_index.reindex_products(db, affected)
+    catalog_cache.invalidate("subcategories", "products")
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={"message": "Sub category deleted successfully"},
@@ -545,8 +661,14 @@ def add_product(
         category_id=category_id,
     )
     db.add(new_product)
+    db.flush()
+    read_model.sync_products(db, Product.product_id == new_product.product_id)
     db.commit()
     db.refresh(new_product)
+    search_index.reindex_products(db, Product.product_id == new_product.product_id)
+    facet_index.reindex_products(db, Product.product_id == new_product.product_id)
+    price_index.reindex_products(db, Product.product_id == new_product.product_id)
+    catalog_cache.invalidate("products")
 
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
@@ -619,8 +741,13 @@ def update_product(
     found_product.sub_category_id = sub_category_id
     found_product.category_id = category_id
 
+    read_model.sync_products(db, Product.product_id == id)
     db.commit()
     db.refresh(found_product)
+    search_index.reindex_products(db, Product.product_id == id)
+    facet_index.reindex_products(db, Product.product_id == id)
+    price_index.reindex_products(db, Product.product_id == id)
+    catalog_cache.invalidate("products", f"product:{id}")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -647,7 +774,12 @@ def delete_product(
         )
 
     db.delete(found_product)
+    read_model.remove_product(db, id)
     db.commit()
+    search_index.remove_product(id)
+    facet_index.remove_product(id)
+    price_index.remove_product(id)
+    catalog_cache.invalidate("products", f"product:{id}")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -734,6 +866,7 @@ def update_attribute(id: int, request: AttributeCreate, db: Session = Depends(ge
     attribute.attribute_name = request.attribute_name
     db.commit()
     db.refresh(attribute)
+    catalog_cache.invalidate("attributes")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -760,6 +893,7 @@ def delete_attribute(
 
     db.delete(attribute)
     db.commit()
+    catalog_cache.invalidate("attributes")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -823,6 +957,7 @@ def update_term(
     term.value = request.value
     db.commit()
     db.refresh(term)
+    catalog_cache.invalidate("attributes")
 
     return JSONResponse(
         content={"detail": "Term updated succesfully"}, status_code=status.HTTP_200_OK
@@ -839,8 +974,22 @@ def delete_term(
             content={"detail": "Term not found"}, status_code=status.HTTP_404_NOT_FOUND
         )
 
+    # Restamps the read-model rows of the term's products, which is how
+    # other workers' facet indexes learn of the change (see catalog_sync)
+    affected = Product.product_id.in_(
+        [
+            product_id
+            for (product_id,) in db.query(ProductAssignment.product_id).filter(
+                ProductAssignment.term_id == id
+            )
+        ]
+    )
     db.delete(term)
+    db.flush()
+    read_model.sync_products(db, affected)
     db.commit()
+    facet_index.remove_term(id)
+    catalog_cache.invalidate("attributes")
 
     return JSONResponse(
         content={"message": "Term deleted successfully"}, status_code=status.HTTP_200_OK
@@ -857,8 +1006,12 @@ def assign_product(
         product_id=request.product_id, term_id=request.term_id
     )
     db.add(new_assignment)
+    db.flush()
+    read_model.sync_products(db, Product.product_id == new_assignment.product_id)
     db.commit()
     db.refresh(new_assignment)
+    facet_index.reindex_products(db, Product.product_id == new_assignment.product_id)
+    catalog_cache.invalidate("assignments", f"product:{new_assignment.product_id}")
     return JSONResponse(
         content={"message": "Product assigned    successfully"},
         status_code=status.HTTP_201_CREATED,
@@ -906,10 +1059,22 @@ def update_product_assignment(
             content={"detail": "Not Found"}, status_code=status.HTTP_404_NOT_FOUND
         )
 
+    previous_product_id = assignment.product_id
     assignment.product_id = request.product_id
     assignment.term_id = request.term_id
+    read_model.sync_products(
+        db, Product.product_id.in_([previous_product_id, assignment.product_id])
+    )
     db.commit()
     db.refresh(assignment)
+    facet_index.reindex_products(
+        db, Product.product_id.in_([previous_product_id, assignment.product_id])
+    )
+    catalog_cache.invalidate(
+        "assignments",
+        f"product:{previous_product_id}",
+        f"product:{assignment.product_id}",
+    )
 
     return JSONResponse(
         content={"message": "Updated succesfully"}, status_code=status.HTTP_200_OK
@@ -933,7 +1098,10 @@ def delete_product_assignment(
         )
 
     db.delete(assignment)
+    read_model.sync_products(db, Product.product_id == assignment.product_id)
     db.commit()
+    facet_index.reindex_products(db, Product.product_id == assignment.product_id)
+    catalog_cache.invalidate("assignments", f"product:{assignment.product_id}")
     return JSONResponse(
         content={"message": "Product Assignment Deleted successfully"},
         status_code=status.HTTP_200_OK,
@@ -961,8 +1129,10 @@ def add_variant(
         available=request.available,
     )
     db.add(new_variant)
+    read_model.sync_products(db, Product.product_id == request.product_id)
     db.commit()
     db.refresh(new_variant)
+    catalog_cache.invalidate("products", f"product:{new_variant.product_id}")
     return new_variant
 
 
@@ -1000,16 +1170,27 @@ def update_variant(
         )
 
     # 2. Update fields
+    previous_product_id = variant.product_id
     variant.product_id = request.product_id
     variant.name = request.name
     variant.sku = request.sku
     variant.price = request.price
     variant.stock = request.stock
     variant.available = request.available
+    if stock_counters.sharded(db, [id]):
+        stock_counters.set_total(db, id, request.stock)
 
-    # 3. Commit changes
+    # 3. Commit changes; carts holding the variant get their totals re-derived
+    read_model.sync_products(
+        db, Product.product_id.in_([previous_product_id, request.product_id])
+    )
+    cart_users = cart_summary.refresh_variant(db, id)
     db.commit()
+    cart_summary.invalidate(*cart_users)
     db.refresh(variant)
+    catalog_cache.invalidate(
+        "products", f"product:{previous_product_id}", f"product:{variant.product_id}"
+    )
 
     return variant
 
@@ -1029,8 +1210,11 @@ def delete_variant(
         )
 
     # 2. Delete it
+    stock_counters.disable(db, id)
     db.delete(variant)
+    read_model.sync_products(db, Product.product_id == variant.product_id)
     db.commit()
+    catalog_cache.invalidate("products", f"product:{variant.product_id}")
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -1038,6 +1222,98 @@ def delete_variant(
     )
 
 
+@admin_router.post("/variants/{id}/shards")
+def enable_stock_shards(
+    id: int,
+    shards: int = Query(stock_counters.STOCK_SHARDS, ge=2, le=256),
+    current_user=Depends(admin_required),
+    db: Session = Depends(get_db),
+):
+    # Switch a hot variant to sharded stock counters (or re-split it)
+    variant = db.query(Variant).filter(Variant.variant_id == id).first()
+    if not variant:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"detail": "Variant not found"},
+        )
+
+    total = stock_counters.enable(db, id, shards)
+    db.commit()
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"variant_id": id, "shards": shards, "stock": total},
+    )
+
+
+@admin_router.get("/variants/{id}/shards")
+def get_stock_shards(
+    id: int, current_user=Depends(admin_required), db: Session = Depends(get_db)
+):
+    shards = (
+        db.query(VariantStockShard)
+        .filter(VariantStockShard.variant_id == id)
+        .order_by(VariantStockShard.shard)
+        .all()
+    )
+    if not shards:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"detail": "Variant is not sharded"},
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={
+            "variant_id": id,
+            "stock": sum(shard.stock for shard in shards),
+            "shards": [shard.stock for shard in shards],
+        },
+    )
+
+
+@admin_router.delete("/variants/{id}/shards")
+def disable_stock_shards(
+    id: int, current_user=Depends(admin_required), db: Session = Depends(get_db)
+):
+    if not stock_counters.sharded(db, [id]):
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"detail": "Variant is not sharded"},
+        )
+
+    total = stock_counters.disable(db, id)
+    variant = db.query(Variant).filter(Variant.variant_id == id).first()
+    read_model.sync_products(db, Product.product_id == variant.product_id)
+    db.commit()
+    catalog_cache.invalidate("products", f"product:{variant.product_id}")
+
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"variant_id": id, "stock": total},
+    )
+
+
+@admin_router.get("/cache/stats")
+def get_cache_stats(current_user=Depends(admin_required)):
+    return catalog_cache.stats()
+
+
+@admin_router.get("/passwords/stats")
+def get_password_pool_stats(current_user=Depends(admin_required)):
+    return passwords.password_pool.stats()
+
+
+@admin_router.get("/sessions/log/stats")
+def get_session_log_stats(current_user=Depends(admin_required)):
+    return session_log.session_log.stats()
+
+
+@admin_router.get("/carts/expiry/stats")
+def get_cart_expiry_stats(current_user=Depends(admin_required)):
+    return cart_expiry.expire_stats()
+
+
 # CREATE Coupon
 @admin_router.post("/coupons", response_model=CouponResponse)
 def create_coupon(coupon_data: CouponCreate, db: Session = Depends(get_db)):
@@ -1051,9 +1327,53 @@ def create_coupon(coupon_data: CouponCreate, db: Session = Depends(get_db)):
     db.add(new_coupon)
     db.commit()
     db.refresh(new_coupon)
+    coupons.add_codes(new_coupon.code)
     return JSONResponse(status_code=201, content={"message": "Created successfully"})
 
 
+@admin_router.post("/coupons/bulk")
+def bulk_create_coupons(
+    request: CouponBulkCreate,
+    current_user=Depends(admin_required),
+    db: Session = Depends(get_db),
+):
+    template = request.model_dump(exclude={"prefix", "count", "length"})
+    template.update(usage_limit=1, usage_per_user=1, is_active=True)
+    created, seconds = coupons.bulk_create(
+        db, request.prefix, request.count, request.length, template
+    )
+    coupons.extend_filter(db)
+    return JSONResponse(
+        status_code=201,
+        content={
+            "created": created,
+            "seconds": round(seconds, 3),
+            "codes_per_second": round(created / seconds) if seconds else created,
+            "export": f"/admin/coupons/export?prefix={request.prefix}",
+        },
+    )
+
+
+def stream_coupon_codes(prefix: str):
+    # Own session, as the body is sent after the request's session is closed
+    db = SessionLocal()
+    try:
+        query = (
+            db.query(Coupon.code)
+            .filter(Coupon.code.startswith(prefix, autoescape=True))
+            .order_by(Coupon.coupon_id)
+        )
+        for (code,) in query.yield_per(coupons.COUPON_BULK_BATCH):
+            yield code + "\n"
+    finally:
+        db.close()
+
+
+@admin_router.get("/coupons/export")
+def export_coupon_codes(prefix: str, current_user=Depends(admin_required)):
+    return StreamingResponse(stream_coupon_codes(prefix), media_type="text/plain")
+
+
 # READ All Coupons
 @admin_router.get("/coupons", response_model=list[CouponResponse])
 def list_coupons(db: Session = Depends(get_db)):
@@ -1079,11 +1399,13 @@ def update_coupon(
     if not coupon:
         return JSONResponse(status_code=404, content={"detail": "Coupon not found"})
 
+    previous_code = coupon.code
     for key, value in coupon_data.dict(exclude_unset=True).items():
         setattr(coupon, key, value)
 
     db.commit()
     db.refresh(coupon)
+    coupons.invalidate(previous_code, coupon.code)
     return JSONResponse(status_code=200, content={"message": "Updates sucessfully"})
 
 
@@ -1094,8 +1416,10 @@ def delete_coupon(coupon_id: int, db: Session = Depends(get_db)):
     if not coupon:
         return JSONResponse(status_code=404, content={"detail": "Coupon not found"})
 
+    db.execute(delete(CouponUsage).where(CouponUsage.coupon_id == coupon_id))
     db.delete(coupon)
     db.commit()
+    coupons.invalidate(coupon.code)
     return JSONResponse(
         status_code=200, content={"message": "Coupon deleted successfully"}
     )
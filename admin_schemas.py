@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Token(BaseModel):
@@ -118,6 +118,18 @@ class CouponCreate(CouponBase):
     pass
 
 
+class CouponBulkCreate(BaseModel):
+    # count single-use coupons with codes prefix + length random symbols
+    prefix: str = Field("", max_length=16, pattern=r"^[A-Za-z0-9_-]*$")
+    count: int = Field(ge=1, le=5_000_000)
+    length: int = Field(10, ge=6, le=12)
+    discount_type: str  # "percentage" or "fixed"
+    discount_value: float
+    min_order_amount: Optional[float] = 0.0
+    start_date: datetime
+    end_date: datetime
+
+
 class CouponUpdate(BaseModel):
     discount_type: Optional[str] = None
     discount_value: Optional[float] = None
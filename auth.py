@@ -1,8 +1,11 @@
 from datetime import datetime, timedelta, timezone
-from jose import jwt
+from uuid import uuid4
+from jose import JWTError, jwt
 from dotenv import load_dotenv
 import os
 from admin_schemas import User
+from catalog_cache import LRUCache
+import revocation
 from database import get_db
 from models import Users
 from sqlalchemy.orm import Session
@@ -13,6 +16,21 @@ load_dotenv()
 
 o_auth_schemes = OAuth2PasswordBearer(tokenUrl="/login")
 
+# The cache is per worker and invalidate_user only reaches the worker that
+# made the change, so the TTL is how long the other workers can keep serving
+# an old role, or a user deleted from the database. It defaults to the
+# revocation sync interval, the same bound a logout has.
+AUTH_USER_CACHE_TTL = float(
+    os.getenv("AUTH_USER_CACHE_TTL", os.getenv("REVOCATION_SYNC_INTERVAL", 5))
+)
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 10_000))
+# Trust the token's signed user_id/role claims without loading the user; a
+# role change or deleted account then only takes effect once the token expires
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "false").lower() == "true"
+
+# user_id -> User; role changes call invalidate_user for this worker
+user_cache = LRUCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+
 
 def create_access_token(data: dict, expire_time: timedelta | None = None):
     to_encode = data.copy()
@@ -20,7 +38,10 @@ def create_access_token(data: dict, expire_time: timedelta | None = None):
         exp_time = datetime.now(timezone.utc) + expire_time
     else:
         exp_time = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp_time": exp_time.isoformat()})
+    # exp is enforced by jwt.decode; jti names the token in the revocation list
+    to_encode.update(
+        {"exp_time": exp_time.isoformat(), "exp": exp_time, "jti": uuid4().hex}
+    )
     return jwt.encode(to_encode, os.getenv("SECRET_KEY"), os.getenv("ALGORITHM"))
 
 
@@ -29,17 +50,43 @@ def get_current_user(
 ):
     try:
         payload = jwt.decode(token, os.getenv("SECRET_KEY"), os.getenv("ALGORITHM"))
+        # In-memory check: no query per request
+        if revocation.is_revoked(revocation.token_id(token, payload)):
+            raise HTTPException(status_code=401, detail="Token revoked")
         username = payload.get("sub")
-        found_user = db.query(Users).filter(Users.email == username).first()
-        if not found_user:
-            return {"messsage": "Expired token"}
-        return User(
-            email=found_user.email, role=found_user.role, user_id=found_user.user_id
-        )
+        user_id = payload.get("user_id")
+        if user_id is None:
+            # Token issued before user_id was a claim
+            found_user = db.query(Users).filter(Users.email == username).first()
+            if not found_user:
+                return {"messsage": "Expired token"}
+            return User(
+                email=found_user.email, role=found_user.role, user_id=found_user.user_id
+            )
+        if AUTH_STATELESS:
+            return User(email=username, role=payload.get("role"), user_id=user_id)
+
+        # The session from get_db only connects if this lookup misses
+        user = user_cache.get(str(user_id))
+        if user is None:
+            found_user = db.get(Users, user_id)
+            if not found_user:
+                return {"messsage": "Expired token"}
+            user = User(
+                email=found_user.email, role=found_user.role, user_id=found_user.user_id
+            )
+            user_cache.set(str(user_id), user)
+        return user
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
     except Exception as e:
         raise e
 
 
+def invalidate_user(user_id: int):
+    user_cache.delete(str(user_id))
+
+
 def admin_required(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admins only")
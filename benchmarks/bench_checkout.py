@@ -0,0 +1,163 @@
+# Checkout throughput on one hot variant: single-row stock decrement vs
+# sharded stock counters, under many concurrent buyers.
+#
+#   python benchmarks/bench_checkout.py --threads 64 --checkouts 4000
+#   python benchmarks/bench_checkout.py --url postgresql+psycopg2://... --shards 32
+#
+# Each checkout is one transaction: reserve 1 unit, insert the order and its
+# item, then hold the transaction open for --hold-ms to stand in for the rest
+# of create_order. Defaults to a throwaway SQLite file; SQLite serializes all
+# writers, so the sharded mode only pays off on a row-locking database.
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--url", default="sqlite:////tmp/bench_checkout.db")
+parser.add_argument("--threads", type=int, default=64)
+parser.add_argument("--checkouts", type=int, default=2000)
+parser.add_argument("--shards", type=int, default=16)
+parser.add_argument("--hold-ms", type=float, default=2.0)
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = args.url
+
+from sqlalchemy import create_engine, insert, update  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database import Base  # noqa: E402
+from models import (  # noqa: E402
+    Order,
+    OrderItem,
+    Product,
+    Users,
+    Variant,
+    VariantStockShard,
+)
+import stock_counters  # noqa: E402
+
+connect_args = {"timeout": 60} if args.url.startswith("sqlite") else {}
+engine = create_engine(
+    args.url,
+    pool_size=args.threads,
+    max_overflow=0,
+    connect_args=connect_args,
+)
+Session = sessionmaker(bind=engine, autoflush=False)
+
+
+def seed(sharded: bool):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    db = Session()
+    try:
+        db.add(Users(user_id=1, email="bench@example.com", password="", role="user"))
+        db.add(
+            Product(
+                product_id=1,
+                product_name="hot product",
+                prod_image="",
+                product_price=10,
+                product_description="",
+            )
+        )
+        db.add(
+            Variant(
+                variant_id=1,
+                product_id=1,
+                name="hot variant",
+                sku="hot",
+                price=10,
+                stock=args.checkouts,
+                available=True,
+            )
+        )
+        db.flush()
+        if sharded:
+            stock_counters.enable(db, 1, args.shards)
+        db.commit()
+    finally:
+        db.close()
+
+
+def checkout(sharded: bool) -> tuple[bool, float]:
+    db = Session()
+    start = time.perf_counter()
+    try:
+        if sharded:
+            taken = stock_counters.reserve(db, 1, 1)
+        else:
+            result = db.execute(
+                update(Variant)
+                .where(Variant.variant_id == 1, Variant.stock >= 1)
+                .values(stock=Variant.stock - 1)
+            )
+            taken = result.rowcount == 1
+        if not taken:
+            db.rollback()
+            return False, time.perf_counter() - start
+        order = Order(user_id=1, totol_amount=10, status="pending")
+        db.add(order)
+        db.flush()
+        db.execute(
+            insert(OrderItem),
+            [
+                {
+                    "order_id": order.order_id,
+                    "product_id": 1,
+                    "variant_id": 1,
+                    "quantity": 1,
+                    "price": 10,
+                }
+            ],
+        )
+        time.sleep(args.hold_ms / 1000)
+        db.commit()
+        return True, time.perf_counter() - start
+    finally:
+        db.close()
+
+
+def run(name: str, sharded: bool):
+    seed(sharded)
+    barrier = threading.Barrier(args.threads)
+
+    def buyer(_):
+        barrier.wait()
+        return [checkout(sharded) for _ in range(args.checkouts // args.threads)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = [
+            result for batch in pool.map(buyer, range(args.threads)) for result in batch
+        ]
+    elapsed = time.perf_counter() - start
+
+    db = Session()
+    try:
+        if sharded:
+            left = sum(shard.stock for shard in db.query(VariantStockShard))
+        else:
+            left = db.get(Variant, 1).stock
+        orders = db.query(OrderItem).count()
+    finally:
+        db.close()
+
+    latencies = sorted(seconds * 1000 for ok, seconds in results if ok)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(
+        f"{name:<10} {len(latencies) / elapsed:8.1f} checkouts/s "
+        f"p50={statistics.median(latencies) if latencies else 0:7.2f}ms p95={p95:7.2f}ms "
+        f"sold={orders} left={left} oversold={orders + left != args.checkouts}"
+    )
+
+
+if __name__ == "__main__":
+    run("single", sharded=False)
+    run(f"sharded/{args.shards}", sharded=True)
@@ -0,0 +1,163 @@
+# Latency of /products/query shapes against a seeded catalog, and of the
+# price-only shapes served from the in-memory price index vs the SQL path.
+#
+#   python benchmarks/bench_product_query.py --products 1000000
+#   python benchmarks/bench_product_query.py --url postgresql+psycopg2://... --products 1000000
+#
+# Defaults to a throwaway SQLite file so it runs without Postgres.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--url", default="sqlite:////tmp/bench_catalog.db")
+parser.add_argument("--products", type=int, default=1_000_000)
+parser.add_argument("--brands", type=int, default=200)
+parser.add_argument("--categories", type=int, default=50)
+parser.add_argument("--runs", type=int, default=200)
+parser.add_argument("--reseed", action="store_true")
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = args.url
+
+from sqlalchemy import func, select  # noqa: E402
+from database import Base, SessionLocal, db_engine  # noqa: E402
+from models import Brand, Category, Product, SubCategory  # noqa: E402
+import price_index  # noqa: E402
+import read_model  # noqa: E402
+from users_routes import (  # noqa: E402
+    build_product_query,
+    encode_cursor,
+    price_index_page,
+)
+
+BATCH = 10_000
+
+
+def seed():
+    Base.metadata.create_all(db_engine)
+    with db_engine.connect() as conn:
+        count = conn.execute(select(func.count()).select_from(Product)).scalar()
+    if count >= args.products and not args.reseed:
+        return
+
+    Base.metadata.drop_all(db_engine)
+    Base.metadata.create_all(db_engine)
+    with db_engine.begin() as conn:
+        conn.execute(
+            Brand.__table__.insert(),
+            [{"brand_name": f"brand-{i}"} for i in range(1, args.brands + 1)],
+        )
+        conn.execute(
+            Category.__table__.insert(),
+            [
+                {"category_name": f"category-{i}", "brand_id": 1}
+                for i in range(1, args.categories + 1)
+            ],
+        )
+        conn.execute(
+            SubCategory.__table__.insert(),
+            [
+                {"sub_category_name": f"sub-{i}", "category_id": 1, "brand_id": 1}
+                for i in range(1, args.categories * 4 + 1)
+            ],
+        )
+
+    rng = random.Random(42)
+    start = time.perf_counter()
+    for offset in range(0, args.products, BATCH):
+        rows = [
+            {
+                "product_name": f"product-{i}",
+                "prod_image": "",
+                "product_price": round(rng.uniform(1, 5000), 2),
+                "product_description": f"description {i}",
+                "brand_id": rng.randint(1, args.brands),
+                "category_id": rng.randint(1, args.categories),
+                "sub_category_id": rng.randint(1, args.categories * 4),
+            }
+            for i in range(offset, min(offset + BATCH, args.products))
+        ]
+        with db_engine.begin() as conn:
+            conn.execute(Product.__table__.insert(), rows)
+    db = SessionLocal()
+    try:
+        read_model.rebuild(db)
+    finally:
+        db.close()
+    print(f"seeded {args.products} products in {time.perf_counter() - start:.1f}s")
+
+
+def sql_page(db, **params):
+    build_product_query(db, **params).limit(51).all()
+
+
+def index_page(db, min_price=None, max_price=None, sort="price_asc", cursor=None):
+    price_index_page(db, min_price, max_price, sort, cursor, 50)
+
+
+def measure(name, run=sql_page, **filters):
+    rng = random.Random(7)
+    timings = []
+    db = SessionLocal()
+    try:
+        for _ in range(args.runs):
+            params = {
+                key: value(rng) if callable(value) else value
+                for key, value in filters.items()
+            }
+            start = time.perf_counter()
+            run(db, **params)
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        db.close()
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<34} p50={statistics.median(timings):7.2f}ms p95={p95:7.2f}ms")
+
+
+if __name__ == "__main__":
+    seed()
+    measure("first page, id order")
+    measure("price range", min_price=100, max_price=200, sort="price_asc")
+    measure("brand", brand_id=lambda r: r.randint(1, args.brands))
+    measure(
+        "brand + category + price",
+        brand_id=lambda r: r.randint(1, args.brands),
+        category_id=lambda r: r.randint(1, args.categories),
+        min_price=500,
+        max_price=2500,
+        sort="price_desc",
+    )
+    measure(
+        "subcategory, sorted by price",
+        sub_category_id=lambda r: r.randint(1, args.categories * 4),
+        sort="price_asc",
+    )
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        price_index.rebuild(db)
+        print(f"price index loaded in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
+    price_shapes = {
+        "price range": dict(min_price=100, max_price=200, sort="price_asc"),
+        "all, sorted by price desc": dict(sort="price_desc"),
+        "deep page, sorted by price": dict(
+            sort="price_asc",
+            cursor=lambda r: encode_cursor(
+                "price_asc", round(r.uniform(1, 5000), 2), 0
+            ),
+        ),
+    }
+    for name, filters in price_shapes.items():
+        measure(f"sql: {name}", **filters)
+        measure(f"index: {name}", run=index_page, **filters)
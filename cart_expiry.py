@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import func, select, update
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from models import Cart
+import cart_summary
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CART_EXPIRY_DAYS = float(os.getenv("CART_EXPIRY_DAYS", 30))
+CART_EXPIRY_INTERVAL = float(os.getenv("CART_EXPIRY_INTERVAL", 3600))
+CART_EXPIRY_BATCH = int(os.getenv("CART_EXPIRY_BATCH", 500))
+# Pause between batches, so a large backlog is drained without holding
+# locks or connections that foreground requests are waiting for
+CART_EXPIRY_PAUSE = float(os.getenv("CART_EXPIRY_PAUSE", 0.5))
+# Key of the PostgreSQL advisory lock held by the worker expiring a batch
+CART_EXPIRY_LOCK_KEY = int(os.getenv("CART_EXPIRY_LOCK_KEY", 720_018))
+
+# Counters of this worker's runs only; stats() adds the backlog, which is
+# read from the database and the same from every worker
+stats = {
+    "runs": 0,
+    "batches": 0,
+    "rows_reclaimed": 0,
+    "last_run_at": None,
+    "last_run_rows": 0,
+    "last_run_seconds": 0.0,
+}
+
+
+def expire_batch(db, cutoff: datetime) -> int:
+    # Deletes up to CART_EXPIRY_BATCH lines untouched since cutoff, oldest
+    # first, and re-derives the owners' cart summaries; one transaction.
+    # Every worker runs the task, so on PostgreSQL a batch first takes a
+    # transaction-level advisory lock and a worker that misses it skips the
+    # run; lines locked by a cart request in flight are skipped too. SQLite
+    # serializes writers on its own.
+    if db.get_bind().dialect.name == "postgresql":
+        locked = db.execute(
+            select(func.pg_try_advisory_xact_lock(CART_EXPIRY_LOCK_KEY))
+        ).scalar()
+        if not locked:
+            db.rollback()
+            return 0
+    rows = (
+        db.query(Cart.cart_id, Cart.user_id)
+        .filter(Cart.updated_at < cutoff)
+        .order_by(Cart.updated_at)
+        .limit(CART_EXPIRY_BATCH)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not rows:
+        db.rollback()
+        return 0
+    db.query(Cart).filter(Cart.cart_id.in_([row.cart_id for row in rows])).delete(
+        synchronize_session=False
+    )
+    user_ids = {row.user_id for row in rows}
+    cart_summary.refresh(db, *user_ids)
+    db.commit()
+    cart_summary.invalidate(*user_ids)
+    return len(rows)
+
+
+def expire_stale() -> int:
+    # Their holds lapsed long ago and are released by the reservation sweeper
+    start = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=CART_EXPIRY_DAYS)
+    reclaimed = 0
+    db = SessionLocal()
+    try:
+        # Lines from before updated_at existed start their clock now
+        db.execute(
+            update(Cart)
+            .where(Cart.updated_at.is_(None))
+            .values(updated_at=datetime.utcnow())
+        )
+        db.commit()
+        while True:
+            deleted = expire_batch(db, cutoff)
+            reclaimed += deleted
+            if deleted:
+                stats["batches"] += 1
+                stats["rows_reclaimed"] += deleted
+            if deleted < CART_EXPIRY_BATCH:
+                break
+            time.sleep(CART_EXPIRY_PAUSE)
+    finally:
+        db.close()
+    stats["runs"] += 1
+    stats["last_run_at"] = datetime.utcnow().isoformat()
+    stats["last_run_rows"] = reclaimed
+    stats["last_run_seconds"] = round(time.perf_counter() - start, 3)
+    return reclaimed
+
+
+def expire_stats() -> dict:
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=CART_EXPIRY_DAYS)
+        pending = db.query(func.count(Cart.cart_id)).filter(Cart.updated_at < cutoff)
+        return {**stats, "worker_pid": os.getpid(), "pending_rows": pending.scalar()}
+    finally:
+        db.close()
+
+
+async def expire_periodically():
+    while True:
+        await asyncio.sleep(CART_EXPIRY_INTERVAL)
+        try:
+            reclaimed = await run_in_threadpool(expire_stale)
+            if reclaimed:
+                logger.info("expired %d abandoned cart lines", reclaimed)
+        except Exception:
+            logger.exception("cart expiry failed")
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import delete, exists, func, literal, select
+from sqlalchemy.orm import Session
+from catalog_cache import LRUCache
+from database import dialect_insert
+from models import Cart, CartSummary, Variant
+
+load_dotenv()
+
+# invalidate() only reaches this worker's cache, so another worker can show
+# a stale badge for up to this long after a cart write
+CART_SUMMARY_TTL = float(os.getenv("CART_SUMMARY_TTL", 30))
+CART_SUMMARY_CACHE_SIZE = int(os.getenv("CART_SUMMARY_CACHE_SIZE", 10_000))
+
+# user_id -> summary dict; the cart_summaries row is the source of truth
+summaries = LRUCache(CART_SUMMARY_CACHE_SIZE, CART_SUMMARY_TTL)
+
+COLUMNS = ["user_id", "line_count", "item_count", "subtotal", "updated_at"]
+
+
+def source_query(*criteria):
+    # One aggregate row per user with cart lines matching criteria
+    return (
+        select(
+            Cart.user_id,
+            func.count(Cart.cart_id),
+            func.coalesce(func.sum(Cart.quantity), 0),
+            func.coalesce(func.sum(Variant.price * Cart.quantity), 0),
+            literal(datetime.utcnow()),
+        )
+        .join(Variant, Variant.variant_id == Cart.variant_id)
+        .where(*criteria)
+        .group_by(Cart.user_id)
+    )
+
+
+def refresh(db: Session, *user_ids: int):
+    # Re-derive the summaries of user_ids inside the caller's transaction
+    # (after its cart writes); an emptied cart leaves no row. The caller
+    # calls invalidate(*user_ids) after commit. An upsert rather than
+    # delete-and-insert, so two transactions refreshing the same user (two
+    # cart writes, or the expiry job and a cart write) cannot collide on
+    # the primary key.
+    db.flush()
+    statement = dialect_insert(db)(CartSummary).from_select(
+        COLUMNS, source_query(Cart.user_id.in_(user_ids))
+    )
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[CartSummary.user_id],
+            set_={
+                column: getattr(statement.excluded, column) for column in COLUMNS[1:]
+            },
+        )
+    )
+    db.execute(
+        delete(CartSummary).where(
+            CartSummary.user_id.in_(user_ids),
+            ~exists().where(Cart.user_id == CartSummary.user_id),
+        )
+    )
+
+
+def refresh_variant(db: Session, variant_id: int) -> list[int]:
+    # Admin price/variant changes: every cart holding the variant; returns
+    # the users to invalidate after commit
+    user_ids = [
+        user_id
+        for (user_id,) in db.query(Cart.user_id).filter(Cart.variant_id == variant_id)
+    ]
+    if user_ids:
+        refresh(db, *user_ids)
+    return user_ids
+
+
+def invalidate(*user_ids: int):
+    summaries.delete(*[str(user_id) for user_id in user_ids])
+
+
+def get(db: Session, user_id: int) -> dict:
+    summary = summaries.get(str(user_id))
+    if summary is None:
+        row = db.get(CartSummary, user_id)
+        summary = {
+            "line_count": row.line_count if row else 0,
+            "item_count": row.item_count if row else 0,
+            "subtotal": float(row.subtotal) if row else 0.0,
+            "updated_at": row.updated_at.isoformat() if row else None,
+        }
+        summaries.set(str(user_id), summary)
+    return summary
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Iterable
+from dotenv import load_dotenv
+from fastapi import Request, Response, status
+
+try:
+    import redis
+except ImportError:  # optional: only needed for CATALOG_CACHE_URL
+    redis = None
+
+load_dotenv()
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", 300))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 1024))
+CATALOG_CACHE_URL = os.getenv("CATALOG_CACHE_URL")
+
+# Counter holding the time (in microseconds) the tag versions were first
+# used. Versions start again from 0 whenever their store is new: every
+# restart for the in-process store, a flushed or replaced Redis. The epoch
+# goes into every versioned key and ETag, so a restarted counter cannot
+# reproduce a validator or cache key issued before the reset.
+EPOCH = "epoch"
+
+
+class LRUCache:
+    # Bounded in-process cache; entries expire after ttl seconds and the
+    # least recently used entry is evicted once max_entries is reached
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class MemoryBackend:
+    # Shared-backend interface implemented in process. Stands in for Redis in
+    # single-worker deployments and local development.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values: dict[str, tuple[float, str]] = {}
+        self.counters: dict[str, int] = {}
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return json.loads(entry[1])
+
+    def set(self, key: str, value, ttl: float):
+        with self.lock:
+            self.values[key] = (time.monotonic() + ttl, json.dumps(value))
+
+    def get_counters(self, names: list[str]) -> list[int]:
+        with self.lock:
+            return [self.counters.get(name, 0) for name in names]
+
+    def incr(self, name: str) -> int:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            return self.counters[name]
+
+    def set_counter(self, name: str, value: int):
+        with self.lock:
+            self.counters[name] = value
+
+    def init_counter(self, name: str, value: int) -> int:
+        with self.lock:
+            return self.counters.setdefault(name, value)
+
+
+class RedisBackend:
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("CATALOG_CACHE_URL is set but redis is not installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self.client.get(f"catalog:{key}")
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value, ttl: float):
+        self.client.set(f"catalog:{key}", json.dumps(value), ex=max(1, int(ttl)))
+
+    def get_counters(self, names: list[str]) -> list[int]:
+        values = self.client.mget([f"catalog:tag:{name}" for name in names])
+        return [int(value or 0) for value in values]
+
+    def incr(self, name: str) -> int:
+        return self.client.incr(f"catalog:tag:{name}")
+
+    def set_counter(self, name: str, value: int):
+        self.client.set(f"catalog:tag:{name}", value)
+
+    def init_counter(self, name: str, value: int) -> int:
+        # First writer wins, so every worker ends up with the same value
+        self.client.set(f"catalog:tag:{name}", value, nx=True)
+        return int(self.client.get(f"catalog:tag:{name}"))
+
+
+class CatalogCache:
+    # Read-through cache for catalog responses.
+    #
+    # Every entry is tagged ("products", "product:7", "brands", ...) and its
+    # key embeds the current version of each tag. Admin writes bump the
+    # versions of the tags they affect, so stale entries are never read again
+    # and simply age out of the LRU. With a shared backend the tag versions
+    # live there, which also invalidates the local caches of other workers.
+    # Without one the versions are per process: each worker then issues its
+    # own validators (never valid at another worker, so never a wrong 304),
+    # but writes only invalidate the worker that made them, which is why
+    # multi-worker deployments need CATALOG_CACHE_URL.
+
+    def __init__(self, local: LRUCache, shared=None):
+        self.local = local
+        self.shared = shared
+        self.versions = MemoryBackend() if shared is None else shared
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def epoch(self, value: int) -> int:
+        # value as read together with the tag versions; 0 while unset
+        if value:
+            return value
+        return self.versions.init_counter(EPOCH, time.time_ns() // 1000)
+
+    def versioned_key(self, key: str, tags: Iterable[str]) -> str:
+        tags = sorted(tags)
+        *versions, epoch = self.versions.get_counters(tags + [EPOCH])
+        stamp = ",".join(f"{tag}={version}" for tag, version in zip(tags, versions))
+        return f"{key}|{EPOCH}={self.epoch(epoch)},{stamp}"
+
+    def validators(self, key: str, tags: Iterable[str]) -> tuple[str, int]:
+        # (strong ETag, Last-Modified epoch seconds) for a response that is a
+        # pure function of its key and the catalog state its tags cover
+        tags = sorted(tags)
+        *counters, epoch = self.versions.get_counters(
+            tags + [f"{tag}:modified" for tag in tags] + [EPOCH]
+        )
+        versions, modified = counters[: len(tags)], counters[len(tags) :]
+        epoch = self.epoch(epoch)
+        stamp = ",".join(f"{tag}={version}" for tag, version in zip(tags, versions))
+        etag = hashlib.sha1(f"{key}|{EPOCH}={epoch},{stamp}".encode()).hexdigest()
+        # Tags not written since the epoch were last modified at the epoch
+        return f'"{etag}"', max(modified + [epoch // 1_000_000])
+
+    def get_or_load(self, key: str, tags: Iterable[str], loader: Callable):
+        full_key = self.versioned_key(key, tags)
+
+        value = self.local.get(full_key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(full_key)
+            if value is not None:
+                self.local.set(full_key, value)
+        if value is not None:
+            with self.lock:
+                self.hits += 1
+            return value
+
+        with self.lock:
+            self.misses += 1
+        value = loader()
+        self.local.set(full_key, value)
+        if self.shared is not None:
+            self.shared.set(full_key, value, self.local.ttl)
+        return value
+
+    def invalidate(self, *tags: str):
+        now = int(time.time())
+        for tag in tags:
+            self.versions.incr(tag)
+            self.versions.set_counter(f"{tag}:modified", now)
+        with self.lock:
+            self.invalidations += len(tags)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.shared).__name__ if self.shared else "local",
+            "entries": len(self.local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+def shared_backend(url: str | None):
+    # memory:// selects the in-process stand-in, anything else is a Redis URL
+    if not url:
+        return None
+    if url == "memory://":
+        return MemoryBackend()
+    return RedisBackend(url)
+
+
+catalog_cache = CatalogCache(
+    LRUCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL), shared_backend(CATALOG_CACHE_URL)
+)
+
+
+def cache_key(name: str, **params) -> str:
+    return name + "?" + "&".join(f"{key}={params[key]}" for key in sorted(params))
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def not_modified(
+    request: Request, response: Response, key: str, tags: Iterable[str]
+) -> Response | None:
+    # Sets ETag/Last-Modified on response and returns a 304 to send instead
+    # when the client's copy is current. Runs before any catalog query.
+    etag, modified_at = catalog_cache.validators(key, tags)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = etag_matches(if_none_match, etag)
+    else:
+        fresh = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+                fresh = modified_at <= since
+            except (TypeError, ValueError):
+                pass
+
+    if fresh:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return None
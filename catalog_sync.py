@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from models import Product, ProductReadModel
+import facet_index
+import price_index
+import search_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Other workers' admin catalog writes reach this worker's indexes this often
+CATALOG_SYNC_INTERVAL = float(os.getenv("CATALOG_SYNC_INTERVAL", 5))
+# Each poll re-reads rows stamped this far before the previous one began, so
+# a write committed late in its transaction, or stamped by a host whose
+# clock runs behind, is still picked up; reindexing a product twice is
+# harmless
+CATALOG_SYNC_OVERLAP = float(os.getenv("CATALOG_SYNC_OVERLAP", 30))
+CATALOG_SYNC_BATCH = int(os.getenv("CATALOG_SYNC_BATCH", 1000))
+
+# The price, search and facet indexes live in each worker, and an admin
+# write patches only the worker that handled it. Every write that changes
+# what they index re-syncs the product's read-model row, which stamps its
+# updated_at, so the other workers find changed products by polling the
+# read model. Deleted products have no row left to stamp: they show up as a
+# change in the read model's id count or sum, and only then are the ids
+# compared in full.
+
+synced_at = datetime.utcnow()
+
+
+def reindex(db: Session, product_ids):
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), CATALOG_SYNC_BATCH):
+        batch = Product.product_id.in_(product_ids[start : start + CATALOG_SYNC_BATCH])
+        search_index.reindex_products(db, batch)
+        facet_index.reindex_products(db, batch)
+        price_index.reindex_products(db, batch)
+
+
+def remove(product_ids):
+    for product_id in product_ids:
+        search_index.remove_product(product_id)
+        facet_index.remove_product(product_id)
+        price_index.remove_product(product_id)
+
+
+def sync(db: Session):
+    global synced_at
+    started = datetime.utcnow()
+    since = synced_at - timedelta(seconds=CATALOG_SYNC_OVERLAP)
+    changed = [
+        product_id
+        for (product_id,) in db.query(ProductReadModel.product_id).filter(
+            ProductReadModel.updated_at > since
+        )
+    ]
+    reindex(db, changed)
+
+    count, total = db.query(
+        func.count(ProductReadModel.product_id),
+        func.coalesce(func.sum(ProductReadModel.product_id), 0),
+    ).one()
+    known = price_index.price_index.product_ids()
+    if count != len(known) or total != sum(known):
+        stored = {product_id for (product_id,) in db.query(ProductReadModel.product_id)}
+        remove(known - stored)
+        reindex(db, stored - known)
+
+    search_index.sync_taxonomy(db)
+    synced_at = started
+
+
+def sync_once():
+    db = SessionLocal()
+    try:
+        sync(db)
+    finally:
+        db.close()
+
+
+async def sync_periodically():
+    while True:
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
+        try:
+            await run_in_threadpool(sync_once)
+        except Exception:
+            logger.exception("catalog index sync failed")
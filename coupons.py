@@ -0,0 +1,437 @@
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import (
+    column,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    table,
+    text,
+    true,
+    update,
+)
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from catalog_cache import LRUCache
+from database import SessionLocal, dialect_insert
+from models import Coupon, CouponUsage, Order
+
+load_dotenv()
+
+COUPON_CACHE_TTL = float(os.getenv("COUPON_CACHE_TTL", 60))
+COUPON_CACHE_SIZE = int(os.getenv("COUPON_CACHE_SIZE", 10_000))
+# False-positive rate of the code filter while it holds at most its capacity
+# (twice the codes at the last full rebuild): with the default 0.001 about
+# one random code in a thousand gets through to the database
+COUPON_FILTER_FP_RATE = float(os.getenv("COUPON_FILTER_FP_RATE", 0.001))
+# Other workers' admin writes reach this worker's filter on the next refresh
+COUPON_FILTER_REFRESH = float(os.getenv("COUPON_FILTER_REFRESH", 60))
+COUPON_BULK_BATCH = int(os.getenv("COUPON_BULK_BATCH", 50_000))
+# Coupon ids become visible at commit, not in id order, so each refresh
+# re-reads this many ids below the highest one it has seen; it covers a
+# create committing behind a whole bulk batch
+COUPON_FILTER_OVERLAP = int(os.getenv("COUPON_FILTER_OVERLAP", 2 * COUPON_BULK_BATCH))
+# Per-connection temporary table bulk_create loads each batch of codes into
+CODE_STAGING = "coupon_code_staging"
+
+# Generated code symbols: 32 of them (5 bits each), without 0/O and 1/I
+CODE_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+
+logger = logging.getLogger(__name__)
+
+# coupon_usage row counting a coupon's uses by everyone
+ALL_USERS = 0
+
+
+class CompiledCoupon(NamedTuple):
+    # Detached copy of a Coupon row, safe to share between requests
+    coupon_id: int
+    code: str
+    discount_type: str
+    discount_value: float
+    min_order_amount: Optional[float]
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    usage_limit: Optional[int]
+    usage_per_user: Optional[int]
+    is_active: bool
+
+
+class BloomFilter:
+    # Set membership with no false negatives: m bits and k hash positions per
+    # key, m = -n ln(p) / ln(2)^2 and k = (m / n) ln(2) for n keys at false
+    # positive rate p. The k positions come from the two halves of one
+    # blake2b digest (h1 + i * h2 mod 2^64), so a lookup hashes the key once.
+    # add_many computes the same positions with numpy for bulk loads.
+
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [
+            ((h1 + i * h2) & 0xFFFFFFFFFFFFFFFF) % self.size for i in range(self.hashes)
+        ]
+
+    def add(self, key: str):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add_many(
+        self, keys: list[str], chunk: int = 100_000, new: Optional[int] = None
+    ):
+        # new: how many of keys are not in the filter yet, when some are
+        marked = np.unpackbits(
+            np.frombuffer(self.bits, np.uint8), count=self.size, bitorder="little"
+        ).astype(bool)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        for start in range(0, len(keys), chunk):
+            digests = np.frombuffer(
+                b"".join(
+                    hashlib.blake2b(key.encode(), digest_size=16).digest()
+                    for key in keys[start : start + chunk]
+                ),
+                dtype="<u8",
+            ).reshape(-1, 2)
+            h1, h2 = digests[:, :1], digests[:, 1:] | np.uint64(1)
+            marked[(h1 + steps * h2) % np.uint64(self.size)] = True
+        self.bits = bytearray(np.packbits(marked, bitorder="little").tobytes())
+        self.count += len(keys) if new is None else new
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key)
+        )
+
+
+# Codes of all coupons, active or not, so a reactivated coupon never needs
+# adding back (get() returns is_active for the caller to check). None until
+# the first rebuild, which lets every code through. Deleted codes stay until
+# the next full rebuild and only get through to the database lookup.
+code_filter: Optional[BloomFilter] = None
+# Highest coupon_id the filter has loaded
+filter_last_id = 0
+
+
+def rebuild_filter(db: Session):
+    global code_filter, filter_last_id
+    rows = db.query(Coupon.coupon_id, Coupon.code).all()
+    rebuilt = BloomFilter(2 * len(rows), COUPON_FILTER_FP_RATE)
+    rebuilt.add_many([code for _, code in rows])
+    code_filter = rebuilt
+    filter_last_id = max((coupon_id for coupon_id, _ in rows), default=0)
+
+
+def extend_filter(db: Session):
+    # Loads only the codes added since the last refresh; the filter is
+    # rebuilt in full once they would take it past its capacity
+    global filter_last_id
+    if code_filter is None:
+        return rebuild_filter(db)
+    rows = (
+        db.query(Coupon.coupon_id, Coupon.code)
+        .filter(Coupon.coupon_id > filter_last_id - COUPON_FILTER_OVERLAP)
+        .all()
+    )
+    new = sum(1 for coupon_id, _ in rows if coupon_id > filter_last_id)
+    if not new:
+        return
+    if code_filter.count + new > code_filter.capacity:
+        return rebuild_filter(db)
+    code_filter.add_many([code for _, code in rows], new=new)
+    filter_last_id = max(coupon_id for coupon_id, _ in rows)
+
+
+def add_codes(*codes: str):
+    # New codes become usable on this worker before the next refresh
+    if code_filter is not None:
+        for code in codes:
+            code_filter.add(code)
+
+
+def might_exist(code: str) -> bool:
+    return code_filter is None or code in code_filter
+
+
+def known_code(code: str) -> str:
+    # Dependency declared ahead of get_db: codes that cannot exist are turned
+    # away before a session is opened or the token's user is loaded
+    if not might_exist(code):
+        raise HTTPException(status_code=404, detail="Coupon not found")
+    return code
+
+
+def refresh_filter():
+    db = SessionLocal()
+    try:
+        extend_filter(db)
+    finally:
+        db.close()
+
+
+async def refresh_filter_periodically():
+    while True:
+        await asyncio.sleep(COUPON_FILTER_REFRESH)
+        try:
+            await run_in_threadpool(refresh_filter)
+        except Exception:
+            logger.exception("coupon filter refresh failed")
+
+
+# Coupon.code -> CompiledCoupon; admin writes invalidate, the TTL bounds how
+# long other workers can serve an edited coupon
+compiled = LRUCache(COUPON_CACHE_SIZE, COUPON_CACHE_TTL)
+
+
+def get(db: Session, code: str) -> Optional[CompiledCoupon]:
+    if not might_exist(code):
+        return None
+    coupon = compiled.get(code)
+    if coupon is None:
+        row = db.query(Coupon).filter(Coupon.code == code).first()
+        if row is None:
+            return None
+        coupon = CompiledCoupon(
+            coupon_id=row.coupon_id,
+            code=row.code,
+            discount_type=row.discount_type,
+            discount_value=row.discount_value,
+            min_order_amount=row.min_order_amount,
+            start_date=row.start_date,
+            end_date=row.end_date,
+            usage_limit=row.usage_limit,
+            usage_per_user=row.usage_per_user,
+            is_active=row.is_active,
+        )
+        compiled.set(code, coupon)
+    return coupon
+
+
+def invalidate(*codes: str):
+    compiled.delete(*codes)
+
+
+def usage(db: Session, coupon_id: int, user_id: int) -> tuple[int, int]:
+    # (uses by everyone, uses by user_id) in one primary-key lookup
+    used = dict(
+        db.query(CouponUsage.user_id, CouponUsage.used).filter(
+            CouponUsage.coupon_id == coupon_id,
+            CouponUsage.user_id.in_([ALL_USERS, user_id]),
+        )
+    )
+    return used.get(ALL_USERS, 0), used.get(user_id, 0)
+
+
+def count_use(db: Session, coupon: CompiledCoupon, user_id: int) -> bool:
+    # Increments both counters in the caller's order transaction, each only
+    # while under its limit; False when a concurrent order took the last use
+    # (the caller rolls back). Called last before commit, so the coupon's
+    # total row stays locked as briefly as possible.
+    for counter, limit in (
+        (ALL_USERS, coupon.usage_limit),
+        (user_id, coupon.usage_per_user),
+    ):
+        statement = dialect_insert(db)(CouponUsage).values(
+            coupon_id=coupon.coupon_id, user_id=counter, used=1
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[CouponUsage.coupon_id, CouponUsage.user_id],
+            set_={"used": CouponUsage.used + 1},
+            where=CouponUsage.used < limit if limit is not None else None,
+        )
+        if db.execute(statement).rowcount != 1:
+            return False
+    return True
+
+
+def release_use(db: Session, coupon_id: int, user_id: int):
+    # A deleted order gives its use back
+    db.execute(
+        update(CouponUsage)
+        .where(
+            CouponUsage.coupon_id == coupon_id,
+            CouponUsage.user_id.in_([ALL_USERS, user_id]),
+            CouponUsage.used > 0,
+        )
+        .values(used=CouponUsage.used - 1)
+    )
+
+
+def rebuild(db: Session):
+    # Recounts every coupon from orders
+    used = func.count(Order.order_id)
+    db.execute(delete(CouponUsage))
+    db.execute(
+        insert(CouponUsage).from_select(
+            ["coupon_id", "user_id", "used"],
+            select(Order.coupon_id, literal(ALL_USERS), used)
+            .where(Order.coupon_id.is_not(None))
+            .group_by(Order.coupon_id),
+        )
+    )
+    db.execute(
+        insert(CouponUsage).from_select(
+            ["coupon_id", "user_id", "used"],
+            select(Order.coupon_id, Order.user_id, used)
+            .where(Order.coupon_id.is_not(None))
+            .group_by(Order.coupon_id, Order.user_id),
+        )
+    )
+    db.commit()
+
+
+def ensure_built(db: Session):
+    # Startup check: orders placed before the counters existed are counted
+    # once
+    counted = db.scalar(select(func.count()).select_from(CouponUsage))
+    if not counted and db.query(Order).filter(Order.coupon_id.is_not(None)).first():
+        rebuild(db)
+
+
+class CodePermutation:
+    # Keyed bijection of [0, 32^length): a 4-round Feistel network over the
+    # code's 5 * length bits (cycle-walking when that is odd). Consecutive
+    # indices map to distinct, unordered codes, so a run of n codes needs no
+    # set of issued codes and no duplicate checks. A fresh random key per run
+    # keeps the codes unguessable from one another.
+
+    ROUNDS = 4
+
+    def __init__(self, length: int, key: bytes):
+        self.length = length
+        self.domain = 32**length
+        self.half = (5 * length + 1) // 2
+        self.mask = np.uint64((1 << self.half) - 1)
+        self.keys = np.frombuffer(
+            hashlib.blake2b(key, digest_size=8 * self.ROUNDS).digest(), dtype="<u8"
+        )
+
+    def round(self, right, key):
+        mixed = (right ^ key) * np.uint64(0x9E3779B97F4A7C15)
+        return (mixed ^ (mixed >> np.uint64(29))) & self.mask
+
+    def encrypt(self, values):
+        shift = np.uint64(self.half)
+        left, right = values >> shift, values & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self.round(right, key)
+        return (left << shift) | right
+
+    def permute(self, indices):
+        values = self.encrypt(indices)
+        outside = values >= np.uint64(self.domain)
+        while outside.any():
+            values[outside] = self.encrypt(values[outside])
+            outside = values >= np.uint64(self.domain)
+        return values
+
+    def codes(self, prefix: str, start: int, stop: int) -> list[str]:
+        values = self.permute(np.arange(start, stop, dtype=np.uint64))
+        shifts = np.arange(5 * (self.length - 1), -1, -5, dtype=np.uint64)
+        digits = (values[:, None] >> shifts) & np.uint64(31)
+        alphabet = np.frombuffer(CODE_ALPHABET.encode(), np.uint8)
+        raw = alphabet[digits].tobytes().decode()
+        length = self.length
+        return [prefix + raw[at : at + length] for at in range(0, len(raw), length)]
+
+
+def stage_codes(db: Session, codes: list[str]):
+    # Loads codes into the session's staging table by the driver's fastest
+    # route, COPY on PostgreSQL and a plain DB-API executemany elsewhere.
+    # Both skip SQLAlchemy's per-row parameter processing, which is most of
+    # the cost of an ORM or Core executemany at millions of rows.
+    connection = db.connection()
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == "postgresql":
+            data = "\n".join(codes) + "\n"
+            copy = f"COPY {CODE_STAGING} (code) FROM STDIN"
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                cursor.copy_expert(copy, io.StringIO(data))
+            else:  # psycopg 3
+                with cursor.copy(copy) as stream:
+                    stream.write(data)
+        else:
+            marker = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+            cursor.executemany(
+                f"INSERT INTO {CODE_STAGING} (code) VALUES ({marker})",
+                [(code,) for code in codes],
+            )
+    finally:
+        cursor.close()
+
+
+def bulk_create(
+    db: Session, prefix: str, count: int, length: int, template: dict
+) -> tuple[int, float]:
+    # Streams count new coupons sharing template's columns into coupons,
+    # COUPON_BULK_BATCH codes at a time: each batch is generated, staged,
+    # copied into coupons by one INSERT ... SELECT and committed, so a run of
+    # millions of codes never holds one long transaction. A code that already
+    # exists (from an earlier run with the same prefix) is skipped by ON
+    # CONFLICT DO NOTHING; the insert's rowcount says how many were, and later
+    # batches draw further permutation indices to make them up. A failed run
+    # keeps the batches committed before it. -> (created, seconds)
+    start = time.perf_counter()
+    permutation = CodePermutation(length, secrets.token_bytes(16))
+    staging = table(CODE_STAGING, column("code"))
+    columns = Coupon.__table__.c
+    copy = (
+        dialect_insert(db)(Coupon)
+        .from_select(
+            ["code", *template],
+            select(
+                staging.c.code,
+                *[
+                    literal(value, columns[name].type)
+                    for name, value in template.items()
+                ],
+            )
+            # WHERE keeps SQLite from reading ON CONFLICT as a join clause
+            .where(true()).order_by(staging.c.code),
+        )
+        .on_conflict_do_nothing(index_elements=[Coupon.code])
+    )
+    created = 0
+    issued = 0
+    while created < count:
+        size = min(COUPON_BULK_BATCH, count - created)
+        if issued + size > permutation.domain:
+            raise HTTPException(
+                status_code=400, detail="Not enough codes of this length left"
+            )
+        # Each commit may hand the session a different pooled connection,
+        # so the staging table is made sure of per batch
+        db.execute(
+            text(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {CODE_STAGING} (code VARCHAR(64))"
+            )
+        )
+        stage_codes(db, permutation.codes(prefix, issued, issued + size))
+        created += db.execute(copy).rowcount
+        db.execute(staging.delete())
+        db.commit()
+        issued += size
+    return created, time.perf_counter() - start
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker,declarative_base
 from dotenv import load_dotenv
 import os
@@ -22,3 +23,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+
+def dialect_insert(db):
+    # INSERT with ON CONFLICT support: PostgreSQL in production, SQLite locally
+    return (postgresql if db.get_bind().dialect.name == "postgresql" else sqlite).insert
@@ -0,0 +1,266 @@
+import threading
+from typing import Iterable
+import numpy as np
+from sqlalchemy.orm import Session
+from models import Product, ProductAssignment, Term
+
+# facet -> Product column; "term" is multi-valued and comes from ProductAssignment
+FACET_COLUMNS = {
+    "brand": Product.brand_id,
+    "category": Product.category_id,
+    "subcategory": Product.sub_category_id,
+}
+FACETS = tuple(FACET_COLUMNS) + ("term",)
+
+INITIAL_WORDS = 64  # 4096 product slots
+INITIAL_ROWS = 16
+# Upper bound on the temporary (values x words) block ANDed per count step
+COUNT_CHUNK_WORDS = 1 << 22
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+else:  # numpy < 2.0
+    BYTE_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], np.uint8)
+
+    def popcount(words: np.ndarray) -> np.ndarray:
+        return BYTE_POPCOUNT[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def slot_bits(slots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # slot -> (word index, single-bit mask within that word)
+    slots = np.asarray(slots, dtype=np.int64)
+    return slots >> 6, np.left_shift(np.uint64(1), (slots & 63).astype(np.uint64))
+
+
+class Facet:
+    # One packed bitset per facet value, stored as the rows of a single
+    # (values x words) uint64 matrix so counts for every value are one
+    # vectorized AND + popcount
+
+    def __init__(self, words: int):
+        self.rows: dict[int, int] = {}
+        self.values: list[int] = []
+        self.matrix = np.zeros((INITIAL_ROWS, words), dtype=np.uint64)
+
+    def row(self, value: int) -> int:
+        row = self.rows.get(value)
+        if row is None:
+            row = len(self.values)
+            if row == self.matrix.shape[0]:
+                grown = np.zeros((row * 2, self.matrix.shape[1]), dtype=np.uint64)
+                grown[:row] = self.matrix
+                self.matrix = grown
+            self.rows[value] = row
+            self.values.append(value)
+        return row
+
+    def widen(self, words: int):
+        grown = np.zeros((self.matrix.shape[0], words), dtype=np.uint64)
+        grown[:, : self.matrix.shape[1]] = self.matrix
+        self.matrix = grown
+
+    def union(self, values: Iterable[int], words: int) -> np.ndarray:
+        rows = [self.rows[value] for value in values if value in self.rows]
+        if not rows:
+            return np.zeros(words, dtype=np.uint64)
+        return np.bitwise_or.reduce(self.matrix[rows], axis=0)
+
+    def counts(self, within: np.ndarray) -> dict[int, int]:
+        used = len(self.values)
+        step = max(1, COUNT_CHUNK_WORDS // max(1, within.size))
+        matrix = self.matrix[:used]
+        counts = np.empty(used, dtype=np.int64)
+        for start in range(0, used, step):
+            block = matrix[start : start + step] & within
+            counts[start : start + step] = popcount(block)
+        return {
+            self.values[row]: int(count) for row, count in enumerate(counts) if count
+        }
+
+
+class FacetIndex:
+    # Products occupy slots (bit positions); a product's facet values are the
+    # rows with its bit set. Filters OR the selected values of a facet and AND
+    # across facets; each facet is counted against the filters of the others,
+    # so picking one brand still reports the counts of the remaining brands.
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.words = INITIAL_WORDS
+            self.slots: dict[int, int] = {}
+            self.free: list[int] = []
+            self.product_ids = np.zeros(self.words * 64, dtype=np.int64)
+            self.alive = np.zeros(self.words, dtype=np.uint64)
+            self.facets = {facet: Facet(self.words) for facet in FACETS}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def reserve(self, slots: int):
+        words = self.words
+        while words * 64 < slots:
+            words *= 2
+        if words == self.words:
+            return
+        product_ids = np.zeros(words * 64, dtype=np.int64)
+        product_ids[: self.product_ids.size] = self.product_ids
+        alive = np.zeros(words, dtype=np.uint64)
+        alive[: self.words] = self.alive
+        for facet in self.facets.values():
+            facet.widen(words)
+        self.words, self.product_ids, self.alive = words, product_ids, alive
+
+    def clear_slot(self, slot: int):
+        word, bit = slot_bits(slot)
+        for facet in self.facets.values():
+            facet.matrix[:, word] &= ~bit
+
+    def set_product(self, product_id: int, values: dict[str, Iterable[int]]):
+        with self.lock:
+            slot = self.slots.get(product_id)
+            if slot is None:
+                slot = self.free.pop() if self.free else len(self.slots)
+                self.reserve(slot + 1)
+                self.slots[product_id] = slot
+                self.product_ids[slot] = product_id
+            else:
+                self.clear_slot(slot)
+            word, bit = slot_bits(slot)
+            self.alive[word] |= bit
+            for name, facet_values in values.items():
+                facet = self.facets[name]
+                for value in facet_values:
+                    if value is not None:
+                        facet.matrix[facet.row(value), word] |= bit
+
+    def remove(self, product_id: int):
+        with self.lock:
+            slot = self.slots.pop(product_id, None)
+            if slot is None:
+                return
+            self.clear_slot(slot)
+            word, bit = slot_bits(slot)
+            self.alive[word] &= ~bit
+            self.free.append(slot)
+
+    def remove_value(self, name: str, value: int):
+        with self.lock:
+            facet = self.facets[name]
+            if value in facet.rows:
+                facet.matrix[facet.rows[value]] = 0
+
+    def load(self, product_ids: np.ndarray, values: dict[str, tuple]):
+        # Bulk build: values[name] = (owning product ids, facet values), two
+        # parallel sequences; slots are assigned in product_ids order
+        with self.lock:
+            self.clear()
+            self.reserve(len(product_ids))
+            slots = np.arange(len(product_ids), dtype=np.int64)
+            self.slots = dict(zip(product_ids.tolist(), slots.tolist()))
+            self.product_ids[: len(product_ids)] = product_ids
+            word, bit = slot_bits(slots)
+            np.bitwise_or.at(self.alive, word, bit)
+
+            order = np.argsort(product_ids)
+            for name, (owners, facet_values) in values.items():
+                facet = self.facets[name]
+                owners = np.asarray(owners, dtype=np.int64)
+                facet_values = np.asarray(facet_values, dtype=object)
+                present = np.not_equal(facet_values, None)
+                owners = owners[present]
+                facet_values = facet_values[present].astype(np.int64)
+                if not owners.size or not product_ids.size:
+                    continue
+                positions = np.searchsorted(product_ids, owners, sorter=order)
+                owner_slots = order[np.minimum(positions, len(order) - 1)]
+                known = product_ids[owner_slots] == owners
+                unique, inverse = np.unique(facet_values[known], return_inverse=True)
+                rows = np.array(
+                    [facet.row(value) for value in unique.tolist()], dtype=np.int64
+                )
+                word, bit = slot_bits(owner_slots[known])
+                np.bitwise_or.at(facet.matrix, (rows[inverse], word), bit)
+
+    def unpack(self, words: np.ndarray) -> np.ndarray:
+        bits = np.unpackbits(words.astype("<u8").view(np.uint8), bitorder="little")
+        return np.flatnonzero(bits)
+
+    def search(
+        self, selected: dict[str, Iterable[int]]
+    ) -> tuple[np.ndarray, dict[str, dict[int, int]]]:
+        # -> (sorted matching product ids, facet -> {value: count})
+        with self.lock:
+            masks = {
+                name: self.facets[name].union(values, self.words)
+                for name, values in selected.items()
+                if values
+            }
+            matched = self.alive.copy()
+            for mask in masks.values():
+                matched &= mask
+
+            counts = {}
+            for name, facet in self.facets.items():
+                within = self.alive.copy()
+                for other, mask in masks.items():
+                    if other != name:
+                        within &= mask
+                counts[name] = facet.counts(within)
+
+            product_ids = np.sort(self.product_ids[self.unpack(matched)])
+        return product_ids, counts
+
+
+facet_index = FacetIndex()
+
+
+def load_values(db: Session, *criteria):
+    products = db.query(Product.product_id, *FACET_COLUMNS.values())
+    terms = (
+        db.query(ProductAssignment.product_id, ProductAssignment.term_id)
+        .join(Product, Product.product_id == ProductAssignment.product_id)
+        .join(Term, Term.term_id == ProductAssignment.term_id)
+    )
+    if criteria:
+        products = products.filter(*criteria)
+        terms = terms.filter(*criteria)
+    return products.all(), terms.all()
+
+
+def rebuild(db: Session):
+    products, terms = load_values(db)
+    product_ids = np.array([row[0] for row in products], dtype=np.int64)
+    values = {
+        name: (product_ids.tolist(), [row[column + 1] for row in products])
+        for column, name in enumerate(FACET_COLUMNS)
+    }
+    values["term"] = ([row[0] for row in terms], [row[1] for row in terms])
+    facet_index.load(product_ids, values)
+
+
+def reindex_products(db: Session, *criteria):
+    # Called after admin writes; criteria select the affected products
+    products, terms = load_values(db, *criteria)
+    assigned = {}
+    for product_id, term_id in terms:
+        assigned.setdefault(product_id, []).append(term_id)
+    for row in products:
+        values = {name: [row[column + 1]] for column, name in enumerate(FACET_COLUMNS)}
+        values["term"] = assigned.get(row[0], [])
+        facet_index.set_product(row[0], values)
+
+
+def remove_product(product_id: int):
+    facet_index.remove(product_id)
+
+
+def remove_term(term_id: int):
+    # Assignments of a deleted term stay behind; rebuild skips them too
+    facet_index.remove_value("term", term_id)
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from catalog_cache import LRUCache
+from models import IdempotencyKey
+
+load_dotenv()
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10_000))
+
+# (user_id, endpoint, key) -> (request hash, status code, body); the table is
+# the source of truth, this only saves the lookup query on hot retries
+stored_responses = LRUCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+
+def fingerprint(payload) -> str:
+    raw = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def entry_key(user_id: int, endpoint: str, key: str) -> str:
+    return f"{user_id}|{endpoint}|{key}"
+
+
+def replay(entry: tuple, request_hash: str) -> JSONResponse:
+    stored_hash, status_code, content = entry
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request",
+        )
+    return JSONResponse(
+        status_code=status_code,
+        content=content,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def lookup(
+    db: Session, user_id: int, endpoint: str, key: Optional[str], request_hash: str
+) -> JSONResponse | None:
+    # The stored response for a retried request, or None to run it
+    if key is None:
+        return None
+    cache_key = entry_key(user_id, endpoint, key)
+    entry = stored_responses.get(cache_key)
+    if entry is None:
+        row = (
+            db.query(IdempotencyKey)
+            .filter(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.endpoint == endpoint,
+                IdempotencyKey.key == key,
+            )
+            .first()
+        )
+        if row is None:
+            return None
+        remaining = (
+            row.created_at + timedelta(seconds=IDEMPOTENCY_TTL) - datetime.utcnow()
+        ).total_seconds()
+        if remaining <= 0:
+            # Expired: the key may be used again. Flushed now so the DELETE
+            # runs before this request's INSERT of the same key.
+            db.delete(row)
+            db.flush()
+            return None
+        entry = (row.request_hash, row.status_code, json.loads(row.response_body))
+        # Cached only for what is left of the key's TTL, so it expires here
+        # when it does in the table
+        stored_responses.set(cache_key, entry, ttl=remaining)
+    return replay(entry, request_hash)
+
+
+def commit(
+    db: Session,
+    user_id: int,
+    endpoint: str,
+    key: Optional[str],
+    request_hash: str,
+    status_code: int,
+    content: dict,
+) -> JSONResponse:
+    # Commits the caller's transaction together with the stored response, so
+    # either both the work and its record exist or neither does
+    if key is not None:
+        db.add(
+            IdempotencyKey(
+                user_id=user_id,
+                endpoint=endpoint,
+                key=key,
+                request_hash=request_hash,
+                status_code=status_code,
+                response_body=json.dumps(content),
+            )
+        )
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key committed first: drop this
+        # attempt's work and answer with the winner's response
+        db.rollback()
+        replayed = lookup(db, user_id, endpoint, key, request_hash)
+        if replayed is None:
+            raise
+        return replayed
+    if key is not None:
+        stored_responses.set(
+            entry_key(user_id, endpoint, key), (request_hash, status_code, content)
+        )
+    return JSONResponse(status_code=status_code, content=content)
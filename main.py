@@ -1,10 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from database import Base,db_engine
+from database import Base, SessionLocal, db_engine
 from admin_routes import admin_router
 from users_routes import user_router
-
-
-app =  FastAPI()
+import cart_expiry
+import catalog_sync
+import coupons
+import facet_index
+import passwords
+import price_index
+import read_model
+import reservations
+import revocation
+import search_index
+import session_log
+import stock_counters
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = SessionLocal()
+    try:
+        read_model.ensure_built(db)
+        search_index.rebuild(db)
+        facet_index.rebuild(db)
+        price_index.rebuild(db)
+        coupons.ensure_built(db)
+        coupons.rebuild_filter(db)
+        revocation.rebuild(db)
+        reservations.sync(db)
+    finally:
+        db.close()
+    passwords.password_pool.start()
+    rebalancer = asyncio.create_task(stock_counters.rebalance_periodically())
+    sweeper = asyncio.create_task(reservations.sweep_periodically())
+    hold_sync = asyncio.create_task(reservations.sync_periodically())
+    cart_expirer = asyncio.create_task(cart_expiry.expire_periodically())
+    index_sync = asyncio.create_task(catalog_sync.sync_periodically())
+    coupon_filter = asyncio.create_task(coupons.refresh_filter_periodically())
+    revocation_sync = asyncio.create_task(revocation.sync_periodically())
+    revocation_purge = asyncio.create_task(revocation.purge_periodically())
+    session_writer = asyncio.create_task(session_log.write_periodically())
+    yield
+    rebalancer.cancel()
+    sweeper.cancel()
+    hold_sync.cancel()
+    cart_expirer.cancel()
+    index_sync.cancel()
+    coupon_filter.cancel()
+    revocation_sync.cancel()
+    revocation_purge.cancel()
+    session_writer.cancel()
+    # Graceful shutdown: write whatever logins are still queued
+    session_log.flush()
+    passwords.password_pool.shutdown()
+
+
+app =  FastAPI(lifespan=lifespan)
 
 
 Base.metadata.create_all(db_engine)
@@ -10,6 +10,9 @@ from sqlalchemy import (
     ForeignKey,
     Boolean,
     Text,
+    Index,
+    UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -17,7 +20,9 @@ from sqlalchemy.orm import relationship
 class Users(Base):
     __tablename__ = "users"
     user_id = Column(Integer, primary_key=True, index=True)
-    email = Column(String)
+    # The email index postdates existing databases, which need
+    #   CREATE INDEX ix_users_email ON users (email);
+    email = Column(String, index=True)
     password = Column(String)
     role = Column(String, default="user")
 
@@ -74,6 +79,78 @@ class Product(Base):
     brand = relationship("Brand", back_populates="products")
     sub_category = relationship("SubCategory", back_populates="products")
     category = relationship("Category", back_populates="products")
+    # passive_deletes="all": deleting a product leaves its variant/assignment
+    # rows untouched, as before these collections existed
+    variants = relationship("Variant", passive_deletes="all")
+    assignments = relationship("ProductAssignment", passive_deletes="all")
+
+    # Composite indexes for /products/query: equality filters first, then the
+    # price range/sort column, with product_id as the keyset tie-breaker
+    __table_args__ = (
+        Index(
+            "ix_products_brand_category_price",
+            "brand_id",
+            "category_id",
+            "product_price",
+            "product_id",
+        ),
+        Index(
+            "ix_products_category_price", "category_id", "product_price", "product_id"
+        ),
+        Index(
+            "ix_products_subcategory_price",
+            "sub_category_id",
+            "product_price",
+            "product_id",
+        ),
+        Index("ix_products_price", "product_price", "product_id"),
+    )
+
+
+class ProductReadModel(Base):
+    # Denormalized storefront view of a product: taxonomy names and variant
+    # aggregates are copied in by read_model.sync_products whenever an admin
+    # write touches the product, its variants or its brand/category/subcategory
+    __tablename__ = "product_read_model"
+    product_id = Column(Integer, primary_key=True)
+    product_name = Column(String(50), nullable=False)
+    prod_image = Column(String, nullable=False)
+    product_price = Column(Float, nullable=False)
+    product_description = Column(Text, nullable=False)
+    brand_id = Column(Integer)
+    brand_name = Column(String)
+    category_id = Column(Integer)
+    category_name = Column(String(50))
+    sub_category_id = Column(Integer)
+    sub_category_name = Column(String(50))
+    min_variant_price = Column(Numeric(10, 2))
+    max_variant_price = Column(Numeric(10, 2))
+    total_stock = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    # ix_read_model_updated_at postdates existing databases, which need
+    #   CREATE INDEX ix_read_model_updated_at ON product_read_model (updated_at);
+    __table_args__ = (
+        Index(
+            "ix_read_model_brand_category_price",
+            "brand_id",
+            "category_id",
+            "product_price",
+            "product_id",
+        ),
+        Index(
+            "ix_read_model_category_price", "category_id", "product_price", "product_id"
+        ),
+        Index(
+            "ix_read_model_subcategory_price",
+            "sub_category_id",
+            "product_price",
+            "product_id",
+        ),
+        Index("ix_read_model_price", "product_price", "product_id"),
+        # Polled by catalog_sync for products changed by other workers
+        Index("ix_read_model_updated_at", "updated_at"),
+    )
 
 
 class Attribute(Base):
@@ -88,18 +165,22 @@ class Term(Base):
     value = Column(String, nullable=False)  # e.g., Black, Pro
     attribute_id = Column(Integer, ForeignKey("attributes.attribute_id"))
 
+    attribute = relationship("Attribute")
+
 
 class ProductAssignment(Base):
     __tablename__ = "product_assignments"
     assignment_id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.product_id"))
+    product_id = Column(Integer, ForeignKey("products.product_id"), index=True)
     term_id = Column(Integer, ForeignKey("terms.term_id"), nullable=False)
 
+    term = relationship("Term")
+
 
 class Variant(Base):
     __tablename__ = "variants"
     variant_id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.product_id"))
+    product_id = Column(Integer, ForeignKey("products.product_id"), index=True)
     name = Column(String, nullable=False)  # e.g., "Black Pro 128GB"
     sku = Column(String, unique=True, nullable=False)
     price = Column(Numeric(10, 2), nullable=False)
@@ -107,6 +188,49 @@ class Variant(Base):
     available = Column(Boolean, default=True)
 
 
+class VariantStockShard(Base):
+    # Sub-counters of a variant in sharded-counter mode (see stock_counters);
+    # while a variant has shard rows they, not Variant.stock, hold its stock
+    __tablename__ = "variant_stock_shards"
+    variant_id = Column(Integer, ForeignKey("variants.variant_id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
+
+class StockReservation(Base):
+    # Append-only ledger of cart holds: a "hold" row opens a hold and a later
+    # "release", "expire" or "checkout" row with the same hold_id closes it
+    __tablename__ = "stock_reservations"
+    reservation_id = Column(Integer, primary_key=True)
+    hold_id = Column(String(32), nullable=False, index=True)
+    entry = Column(String(16), nullable=False)
+    variant_id = Column(Integer, ForeignKey("variants.variant_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Existing databases need the last two indexes created by hand (after
+    # deleting any duplicate closing rows for the unique one):
+    #   CREATE INDEX ix_stock_reservations_variant_expiry
+    #     ON stock_reservations (variant_id, expires_at);
+    #   CREATE UNIQUE INDEX uq_stock_reservations_closing
+    #     ON stock_reservations (hold_id) WHERE entry <> 'hold';
+    __table_args__ = (
+        Index("ix_stock_reservations_entry_expiry", "entry", "expires_at"),
+        # Active holds of a variant, summed on every hold and checkout
+        Index("ix_stock_reservations_variant_expiry", "variant_id", "expires_at"),
+        # At most one row closes a hold, whichever worker writes it
+        Index(
+            "uq_stock_reservations_closing",
+            "hold_id",
+            unique=True,
+            postgresql_where=text("entry <> 'hold'"),
+            sqlite_where=text("entry <> 'hold'"),
+        ),
+    )
+
+
 # '''
 # class Attribute(Base):
 #     __tablename__ = "attributes"
@@ -146,11 +270,47 @@ class Cart(Base):
     product_id = Column(Integer, ForeignKey("products.product_id"), nullable=False)
     variant_id = Column(Integer, ForeignKey("variants.variant_id"), nullable=False)
     quantity = Column(Integer, default=1)
+    # updated_at and its index postdate existing databases, which need
+    #   ALTER TABLE carts ADD COLUMN updated_at TIMESTAMP;
+    #   CREATE INDEX ix_carts_updated_at ON carts (updated_at);
+    # cart_expiry stamps the NULLs it finds on its first run
+    updated_at = Column(
+        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True
+    )
 
     user = relationship("Users", back_populates="cart")
     product = relationship("Product")
     variant = relationship("Variant")
 
+    # One line per variant, so cart writes can upsert on (user_id, variant_id).
+    # uq_cart_user_variant postdates existing databases, which need their
+    # duplicate lines merged into the oldest one first:
+    #   UPDATE carts SET quantity = d.quantity
+    #     FROM (SELECT MIN(cart_id) AS cart_id, SUM(quantity) AS quantity
+    #           FROM carts GROUP BY user_id, variant_id
+    #           HAVING COUNT(*) > 1) d
+    #     WHERE carts.cart_id = d.cart_id;
+    #   DELETE FROM carts USING carts kept
+    #     WHERE kept.user_id = carts.user_id
+    #       AND kept.variant_id = carts.variant_id
+    #       AND kept.cart_id < carts.cart_id;
+    #   ALTER TABLE carts
+    #     ADD CONSTRAINT uq_cart_user_variant UNIQUE (user_id, variant_id);
+    __table_args__ = (
+        UniqueConstraint("user_id", "variant_id", name="uq_cart_user_variant"),
+    )
+
+
+class CartSummary(Base):
+    # Per-user cart totals, re-derived by cart_summary.refresh in the same
+    # transaction as every cart write and variant price change
+    __tablename__ = "cart_summaries"
+    user_id = Column(Integer, ForeignKey("users.user_id"), primary_key=True)
+    line_count = Column(Integer, nullable=False, default=0)
+    item_count = Column(Integer, nullable=False, default=0)
+    subtotal = Column(Numeric(12, 2), nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 class WishList(Base):
     __tablename__ = "wishlist"
@@ -178,6 +338,15 @@ class Coupon(Base):
     orders = relationship("Order", back_populates="coupon")
 
 
+class CouponUsage(Base):
+    # Times a coupon was used, per user; the row with user_id 0
+    # (coupons.ALL_USERS) is the total over all users
+    __tablename__ = "coupon_usage"
+    coupon_id = Column(Integer, ForeignKey("coupons.coupon_id"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    used = Column(Integer, nullable=False, default=0)
+
+
 class Order(Base):
     __tablename__ = "orders"
     order_id = Column(Integer, primary_key=True)
@@ -211,8 +380,13 @@ class BlackListedToken(Base):
     __tablename__ = "blacklisted_token"
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String, nullable=False, unique=True)
+    # jti and the expire_at index postdate existing databases, which need
+    #   ALTER TABLE blacklisted_token ADD COLUMN jti VARCHAR(32) UNIQUE;
+    #   CREATE INDEX ix_blacklisted_token_expire_at
+    #     ON blacklisted_token (expire_at);
+    jti = Column(String(32), unique=True)  # see revocation.token_id
     black_listed_at = Column(DateTime, default=datetime.utcnow)
-    expire_at = Column(DateTime, nullable=False)
+    expire_at = Column(DateTime, nullable=False, index=True)
 
 
 class UserSession(Base):
@@ -236,3 +410,20 @@ class UserAddress(Base):
     address = Column(String)
 
     user = relationship("Users")
+
+
+class IdempotencyKey(Base):
+    # Stored response of a POST retried with the same Idempotency-Key header
+    __tablename__ = "idempotency_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    endpoint = Column(String, nullable=False)  # e.g. "POST /order"
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "endpoint", "key", name="uq_idempotency_key"),
+    )
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+load_dotenv()
+
+# bcrypt cost factor for new hashes; hashes made with another cost are
+# rewritten on the user's next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Worker processes per web worker. Every uvicorn worker starts its own pool,
+# so the default splits half the cores across WEB_CONCURRENCY of them (the
+# variable uvicorn reads for its worker count); the rest of the cores stay
+# with the web workers.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+PASSWORD_POOL_SIZE = int(
+    os.getenv(
+        "PASSWORD_POOL_SIZE", max(1, (os.cpu_count() or 2) // 2 // WEB_CONCURRENCY)
+    )
+)
+# Hashes running or queued before new requests get a 429
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 4 * PASSWORD_POOL_SIZE))
+PASSWORD_RETRY_AFTER = int(os.getenv("PASSWORD_RETRY_AFTER", 1))
+
+pw_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS
+)
+
+
+# hash_in_worker and verify_in_worker run in the pool's worker processes and
+# also report when the work actually started there
+def hash_in_worker(password: str) -> tuple[str, float]:
+    started = time.monotonic()
+    return pw_context.hash(password), started
+
+
+def verify_in_worker(password: str, hashed: str) -> tuple[bool, Optional[str], float]:
+    started = time.monotonic()
+    verified, new_hash = pw_context.verify_and_update(password, hashed)
+    return verified, new_hash, started
+
+
+class PasswordPool:
+    # Bounded process pool for bcrypt. Hashing holds the GIL for its whole
+    # ~250 ms, so it runs in other processes; the calling request thread only
+    # waits on the result. At most queue_limit calls are running or queued,
+    # which also caps the request threads a login burst can tie up; callers
+    # beyond that are refused at once rather than queued.
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def start(self):
+        # Called from lifespan startup. Workers come from a forkserver (spawn
+        # where there is none) rather than a fork of this process, which by
+        # then has request threads, locks and pooled connections.
+        method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context(method)
+                )
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def run(self, fn, *args):
+        with self.lock:
+            if self.executor is None:
+                raise RuntimeError("password pool not started")
+            if self.in_flight >= self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many password requests, try again shortly",
+                    headers={"Retry-After": str(PASSWORD_RETRY_AFTER)},
+                )
+            self.in_flight += 1
+        submitted = time.monotonic()
+        try:
+            *result, started = self.executor.submit(fn, *args).result()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        # time.monotonic() is system-wide on Linux, so the worker's start time
+        # is comparable with ours
+        finished = time.monotonic()
+        wait = max(0.0, started - submitted)
+        with self.lock:
+            self.completed += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self.run_seconds += finished - max(started, submitted)
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.workers,
+                "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_wait_ms": round(1000 * self.wait_seconds / completed, 1),
+                "max_wait_ms": round(1000 * self.max_wait_seconds, 1),
+                "avg_run_ms": round(1000 * self.run_seconds / completed, 1),
+            }
+
+
+password_pool = PasswordPool(PASSWORD_POOL_SIZE, PASSWORD_QUEUE_LIMIT)
+
+
+def hash_password(password: str) -> str:
+    (hashed,) = password_pool.run(hash_in_worker, password)
+    return hashed
+
+
+def verify_password(password: str, hashed: str) -> tuple[bool, Optional[str]]:
+    # (verified, new hash to store or None); a new hash is returned when the
+    # stored one uses a cost factor other than BCRYPT_ROUNDS
+    verified, new_hash = password_pool.run(verify_in_worker, password, hashed)
+    if new_hash is not None:
+        with password_pool.lock:
+            password_pool.rehashed += 1
+    return verified, new_hash
@@ -0,0 +1,118 @@
+import threading
+from typing import Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from models import Product
+
+
+class PriceIndex:
+    # Products ordered by (price, product_id) in two parallel sorted arrays.
+    # A price range is two binary searches and a page is a slice, so range
+    # and sort-by-price requests are answered without scanning products.
+    #
+    # Writes build new arrays (np.insert/np.delete) and swap them in under the
+    # lock; readers take the current pair and never see a half-applied write.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.arrays = (np.empty(0, np.float64), np.empty(0, np.int64))
+            self.prices_by_id: dict[int, float] = {}
+
+    def __len__(self):
+        return len(self.prices_by_id)
+
+    def load(self, product_ids, prices):
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        order = np.lexsort((product_ids, prices))
+        with self.lock:
+            self.arrays = (prices[order], product_ids[order])
+            self.prices_by_id = dict(zip(product_ids.tolist(), prices.tolist()))
+
+    @staticmethod
+    def position(prices, product_ids, price: float, product_id: int, side: str):
+        # Index of (price, product_id) in the (price, id) order
+        start = int(np.searchsorted(prices, price, "left"))
+        end = int(np.searchsorted(prices, price, "right"))
+        return start + int(np.searchsorted(product_ids[start:end], product_id, side))
+
+    def set(self, product_id: int, price: float):
+        with self.lock:
+            prices, product_ids = self.arrays
+            previous = self.prices_by_id.get(product_id)
+            if previous is not None:
+                at = self.position(prices, product_ids, previous, product_id, "left")
+                prices, product_ids = np.delete(prices, at), np.delete(product_ids, at)
+            at = self.position(prices, product_ids, price, product_id, "left")
+            self.arrays = (
+                np.insert(prices, at, price),
+                np.insert(product_ids, at, product_id),
+            )
+            self.prices_by_id[product_id] = price
+
+    def remove(self, product_id: int):
+        with self.lock:
+            previous = self.prices_by_id.pop(product_id, None)
+            if previous is None:
+                return
+            prices, product_ids = self.arrays
+            at = self.position(prices, product_ids, previous, product_id, "left")
+            self.arrays = (np.delete(prices, at), np.delete(product_ids, at))
+
+    def page(
+        self,
+        min_price: Optional[float],
+        max_price: Optional[float],
+        limit: int,
+        after: Optional[tuple[float, int]] = None,
+        descending: bool = False,
+    ) -> list[tuple[float, int]]:
+        # -> up to limit (price, product_id) pairs inside [min_price, max_price],
+        # strictly after the keyset cursor in the requested direction
+        prices, product_ids = self.arrays
+        start = 0 if min_price is None else int(np.searchsorted(prices, min_price))
+        end = (
+            len(prices)
+            if max_price is None
+            else int(np.searchsorted(prices, max_price, "right"))
+        )
+        if descending:
+            if after is not None:
+                end = min(end, self.position(prices, product_ids, *after, "left"))
+            start = max(start, end - limit)
+            window = slice(end - 1, start - 1 if start else None, -1)
+        else:
+            if after is not None:
+                start = max(start, self.position(prices, product_ids, *after, "right"))
+            end = min(end, start + limit)
+            window = slice(start, end)
+        if start >= end:
+            return []
+        return list(zip(prices[window].tolist(), product_ids[window].tolist()))
+
+    def product_ids(self) -> frozenset[int]:
+        with self.lock:
+            return frozenset(self.prices_by_id)
+
+
+price_index = PriceIndex()
+
+
+def rebuild(db: Session):
+    rows = db.query(Product.product_id, Product.product_price).all()
+    price_index.load([row[0] for row in rows], [row[1] for row in rows])
+
+
+def reindex_products(db: Session, *criteria):
+    # Called after admin product writes
+    query = db.query(Product.product_id, Product.product_price).filter(*criteria)
+    for product_id, price in query:
+        price_index.set(product_id, price)
+
+
+def remove_product(product_id: int):
+    price_index.remove(product_id)
@@ -0,0 +1,112 @@
+from datetime import datetime
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+from database import dialect_insert
+from models import Brand, Category, Product, ProductReadModel, SubCategory, Variant
+
+
+def source_query(*criteria):
+    # products + taxonomy names + variant aggregates, one row per product
+    variants = (
+        select(
+            Variant.product_id,
+            func.min(Variant.price).label("min_price"),
+            func.max(Variant.price).label("max_price"),
+            func.sum(Variant.stock).label("stock"),
+        )
+        .group_by(Variant.product_id)
+        .subquery()
+    )
+    query = (
+        select(
+            Product.product_id,
+            Product.product_name,
+            Product.prod_image,
+            Product.product_price,
+            Product.product_description,
+            Product.brand_id,
+            Brand.brand_name,
+            Product.category_id,
+            Category.category_name,
+            Product.sub_category_id,
+            SubCategory.sub_category_name,
+            variants.c.min_price,
+            variants.c.max_price,
+            func.coalesce(variants.c.stock, 0),
+            literal(datetime.utcnow()),
+        )
+        .outerjoin(Brand, Product.brand_id == Brand.brand_id)
+        .outerjoin(Category, Product.category_id == Category.category_id)
+        .outerjoin(SubCategory, Product.sub_category_id == SubCategory.sub_category_id)
+        .outerjoin(variants, variants.c.product_id == Product.product_id)
+    )
+    if criteria:
+        query = query.where(*criteria)
+    return query
+
+
+COLUMNS = [
+    "product_id",
+    "product_name",
+    "prod_image",
+    "product_price",
+    "product_description",
+    "brand_id",
+    "brand_name",
+    "category_id",
+    "category_name",
+    "sub_category_id",
+    "sub_category_name",
+    "min_variant_price",
+    "max_variant_price",
+    "total_stock",
+    "updated_at",
+]
+
+
+def sync_products(db: Session, *criteria):
+    # Re-derive the read-model rows of the products matching criteria (on
+    # Product columns) inside the caller's transaction, so the row commits or
+    # rolls back together with the admin write that made it stale. An upsert,
+    # as request handlers and the stock rebalancer sync the same products
+    # concurrently; criteria must not be empty (SQLite needs the WHERE to
+    # parse INSERT ... SELECT ... ON CONFLICT).
+    db.flush()
+    statement = dialect_insert(db)(ProductReadModel).from_select(
+        COLUMNS, source_query(*criteria)
+    )
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ProductReadModel.product_id],
+            set_={
+                column: getattr(statement.excluded, column) for column in COLUMNS[1:]
+            },
+        )
+    )
+
+
+def product_ids(db: Session, *criteria) -> list[int]:
+    return [
+        product_id for (product_id,) in db.query(Product.product_id).filter(*criteria)
+    ]
+
+
+def remove_product(db: Session, product_id: int):
+    db.execute(
+        delete(ProductReadModel).where(ProductReadModel.product_id == product_id)
+    )
+
+
+def rebuild(db: Session):
+    db.execute(delete(ProductReadModel))
+    db.execute(insert(ProductReadModel).from_select(COLUMNS, source_query()))
+    db.commit()
+
+
+def ensure_built(db: Session):
+    # Startup check: a fresh table (or one that drifted) is rebuilt in one
+    # INSERT ... SELECT
+    products = db.scalar(select(func.count()).select_from(Product))
+    rows = db.scalar(select(func.count()).select_from(ProductReadModel))
+    if products != rows:
+        rebuild(db)
@@ -0,0 +1,337 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+from dotenv import load_dotenv
+from sqlalchemy import event, exists, func, insert, select, text
+from sqlalchemy.orm import Session, aliased
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal, dialect_insert
+from models import StockReservation, Variant, VariantStockShard
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", 15 * 60))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", 60))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", 500))
+# Holds made or closed by other workers reach this worker's index this often
+RESERVATION_SYNC_INTERVAL = float(os.getenv("RESERVATION_SYNC_INTERVAL", 5))
+
+# The ledger is the source of truth: hold() checks against it under a row
+# lock, so holds from every worker count. Reads that only display or
+# pre-check availability are answered from hold_index, a per-worker copy of
+# the open holds. Holds this worker commits reach its index at once, the
+# other workers' on the next sync. A hold counts until it is closed or its
+# expires_at passes; the sweeper's "expire" rows are bookkeeping and are not
+# needed for the hold to lapse.
+
+
+class HoldIndex:
+    # Open holds in memory: a running held total per variant makes "stock -
+    # active holds" a dict lookup, and a heap ordered by expiry lets expired
+    # holds drop out lazily before every read
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+        # Set while sync() reloads the index; changes committed meanwhile are
+        # journaled and replayed on top of the reloaded copy
+        self.syncing = False
+        self.journal: list[tuple[str, list]] = []
+
+    def clear(self):
+        self.holds: dict[str, tuple[int, int, int, datetime]] = {}
+        self.held: defaultdict[int, int] = defaultdict(int)
+        self.by_user: defaultdict[tuple[int, int], set[str]] = defaultdict(set)
+        self.expiry: list[tuple[datetime, str]] = []
+
+    def __len__(self):
+        return len(self.holds)
+
+    def insert(self, hold_id, variant_id, user_id, quantity, expires_at):
+        if hold_id in self.holds:
+            return
+        self.holds[hold_id] = (variant_id, user_id, quantity, expires_at)
+        self.held[variant_id] += quantity
+        self.by_user[(user_id, variant_id)].add(hold_id)
+        heapq.heappush(self.expiry, (expires_at, hold_id))
+
+    def drop(self, hold_id: str):
+        entry = self.holds.pop(hold_id, None)
+        if entry is None:
+            return
+        variant_id, user_id, quantity, _ = entry
+        self.held[variant_id] -= quantity
+        if self.held[variant_id] <= 0:
+            del self.held[variant_id]
+        owned = self.by_user[(user_id, variant_id)]
+        owned.discard(hold_id)
+        if not owned:
+            del self.by_user[(user_id, variant_id)]
+
+    def expire_due(self, now: datetime):
+        while self.expiry and self.expiry[0][0] <= now:
+            _, hold_id = heapq.heappop(self.expiry)
+            self.drop(hold_id)
+
+    def apply(self, opened: list, closed: list):
+        # Holds (hold_id, variant_id, user_id, quantity, expires_at) opened
+        # and hold ids closed by a committed transaction
+        with self.lock:
+            if self.syncing:
+                self.journal.append((opened, closed))
+            for row in opened:
+                self.insert(*row)
+            for hold_id in closed:
+                self.drop(hold_id)
+
+    def held_quantity(self, variant_id: int, exclude_user: Optional[int] = None) -> int:
+        with self.lock:
+            self.expire_due(datetime.utcnow())
+            held = self.held.get(variant_id, 0)
+            if exclude_user is not None:
+                held -= sum(
+                    self.holds[hold_id][2]
+                    for hold_id in self.by_user.get((exclude_user, variant_id), ())
+                )
+            return held
+
+
+hold_index = HoldIndex()
+
+
+@event.listens_for(Session, "after_commit")
+def index_committed_holds(db: Session):
+    opened = db.info.pop("opened_holds", None)
+    closed = db.info.pop("closed_holds", None)
+    if opened or closed:
+        hold_index.apply(opened or [], closed or [])
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_rolled_back_holds(db: Session):
+    db.info.pop("opened_holds", None)
+    db.info.pop("closed_holds", None)
+
+
+def open_holds(db: Session, *criteria):
+    # "hold" rows that no later ledger row has closed
+    closing = aliased(StockReservation)
+    return db.query(StockReservation).filter(
+        StockReservation.entry == "hold",
+        ~exists().where(
+            closing.hold_id == StockReservation.hold_id, closing.entry != "hold"
+        ),
+        *criteria,
+    )
+
+
+def held_quantities(
+    db: Session, variant_ids, exclude_user: Optional[int] = None
+) -> dict[int, int]:
+    # Units in active holds per variant, optionally leaving out one user's
+    criteria = [
+        StockReservation.variant_id.in_(list(variant_ids)),
+        StockReservation.expires_at > datetime.utcnow(),
+    ]
+    if exclude_user is not None:
+        criteria.append(StockReservation.user_id != exclude_user)
+    rows = (
+        open_holds(db, *criteria)
+        .with_entities(StockReservation.variant_id, func.sum(StockReservation.quantity))
+        .group_by(StockReservation.variant_id)
+    )
+    return {variant_id: int(held) for variant_id, held in rows}
+
+
+def held_quantity(db: Session, variant_id: int, exclude_user: Optional[int] = None):
+    return held_quantities(db, [variant_id], exclude_user).get(variant_id, 0)
+
+
+def lock_variants(db: Session, variant_ids):
+    # Serializes check-and-hold per variant across workers (SQLite serializes
+    # all writers anyway), in variant order: shard 0 for sharded variants, so
+    # their variants row stays cold, else the variants row
+    variant_ids = sorted(set(variant_ids))
+    sharded = {
+        variant_id
+        for (variant_id,) in db.execute(
+            select(VariantStockShard.variant_id)
+            .where(
+                VariantStockShard.variant_id.in_(variant_ids),
+                VariantStockShard.shard == 0,
+            )
+            .order_by(VariantStockShard.variant_id)
+            .with_for_update()
+        )
+    }
+    rest = [variant_id for variant_id in variant_ids if variant_id not in sharded]
+    if rest:
+        db.execute(
+            select(Variant.variant_id)
+            .where(Variant.variant_id.in_(rest))
+            .order_by(Variant.variant_id)
+            .with_for_update()
+        ).all()
+
+
+def hold_lines(
+    db: Session, user_id: int, lines: dict[int, int], stocks: dict[int, int]
+) -> Optional[int]:
+    # Appends a hold row for every line (variant_id -> quantity) to the
+    # caller's transaction, or none: returns the first variant whose stock
+    # left after other holds is too low, None once all are held. The check
+    # runs against the ledger under lock_variants, so holds from every worker
+    # count; holds the caller closed earlier in the transaction no longer do,
+    # which is how a cart update replaces a line's holds. A constant number
+    # of statements whatever the number of lines.
+    lock_variants(db, lines)
+    held = held_quantities(db, lines)
+    for variant_id in sorted(lines):
+        if stocks[variant_id] - held.get(variant_id, 0) < lines[variant_id]:
+            return variant_id
+    expires_at = datetime.utcnow() + timedelta(seconds=RESERVATION_TTL)
+    rows = [
+        {
+            "hold_id": uuid4().hex,
+            "entry": "hold",
+            "variant_id": variant_id,
+            "user_id": user_id,
+            "quantity": quantity,
+            "expires_at": expires_at,
+            "created_at": datetime.utcnow(),
+        }
+        for variant_id, quantity in lines.items()
+    ]
+    db.execute(insert(StockReservation), rows)
+    db.info.setdefault("opened_holds", []).extend(
+        (row["hold_id"], row["variant_id"], user_id, row["quantity"], expires_at)
+        for row in rows
+    )
+    return None
+
+
+def hold(db: Session, user_id: int, variant_id: int, quantity: int, stock: int) -> bool:
+    return hold_lines(db, user_id, {variant_id: quantity}, {variant_id: stock}) is None
+
+
+def close_holds(
+    db: Session, entry: str, *criteria, limit: Optional[int] = None
+) -> list[str]:
+    # Appends an entry ("release", "expire" or "checkout") closing the open
+    # holds matching criteria to the caller's transaction. A hold closed
+    # concurrently elsewhere (a sweeper on another worker, say) keeps its
+    # first closing row: the unique index on closing rows turns the second
+    # into a no-op.
+    query = open_holds(db, *criteria).order_by(StockReservation.reservation_id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+    if rows:
+        now = datetime.utcnow()
+        statement = dialect_insert(db)(StockReservation).values(
+            [
+                {
+                    "hold_id": row.hold_id,
+                    "entry": entry,
+                    "variant_id": row.variant_id,
+                    "user_id": row.user_id,
+                    "quantity": row.quantity,
+                    "expires_at": row.expires_at,
+                    "created_at": now,
+                }
+                for row in rows
+            ]
+        )
+        db.execute(
+            statement.on_conflict_do_nothing(
+                index_elements=[StockReservation.hold_id],
+                # A literal, as in the index: PostgreSQL has to match it
+                index_where=text("entry <> 'hold'"),
+            )
+        )
+    closed = [row.hold_id for row in rows]
+    db.info.setdefault("closed_holds", []).extend(closed)
+    return closed
+
+
+def sync(db: Session):
+    # Reloads the open, unexpired holds from the ledger. Ids are assigned at
+    # insert but rows become visible at commit, possibly out of order, so a
+    # "rows since the highest id seen" poll could miss holds for good; the
+    # open holds of a TTL window stay few enough to reload whole.
+    with hold_index.lock:
+        hold_index.syncing = True
+        hold_index.journal = []
+    try:
+        rows = open_holds(db, StockReservation.expires_at > datetime.utcnow()).all()
+    except Exception:
+        with hold_index.lock:
+            hold_index.syncing = False
+        raise
+    with hold_index.lock:
+        hold_index.clear()
+        for row in rows:
+            hold_index.insert(
+                row.hold_id, row.variant_id, row.user_id, row.quantity, row.expires_at
+            )
+        # Committed after the reload's query began, so possibly not in it
+        for opened, closed in hold_index.journal:
+            for row in opened:
+                hold_index.insert(*row)
+            for hold_id in closed:
+                hold_index.drop(hold_id)
+        hold_index.syncing = False
+        hold_index.journal = []
+
+
+def sync_once():
+    db = SessionLocal()
+    try:
+        sync(db)
+    finally:
+        db.close()
+
+
+async def sync_periodically():
+    while True:
+        await asyncio.sleep(RESERVATION_SYNC_INTERVAL)
+        try:
+            await run_in_threadpool(sync_once)
+        except Exception:
+            logger.exception("reservation sync failed")
+
+
+def sweep():
+    # Closes expired holds in the ledger in batches of
+    # RESERVATION_SWEEP_BATCH rows, one short transaction per batch
+    db = SessionLocal()
+    try:
+        while True:
+            expired = close_holds(
+                db,
+                "expire",
+                StockReservation.expires_at <= datetime.utcnow(),
+                limit=RESERVATION_SWEEP_BATCH,
+            )
+            db.commit()
+            if len(expired) < RESERVATION_SWEEP_BATCH:
+                break
+    finally:
+        db.close()
+
+
+async def sweep_periodically():
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        try:
+            await run_in_threadpool(sweep)
+        except Exception:
+            logger.exception("reservation sweep failed")
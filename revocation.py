@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from sqlalchemy import case, delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from models import BlackListedToken
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Revocations made by other workers are picked up this often
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", 5))
+REVOCATION_PURGE_INTERVAL = float(os.getenv("REVOCATION_PURGE_INTERVAL", 3600))
+REVOCATION_PURGE_BATCH = int(os.getenv("REVOCATION_PURGE_BATCH", 1000))
+
+
+def token_id(token: str, payload: dict) -> str:
+    # The jti claim; tokens issued before it existed are identified by a hash
+    return payload.get("jti") or hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def token_expiry(payload: dict) -> datetime:
+    # Naive UTC, as stored in blacklisted_token.expire_at
+    if "exp" in payload:
+        return datetime.fromtimestamp(payload["exp"], timezone.utc).replace(tzinfo=None)
+    expires = datetime.fromisoformat(payload["exp_time"])
+    return expires.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class RevocationList:
+    # Revoked token ids with their expiry, checked on every authenticated
+    # request. A dict lookup of a 32-character id is a few tens of
+    # nanoseconds in CPython, cheaper than hashing the id for a Bloom filter
+    # probe, so the exact set is the only structure on the hot path.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revoked: dict[str, datetime] = {}
+
+    def __len__(self):
+        return len(self.revoked)
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self.revoked
+
+    def add(self, entries):
+        with self.lock:
+            for jti, expire_at in entries:
+                self.revoked[jti] = expire_at
+
+    def expire(self, now: datetime) -> int:
+        with self.lock:
+            expired = [jti for jti, at in self.revoked.items() if at <= now]
+            for jti in expired:
+                del self.revoked[jti]
+            return len(expired)
+
+
+revoked_tokens = RevocationList()
+
+
+def is_revoked(jti: str) -> bool:
+    return jti in revoked_tokens
+
+
+def revoke(db: Session, token: str, payload: dict):
+    # Adds the denylist row to the caller's transaction; this worker skips
+    # the token at once, the others on their next sync
+    jti = token_id(token, payload)
+    expire_at = token_expiry(payload)
+    db.add(BlackListedToken(token=token, jti=jti, expire_at=expire_at))
+    revoked_tokens.add([(jti, expire_at)])
+
+
+def sync(db: Session):
+    # Reloads every unexpired revocation. Ids are assigned at insert but
+    # rows become visible at commit, possibly out of order, so a "rows
+    # since the highest id seen" poll could skip a logout for good. Tokens
+    # live 15 minutes, which keeps the unexpired set small. Entries are
+    # only added here: a revocation this worker made is never dropped
+    # before its row is visible.
+    rows = db.execute(
+        select(
+            BlackListedToken.jti,
+            # Only rows written before the jti column need the token
+            case((BlackListedToken.jti.is_(None), BlackListedToken.token)),
+            BlackListedToken.expire_at,
+        ).where(BlackListedToken.expire_at > datetime.utcnow())
+    ).all()
+    revoked_tokens.add(
+        (jti or token_id(token, {}), expire_at) for jti, token, expire_at in rows
+    )
+
+
+def rebuild(db: Session):
+    # Startup: every unexpired revocation
+    with revoked_tokens.lock:
+        revoked_tokens.revoked.clear()
+    sync(db)
+
+
+def purge() -> int:
+    # Expired tokens are rejected by their exp claim anyway; their rows go
+    # in batches of REVOCATION_PURGE_BATCH, one short transaction each
+    now = datetime.utcnow()
+    revoked_tokens.expire(now)
+    purged = 0
+    db = SessionLocal()
+    try:
+        while True:
+            ids = [
+                row_id
+                for (row_id,) in db.query(BlackListedToken.id)
+                .filter(BlackListedToken.expire_at <= now)
+                .limit(REVOCATION_PURGE_BATCH)
+            ]
+            if ids:
+                db.execute(delete(BlackListedToken).where(BlackListedToken.id.in_(ids)))
+            db.commit()
+            purged += len(ids)
+            if len(ids) < REVOCATION_PURGE_BATCH:
+                return purged
+    finally:
+        db.close()
+
+
+def sync_once():
+    db = SessionLocal()
+    try:
+        sync(db)
+    finally:
+        db.close()
+
+
+async def sync_periodically():
+    while True:
+        await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+        try:
+            await run_in_threadpool(sync_once)
+        except Exception:
+            logger.exception("revocation sync failed")
+
+
+async def purge_periodically():
+    while True:
+        await asyncio.sleep(REVOCATION_PURGE_INTERVAL)
+        try:
+            await run_in_threadpool(purge)
+        except Exception:
+            logger.exception("revocation purge failed")
@@ -0,0 +1,461 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from itertools import groupby
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Brand, Category, OrderItem, Product, SubCategory
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Per-field term weights: a hit in the name counts more than one in the description
+FIELD_WEIGHTS = {
+    "product_name": 3.0,
+    "brand_name": 2.0,
+    "category_name": 1.5,
+    "sub_category_name": 1.5,
+    "product_description": 1.0,
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Fuzzy matching: vocabulary tokens sharing the most trigrams with a query
+# token are re-ranked by edit distance; each edit discounts the term's score
+FUZZY_CANDIDATES = 50
+FUZZY_PENALTY = 0.5
+
+# Top-k per prefix is memoised in an LRU; prefixes of these lengths are
+# precomputed at load because their bisect windows are the widest
+SUGGEST_CACHE_SIZE = 10_000
+SUGGEST_WARM_PREFIXES = (1, 2)
+SUGGEST_MAX_LIMIT = 20
+
+# kind -> (model, primary key, name column, Product foreign key)
+TAXONOMY = {
+    "brand": (Brand, Brand.brand_id, Brand.brand_name, Product.brand_id),
+    "category": (
+        Category,
+        Category.category_id,
+        Category.category_name,
+        Product.category_id,
+    ),
+    "subcategory": (
+        SubCategory,
+        SubCategory.sub_category_id,
+        SubCategory.sub_category_name,
+        Product.sub_category_id,
+    ),
+}
+
+
+def tokenize(text: str | None) -> list[str]:
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(token: str) -> int:
+    if len(token) <= 2:
+        return 0
+    if len(token) <= 5:
+        return 1
+    return 2
+
+
+def levenshtein(a: str, b: str, limit: int) -> int:
+    # Banded DP that gives up as soon as every cell in a row exceeds limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (char_a != char_b),
+                )
+            )
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchIndex:
+    # Inverted index over products: token -> {product_id: weighted tf}.
+    # Each worker process keeps its own copy, built at startup and updated by
+    # the admin product/taxonomy handlers.
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self.doc_terms: dict[int, dict[str, float]] = {}
+        self.doc_length: dict[int, float] = {}
+        self.total_length = 0.0
+        # trigram -> vocabulary tokens containing it, for fuzzy lookups
+        self.trigrams: dict[str, set[str]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def clear(self):
+        with self.lock:
+            self.postings.clear()
+            self.doc_terms.clear()
+            self.doc_length.clear()
+            self.total_length = 0.0
+            self.trigrams.clear()
+
+    def add(self, product_id: int, fields: dict):
+        terms: dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(fields.get(field)):
+                terms[token] += weight
+
+        with self.lock:
+            self.remove(product_id)
+            for token, tf in terms.items():
+                if token not in self.postings:
+                    for gram in trigrams(token):
+                        self.trigrams[gram].add(token)
+                self.postings[token][product_id] = tf
+            length = sum(terms.values())
+            self.doc_terms[product_id] = dict(terms)
+            self.doc_length[product_id] = length
+            self.total_length += length
+
+    def remove(self, product_id: int):
+        with self.lock:
+            terms = self.doc_terms.pop(product_id, None)
+            if terms is None:
+                return
+            for token in terms:
+                docs = self.postings.get(token)
+                if docs is not None:
+                    docs.pop(product_id, None)
+                    if not docs:
+                        del self.postings[token]
+                        for gram in trigrams(token):
+                            tokens = self.trigrams.get(gram)
+                            if tokens is not None:
+                                tokens.discard(token)
+                                if not tokens:
+                                    del self.trigrams[gram]
+            self.total_length -= self.doc_length.pop(product_id)
+
+    def expand(self, token: str) -> dict[str, float]:
+        # Vocabulary tokens within max_edits of token, weighted by closeness
+        if token in self.postings:
+            return {token: 1.0}
+        limit = max_edits(token)
+        if not limit:
+            return {}
+
+        shared: Counter = Counter()
+        for gram in trigrams(token):
+            shared.update(self.trigrams.get(gram, ()))
+        matches = {}
+        for candidate, _ in shared.most_common(FUZZY_CANDIDATES):
+            distance = levenshtein(token, candidate, limit)
+            if distance <= limit:
+                matches[candidate] = FUZZY_PENALTY**distance
+        return matches
+
+    def search(
+        self, query: str, limit: int = 50, fuzzy: bool = False
+    ) -> list[tuple[int, float]]:
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+
+        with self.lock:
+            n_docs = len(self.doc_terms)
+            if not n_docs:
+                return []
+
+            # query term -> weight; fuzzy mode swaps each token for its
+            # closest vocabulary spellings
+            terms: dict[str, float] = defaultdict(float)
+            for token in tokens:
+                if fuzzy:
+                    for term, weight in self.expand(token).items():
+                        terms[term] = max(terms[term], weight)
+                else:
+                    terms[token] = 1.0
+
+            avg_length = self.total_length / n_docs
+            scores: dict[int, float] = defaultdict(float)
+            for term, weight in terms.items():
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for product_id, tf in docs.items():
+                    norm = 1 - B + B * self.doc_length[product_id] / avg_length
+                    scores[product_id] += (
+                        weight * idf * tf * (K1 + 1) / (tf + K1 * norm)
+                    )
+
+        return heapq.nsmallest(
+            limit, scores.items(), key=lambda item: (-item[1], item[0])
+        )
+
+
+class SuggestIndex:
+    # Sorted array of (lowercased name suffix, kind, id) searched with bisect.
+    # Every word start of a name is a key, so "gal" finds "Samsung Galaxy".
+    # Popularity is units sold for products and product count for taxonomy.
+    #
+    # Top-k per prefix is cached; one and two character prefixes (the widest
+    # windows) are precomputed at load. Writes patch the cached lists of the
+    # prefixes they touch instead of clearing the cache.
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.keys: list[tuple[str, str, int]] = []
+        self.names: dict[tuple[str, int], str] = {}
+        self.popularity: Counter = Counter()
+        self.product_refs: dict[int, tuple] = {}
+        self.cache: OrderedDict[str, list[tuple[str, int]]] = OrderedDict()
+
+    @staticmethod
+    def name_keys(name: str, kind: str, ref_id: int):
+        words = name.lower().split()
+        return [(" ".join(words[i:]), kind, ref_id) for i in range(len(words))]
+
+    def rank(self, entry: tuple[str, int]):
+        return (-self.popularity[entry], self.names[entry])
+
+    def top(self, prefix: str) -> list[tuple[str, int]]:
+        lo = bisect.bisect_left(self.keys, (prefix,))
+        hi = bisect.bisect_left(self.keys, (prefix + "\U0010ffff",))
+        matches = {(kind, ref_id) for _, kind, ref_id in self.keys[lo:hi]}
+        return heapq.nsmallest(SUGGEST_MAX_LIMIT, matches, key=self.rank)
+
+    def load(self, names: dict, popularity: Counter, product_refs: dict):
+        keys = []
+        for (kind, ref_id), name in names.items():
+            keys.extend(self.name_keys(name, kind, ref_id))
+        keys.sort()
+        with self.lock:
+            self.keys = keys
+            self.names = names
+            self.popularity = popularity
+            self.product_refs = product_refs
+            self.cache.clear()
+            for length in SUGGEST_WARM_PREFIXES:
+                for prefix, group in groupby(keys, key=lambda key: key[0][:length]):
+                    if len(prefix) < length:
+                        continue
+                    matches = {(kind, ref_id) for _, kind, ref_id in group}
+                    self.cache[prefix] = heapq.nsmallest(
+                        SUGGEST_MAX_LIMIT, matches, key=self.rank
+                    )
+
+    def offer(self, text: str, entry: tuple[str, int]):
+        # entry was added or became more popular: it can only move up
+        for end in range(1, len(text) + 1):
+            cached = self.cache.get(text[:end])
+            if cached is None:
+                continue
+            if entry not in cached:
+                cached.append(entry)
+            cached.sort(key=self.rank)
+            del cached[SUGGEST_MAX_LIMIT:]
+
+    def retract(self, text: str, entry: tuple[str, int]):
+        # entry was removed or became less popular: whatever replaces it is
+        # outside the cached list, so recompute now rather than on a user read
+        for end in range(1, len(text) + 1):
+            prefix = text[:end]
+            cached = self.cache.get(prefix)
+            if cached is not None and entry in cached:
+                self.cache[prefix] = self.top(prefix)
+
+    def set_name(self, kind: str, ref_id: int, name: str):
+        entry = (kind, ref_id)
+        with self.lock:
+            if self.names.get(entry) == name:
+                return
+            self.remove_name(kind, ref_id)
+            self.names[entry] = name
+            for key in self.name_keys(name, kind, ref_id):
+                bisect.insort(self.keys, key)
+                self.offer(key[0], entry)
+
+    def remove_name(self, kind: str, ref_id: int):
+        entry = (kind, ref_id)
+        with self.lock:
+            name = self.names.get(entry)
+            if name is None:
+                return
+            for key in self.name_keys(name, kind, ref_id):
+                pos = bisect.bisect_left(self.keys, key)
+                if pos < len(self.keys) and self.keys[pos] == key:
+                    del self.keys[pos]
+            # still named while retracting so recomputation can rank the rest
+            for key in self.name_keys(name, kind, ref_id):
+                self.retract(key[0], entry)
+            del self.names[entry]
+
+    def adjust_popularity(self, entries, delta: int):
+        for entry in entries:
+            self.popularity[entry] += delta
+            name = self.names.get(entry)
+            if name is None:
+                continue
+            for text, _, _ in self.name_keys(name, *entry):
+                if delta > 0:
+                    self.offer(text, entry)
+                else:
+                    self.retract(text, entry)
+
+    def set_product(self, product_id: int, name: str, refs: tuple):
+        with self.lock:
+            old_refs = self.product_refs.get(product_id, ())
+            self.set_name("product", product_id, name)
+            self.product_refs[product_id] = refs
+            self.adjust_popularity(set(old_refs) - set(refs), -1)
+            self.adjust_popularity(set(refs) - set(old_refs), 1)
+
+    def remove_product(self, product_id: int):
+        with self.lock:
+            self.remove_name("product", product_id)
+            self.adjust_popularity(self.product_refs.pop(product_id, ()), -1)
+            self.popularity.pop(("product", product_id), None)
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+
+        with self.lock:
+            top = self.cache.get(prefix)
+            if top is not None:
+                self.cache.move_to_end(prefix)
+            else:
+                top = self.top(prefix)
+                self.cache[prefix] = top
+                if len(self.cache) > SUGGEST_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            return [
+                {"kind": kind, "id": ref_id, "name": self.names[(kind, ref_id)]}
+                for kind, ref_id in top[:limit]
+            ]
+
+
+product_index = SearchIndex()
+suggest_index = SuggestIndex()
+
+
+def product_refs(row) -> tuple:
+    return tuple(
+        (kind, ref_id)
+        for kind, ref_id in (
+            ("brand", row.brand_id),
+            ("category", row.category_id),
+            ("subcategory", row.sub_category_id),
+        )
+        if ref_id is not None
+    )
+
+
+def load_documents(db: Session, *criteria):
+    query = (
+        db.query(
+            Product.product_id,
+            Product.brand_id,
+            Product.category_id,
+            Product.sub_category_id,
+            Product.product_name,
+            Product.product_description,
+            Brand.brand_name,
+            Category.category_name,
+            SubCategory.sub_category_name,
+        )
+        .outerjoin(Brand, Product.brand_id == Brand.brand_id)
+        .outerjoin(Category, Product.category_id == Category.category_id)
+        .outerjoin(SubCategory, Product.sub_category_id == SubCategory.sub_category_id)
+    )
+    if criteria:
+        query = query.filter(*criteria)
+    return query.yield_per(1000)
+
+
+def rebuild(db: Session):
+    product_index.clear()
+    names = {}
+    popularity = Counter()
+    refs = {}
+    for row in load_documents(db):
+        product_index.add(row.product_id, row._asdict())
+        names[("product", row.product_id)] = row.product_name
+        refs[row.product_id] = product_refs(row)
+        popularity.update(refs[row.product_id])
+
+    for kind, (model, pk, name, _) in TAXONOMY.items():
+        for ref_id, ref_name in db.query(pk, name):
+            names[(kind, ref_id)] = ref_name
+
+    sold = db.query(OrderItem.product_id, func.sum(OrderItem.quantity)).group_by(
+        OrderItem.product_id
+    )
+    for product_id, quantity in sold:
+        if product_id is not None:
+            popularity[("product", product_id)] = quantity or 0
+
+    suggest_index.load(names, popularity, refs)
+
+
+def reindex_products(db: Session, *criteria):
+    # Called after admin writes; criteria select the affected products,
+    # e.g. Product.brand_id == id after a brand rename
+    for row in load_documents(db, *criteria):
+        product_index.add(row.product_id, row._asdict())
+        suggest_index.set_product(row.product_id, row.product_name, product_refs(row))
+
+
+def remove_product(product_id: int):
+    product_index.remove(product_id)
+    suggest_index.remove_product(product_id)
+
+
+def sync_taxonomy(db: Session):
+    # Brand/category/subcategory names written by other workers; the
+    # taxonomy tables are small enough to compare whole
+    for kind, (model, pk, name, _) in TAXONOMY.items():
+        stored = dict(db.query(pk, name))
+        with suggest_index.lock:
+            known = [
+                ref_id
+                for (entry_kind, ref_id) in suggest_index.names
+                if entry_kind == kind
+            ]
+        for ref_id in known:
+            if ref_id not in stored:
+                suggest_index.remove_name(kind, ref_id)
+        for ref_id, ref_name in stored.items():
+            suggest_index.set_name(kind, ref_id, ref_name)
+
+
+def refresh_taxonomy(db: Session, kind: str, ref_id: int):
+    # After a brand/category/subcategory create, update or delete
+    model, pk, name, product_fk = TAXONOMY[kind]
+    found = db.query(name).filter(pk == ref_id).first()
+    if found:
+        suggest_index.set_name(kind, ref_id, found[0])
+    else:
+        suggest_index.remove_name(kind, ref_id)
+    reindex_products(db, product_fk == ref_id)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import insert, update
+from starlette.concurrency import run_in_threadpool
+from database import SessionLocal
+from models import UserSession
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# A flush is triggered by SESSION_LOG_BATCH queued rows or, failing that,
+# every SESSION_LOG_INTERVAL seconds
+SESSION_LOG_BATCH = int(os.getenv("SESSION_LOG_BATCH", 500))
+SESSION_LOG_INTERVAL = float(os.getenv("SESSION_LOG_INTERVAL", 1))
+# Past this depth logins write the queue themselves instead of growing it
+SESSION_LOG_QUEUE_LIMIT = int(os.getenv("SESSION_LOG_QUEUE_LIMIT", 50_000))
+
+
+class SessionLog:
+    # Login session rows waiting to be written. Rows leave the queue only
+    # once their insert has committed; a failed flush puts them back, so
+    # every row is written at least once.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held for the whole of a flush: once flush() returns, every row
+        # queued before the call has been committed
+        self.flush_lock = threading.Lock()
+        self.queue: deque[dict] = deque()
+        # Logouts of sessions not written yet, possibly queued by another
+        # worker: token -> (user_id, logout_time, token expiry). Retried on
+        # every flush until the row shows up or the token has expired.
+        self.pending_logouts: dict[str, tuple[int, datetime, datetime]] = {}
+        # Set by write_periodically, which waits on batch_ready
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batch_ready: Optional[asyncio.Event] = None
+        self.max_depth = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.last_flush_rows = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def record(self, **row):
+        with self.lock:
+            self.queue.append(row)
+            depth = len(self.queue)
+            self.max_depth = max(self.max_depth, depth)
+        if depth >= SESSION_LOG_QUEUE_LIMIT:
+            self.flush()
+        elif depth == SESSION_LOG_BATCH and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.batch_ready.set)
+
+    def flush(self) -> int:
+        written = 0
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    count = min(len(self.queue), SESSION_LOG_BATCH)
+                    batch = [self.queue.popleft() for _ in range(count)]
+                if not batch:
+                    break
+                started = time.perf_counter()
+                db = SessionLocal()
+                try:
+                    db.execute(insert(UserSession), batch)
+                    db.commit()
+                except Exception:
+                    with self.lock:
+                        self.queue.extendleft(reversed(batch))
+                        self.failed_flushes += 1
+                    raise
+                finally:
+                    db.close()
+                elapsed = time.perf_counter() - started
+                written += len(batch)
+                with self.lock:
+                    self.written += len(batch)
+                    self.flushes += 1
+                    self.flush_seconds += elapsed
+                    self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                    self.last_flush_rows = len(batch)
+            if self.pending_logouts:
+                self.apply_logouts()
+        return written
+
+    def apply_logouts(self):
+        with self.lock:
+            pending = list(self.pending_logouts.items())
+        now = datetime.utcnow()
+        done = []
+        db = SessionLocal()
+        try:
+            for token, (user_id, logout_time, expire_at) in pending:
+                result = db.execute(
+                    update(UserSession)
+                    .where(
+                        UserSession.user_id == user_id,
+                        UserSession.token == token,
+                        UserSession.is_active,
+                    )
+                    .values(is_active=False, logout_time=logout_time)
+                )
+                # Past its expiry the token is useless, and a row that has
+                # not appeared by then was lost with its worker
+                if result.rowcount or expire_at <= now:
+                    done.append(token)
+            db.commit()
+        finally:
+            db.close()
+        with self.lock:
+            for token in done:
+                self.pending_logouts.pop(token, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            flushes = self.flushes or 1
+            return {
+                "queue_depth": len(self.queue),
+                "pending_logouts": len(self.pending_logouts),
+                "max_queue_depth": self.max_depth,
+                "written": self.written,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "last_flush_rows": self.last_flush_rows,
+                "avg_flush_ms": round(1000 * self.flush_seconds / flushes, 2),
+                "max_flush_ms": round(1000 * self.max_flush_seconds, 2),
+            }
+
+
+session_log = SessionLog()
+
+
+def record_login(
+    user_id: int, token: str, ip_address: Optional[str], user_agent: Optional[str]
+):
+    session_log.record(
+        user_id=user_id,
+        token=token,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        login_time=datetime.utcnow(),
+        logout_time=None,
+        is_active=True,
+    )
+
+
+def record_logout(user_id: int, token: str, logout_time: datetime, expire_at: datetime):
+    with session_log.lock:
+        session_log.pending_logouts[token] = (user_id, logout_time, expire_at)
+
+
+def flush() -> int:
+    return session_log.flush()
+
+
+async def write_periodically():
+    session_log.batch_ready = asyncio.Event()
+    session_log.loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await asyncio.wait_for(session_log.batch_ready.wait(), SESSION_LOG_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        session_log.batch_ready.clear()
+        try:
+            await run_in_threadpool(session_log.flush)
+        except Exception:
+            logger.exception("session log flush failed")
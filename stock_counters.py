@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import random
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from catalog_cache import catalog_cache
+from database import SessionLocal
+from models import Product, Variant, VariantStockShard
+import read_model
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STOCK_SHARDS = int(os.getenv("STOCK_SHARDS", 16))
+STOCK_REBALANCE_INTERVAL = float(os.getenv("STOCK_REBALANCE_INTERVAL", 30))
+
+# Sharded-counter mode for hot variants. The stock is split over N
+# variant_stock_shards rows and a checkout decrements one shard picked at
+# random, so parallel buyers of the same SKU lock different rows instead of
+# queueing on the single variants row. The shards are the exact stock;
+# Variant.stock is a snapshot refreshed by rebalance() and admin writes.
+
+
+def spread(total: int, shards: int) -> list[int]:
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+def locked_shards(db: Session, variant_id: int) -> list[VariantStockShard]:
+    # Always in shard order, so whole-variant operations cannot deadlock
+    return (
+        db.query(VariantStockShard)
+        .filter(VariantStockShard.variant_id == variant_id)
+        .order_by(VariantStockShard.shard)
+        .with_for_update()
+        .all()
+    )
+
+
+def sharded(db: Session, variant_ids) -> set[int]:
+    rows = (
+        db.query(VariantStockShard.variant_id)
+        .filter(VariantStockShard.variant_id.in_(list(variant_ids)))
+        .distinct()
+    )
+    return {variant_id for (variant_id,) in rows}
+
+
+def available(db: Session, variant_ids) -> dict[int, int]:
+    # Exact stock of sharded variants: the sum over their shards
+    rows = (
+        db.query(VariantStockShard.variant_id, func.sum(VariantStockShard.stock))
+        .filter(VariantStockShard.variant_id.in_(list(variant_ids)))
+        .group_by(VariantStockShard.variant_id)
+    )
+    return {variant_id: int(stock or 0) for variant_id, stock in rows}
+
+
+def current(db: Session, stocks: dict[int, int]) -> dict[int, int]:
+    # variant_id -> stock, from the Variant.stock values passed in, with the
+    # shard sum in place of the snapshot for sharded variants
+    return {**stocks, **available(db, stocks)} if stocks else {}
+
+
+def enable(db: Session, variant_id: int, shards: int = STOCK_SHARDS) -> int:
+    # Splits the variant's current stock over shards rows (re-splits it when
+    # the variant is already sharded); returns the total moved
+    variant = (
+        db.query(Variant)
+        .filter(Variant.variant_id == variant_id)
+        .with_for_update()
+        .first()
+    )
+    rows = locked_shards(db, variant_id)
+    total = sum(row.stock for row in rows) if rows else variant.stock
+    db.execute(
+        delete(VariantStockShard).where(VariantStockShard.variant_id == variant_id)
+    )
+    db.add_all(
+        VariantStockShard(variant_id=variant_id, shard=shard, stock=stock)
+        for shard, stock in enumerate(spread(total, shards))
+    )
+    variant.stock = total
+    return total
+
+
+def disable(db: Session, variant_id: int) -> int:
+    # Folds the shards back into Variant.stock
+    total = sum(row.stock for row in locked_shards(db, variant_id))
+    db.execute(
+        delete(VariantStockShard).where(VariantStockShard.variant_id == variant_id)
+    )
+    db.execute(
+        update(Variant).where(Variant.variant_id == variant_id).values(stock=total)
+    )
+    return total
+
+
+def set_total(db: Session, variant_id: int, total: int):
+    # Admin stock update of a sharded variant
+    rows = locked_shards(db, variant_id)
+    for row, stock in zip(rows, spread(total, len(rows))):
+        row.stock = stock
+
+
+def take(db: Session, variant_id: int, shard: int, quantity: int) -> bool:
+    result = db.execute(
+        update(VariantStockShard)
+        .where(
+            VariantStockShard.variant_id == variant_id,
+            VariantStockShard.shard == shard,
+            VariantStockShard.stock >= quantity,
+        )
+        .values(stock=VariantStockShard.stock - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def reserve(db: Session, variant_id: int, quantity: int) -> bool:
+    # Conditional decrement of one random shard that can cover quantity. Only
+    # when none can is the quantity collected across shards; every decrement
+    # stays conditional, and on False the caller rolls back the partial takes.
+    candidates = [
+        shard
+        for (shard,) in db.query(VariantStockShard.shard).filter(
+            VariantStockShard.variant_id == variant_id,
+            VariantStockShard.stock >= quantity,
+        )
+    ]
+    random.shuffle(candidates)
+    for shard in candidates:
+        if take(db, variant_id, shard, quantity):
+            return True
+
+    remaining = quantity
+    shards = (
+        db.query(VariantStockShard.shard, VariantStockShard.stock)
+        .filter(VariantStockShard.variant_id == variant_id, VariantStockShard.stock > 0)
+        .order_by(VariantStockShard.shard)
+        .all()
+    )
+    for shard, stock in shards:
+        if remaining == 0:
+            break
+        taken = min(stock, remaining)
+        if not take(db, variant_id, shard, taken):
+            return False
+        remaining -= taken
+    return remaining == 0
+
+
+def restock(db: Session, variant_id: int, quantity: int):
+    # Returned units (a deleted order) go to one random shard, like a take
+    shards = [
+        shard
+        for (shard,) in db.query(VariantStockShard.shard).filter(
+            VariantStockShard.variant_id == variant_id
+        )
+    ]
+    db.execute(
+        update(VariantStockShard)
+        .where(
+            VariantStockShard.variant_id == variant_id,
+            VariantStockShard.shard == random.choice(shards),
+        )
+        .values(stock=VariantStockShard.stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebalance(db: Session, variant_id: int):
+    # Evens the shards out again (random picks drain them unevenly) and
+    # refreshes the Variant.stock snapshot and the read model's total_stock;
+    # returns the product id when the snapshot changed
+    rows = locked_shards(db, variant_id)
+    if not rows:
+        return
+    total = sum(row.stock for row in rows)
+    for row, stock in zip(rows, spread(total, len(rows))):
+        row.stock = stock
+    variant = db.query(Variant).filter(Variant.variant_id == variant_id).first()
+    if variant.stock == total:
+        return None
+    variant.stock = total
+    read_model.sync_products(db, Product.product_id == variant.product_id)
+    return variant.product_id
+
+
+def rebalance_all():
+    # One short transaction per variant
+    db = SessionLocal()
+    try:
+        variant_ids = [
+            variant_id
+            for (variant_id,) in db.query(VariantStockShard.variant_id).distinct()
+        ]
+        db.rollback()
+        for variant_id in variant_ids:
+            product_id = rebalance(db, variant_id)
+            db.commit()
+            if product_id is not None:
+                catalog_cache.invalidate("products", f"product:{product_id}")
+    finally:
+        db.close()
+
+
+async def rebalance_periodically():
+    while True:
+        await asyncio.sleep(STOCK_REBALANCE_INTERVAL)
+        try:
+            await run_in_threadpool(rebalance_all)
+        except Exception:
+            logger.exception("stock shard rebalance failed")
@@ -0,0 +1,121 @@
+# Runs the app against a throwaway SQLite file, or TEST_DATABASE_URL (for
+# example a scratch PostgreSQL database) when set. The environment has to be
+# in place before the app modules are imported.
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from itertools import count
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{DB_PATH}?timeout=60"
+)
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+from auth import create_access_token  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from models import Product, Users, Variant  # noqa: E402
+import read_model  # noqa: E402
+
+if os.environ["DATABASE_URL"].startswith("sqlite"):
+    # SQLite serializes writers, so parallel requests queue on the file lock;
+    # a connection per session keeps them from timing out on the pool first
+    SessionLocal.configure(
+        bind=create_engine(os.environ["DATABASE_URL"], poolclass=NullPool)
+    )
+
+serial = count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def db(client):
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def make_user(db):
+    def make_user(role: str = "user") -> tuple[Users, dict]:
+        user = Users(email=f"user{next(serial)}@example.com", password="", role=role)
+        db.add(user)
+        db.commit()
+        token = create_access_token(
+            {"sub": user.email, "role": user.role, "user_id": user.user_id}
+        )
+        return user, {"Authorization": f"Bearer {token}"}
+
+    return make_user
+
+
+@pytest.fixture
+def make_product(db):
+    def make_product(variants: int = 1, stock: int = 10) -> tuple[Product, list]:
+        n = next(serial)
+        product = Product(
+            product_name=f"product {n}",
+            prod_image="",
+            product_price=10,
+            product_description="",
+        )
+        db.add(product)
+        db.flush()
+        rows = [
+            Variant(
+                product_id=product.product_id,
+                name=f"variant {n}.{i}",
+                sku=f"sku-{n}-{i}",
+                price=10,
+                stock=stock,
+                available=True,
+            )
+            for i in range(variants)
+        ]
+        db.add_all(rows)
+        db.flush()
+        read_model.sync_products(db, Product.product_id == product.product_id)
+        db.commit()
+        return product, rows
+
+    return make_product
+
+
+@pytest.fixture
+def count_statements():
+    # Context manager collecting the SQL statements run inside it
+    @contextmanager
+    def count_statements():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+
+    return count_statements
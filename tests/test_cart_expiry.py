@@ -0,0 +1,28 @@
+from datetime import datetime, timedelta
+import cart_expiry
+from models import Cart
+
+
+def test_expire_batch_deletes_only_stale_lines(client, db, make_user, make_product):
+    product, (old, fresh) = make_product(variants=2)
+    user, headers = make_user("admin")
+    for variant, age in ((old, 40), (fresh, 1)):
+        db.add(
+            Cart(
+                user_id=user.user_id,
+                product_id=product.product_id,
+                variant_id=variant.variant_id,
+                quantity=1,
+                updated_at=datetime.utcnow() - timedelta(days=age),
+            )
+        )
+    db.commit()
+
+    stats = client.get("/admin/carts/expiry/stats", headers=headers).json()
+    assert stats["pending_rows"] >= 1
+
+    cutoff = datetime.utcnow() - timedelta(days=30)
+    assert cart_expiry.expire_batch(db, cutoff) >= 1
+    left = db.query(Cart.variant_id).filter(Cart.user_id == user.user_id).all()
+    assert left == [(fresh.variant_id,)]
+    assert cart_expiry.expire_batch(db, cutoff) == 0
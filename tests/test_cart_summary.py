@@ -0,0 +1,31 @@
+import cart_summary
+from models import Cart, CartSummary
+
+
+def test_refresh_overwrites_and_removes_summary_rows(
+    client, db, make_user, make_product
+):
+    product, (variant,) = make_product(stock=10)
+    user, _ = make_user()
+    line = Cart(
+        user_id=user.user_id,
+        product_id=product.product_id,
+        variant_id=variant.variant_id,
+        quantity=2,
+    )
+    db.add(line)
+    cart_summary.refresh(db, user.user_id)
+    db.commit()
+
+    # Refreshing over an existing row updates it in place
+    line.quantity = 5
+    cart_summary.refresh(db, user.user_id)
+    db.commit()
+    summary = db.get(CartSummary, user.user_id)
+    assert (summary.line_count, summary.item_count) == (1, 5)
+
+    db.delete(line)
+    cart_summary.refresh(db, user.user_id)
+    db.commit()
+    db.expire_all()
+    assert db.get(CartSummary, user.user_id) is None
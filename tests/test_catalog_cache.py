@@ -0,0 +1,37 @@
+import time
+from catalog_cache import CatalogCache, LRUCache, MemoryBackend
+
+
+def new_cache(shared=None) -> CatalogCache:
+    return CatalogCache(LRUCache(16, 60), shared)
+
+
+def test_restart_does_not_reissue_old_validators():
+    before = new_cache()
+    etag, _ = before.validators("products_query", ["products"])
+    before.invalidate("products")
+    time.sleep(0.001)
+
+    # A restarted process starts its tag versions from 0 again
+    after = new_cache()
+    assert after.validators("products_query", ["products"])[0] != etag
+    assert after.versioned_key("k", ["products"]) != before.versioned_key(
+        "k", ["products"]
+    )
+
+
+def test_workers_sharing_a_backend_agree_on_validators():
+    shared = MemoryBackend()
+    first, second = new_cache(shared), new_cache(shared)
+    assert first.validators("k", ["products"]) == second.validators("k", ["products"])
+    first.invalidate("products")
+    assert first.validators("k", ["products"]) == second.validators("k", ["products"])
+
+
+def test_flushed_backend_changes_validators():
+    shared = MemoryBackend()
+    cache = new_cache(shared)
+    etag, _ = cache.validators("k", ["products"])
+    time.sleep(0.001)
+    shared.counters.clear()
+    assert cache.validators("k", ["products"])[0] != etag
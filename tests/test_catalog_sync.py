@@ -0,0 +1,36 @@
+import catalog_sync
+import read_model
+from facet_index import facet_index
+from models import Brand, Product
+from price_index import price_index
+from search_index import suggest_index
+
+
+def test_sync_picks_up_other_workers_catalog_writes(client, db, make_product):
+    # make_product writes the product and its read-model row, as an admin
+    # request on another worker would, but leaves this worker's indexes alone
+    product, _ = make_product()
+    product_id = product.product_id
+    assert product_id not in price_index.product_ids()
+
+    catalog_sync.sync_once()
+    assert price_index.prices_by_id[product_id] == 10
+    assert product_id in facet_index.slots
+    assert ("product", product_id) in suggest_index.names
+
+    product.product_price = 25
+    read_model.sync_products(db, Product.product_id == product_id)
+    brand = Brand(brand_name="Synced Brand")
+    db.add(brand)
+    db.commit()
+    catalog_sync.sync_once()
+    assert price_index.prices_by_id[product_id] == 25
+    assert suggest_index.names[("brand", brand.brand_id)] == "Synced Brand"
+
+    read_model.remove_product(db, product_id)
+    db.delete(product)
+    db.commit()
+    catalog_sync.sync_once()
+    assert product_id not in price_index.product_ids()
+    assert product_id not in facet_index.slots
+    assert ("product", product_id) not in suggest_index.names
@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from sqlalchemy import func
+from models import Cart, OrderItem, Variant
+import stock_counters
+
+STOCK = 10
+BUYERS = 100
+
+
+def test_parallel_checkouts_never_oversell(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=STOCK)
+    buyers = []
+    for _ in range(BUYERS):
+        user, headers = make_user()
+        db.add(
+            Cart(
+                user_id=user.user_id,
+                product_id=product.product_id,
+                variant_id=variant.variant_id,
+                quantity=1,
+            )
+        )
+        buyers.append(headers)
+    db.commit()
+
+    barrier = threading.Barrier(BUYERS)
+
+    def checkout(headers):
+        barrier.wait()
+        return client.post("/order", headers=headers).status_code
+
+    with ThreadPoolExecutor(BUYERS) as pool:
+        codes = list(pool.map(checkout, buyers))
+
+    assert codes.count(201) == STOCK
+    assert codes.count(409) == BUYERS - STOCK
+    db.expire_all()
+    assert db.get(Variant, variant.variant_id).stock == 0
+    sold = (
+        db.query(func.sum(OrderItem.quantity))
+        .filter(OrderItem.variant_id == variant.variant_id)
+        .scalar()
+    )
+    assert sold == STOCK
+
+
+def test_checkout_changes_listing_etag(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=5)
+    user, headers = make_user()
+    db.add(
+        Cart(
+            user_id=user.user_id,
+            product_id=product.product_id,
+            variant_id=variant.variant_id,
+            quantity=2,
+        )
+    )
+    db.commit()
+    etag = client.get("/").headers["etag"]
+
+    assert client.post("/order", headers=headers).status_code == 201
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    listed = {item["product_id"]: item for item in response.json()}
+    assert listed[product.product_id]["total_stock"] == 3
+
+
+@pytest.mark.parametrize("shards", [0, 2])
+def test_deleting_pending_order_returns_stock(
+    client, db, make_user, make_product, shards
+):
+    product, (variant,) = make_product(stock=5)
+    if shards:
+        stock_counters.enable(db, variant.variant_id, shards)
+        db.commit()
+    _, headers = make_user()
+    line = {
+        "product_id": product.product_id,
+        "variant_id": variant.variant_id,
+        "quantity": 2,
+    }
+    assert client.post("/cart", json=line, headers=headers).status_code == 201
+    order = client.post("/order", headers=headers).json()["order"]
+    availability = f"/variants/{variant.variant_id}/availability"
+    assert client.get(availability).json()["available"] == 3
+
+    etag = client.get("/").headers["etag"]
+    response = client.delete(f"/order/{order['order_id']}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(availability).json()["available"] == 5
+
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    if not shards:
+        listed = {item["product_id"]: item for item in response.json()}
+        assert listed[product.product_id]["total_stock"] == 5
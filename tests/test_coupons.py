@@ -0,0 +1,88 @@
+from datetime import datetime
+from unittest import mock
+import coupons
+from models import Coupon
+
+
+def test_admin_writes_update_filter_without_rebuilding(client, make_user):
+    _, headers = make_user("admin")
+    coupon = {
+        "code": "FILTER-NEW",
+        "discount_type": "fixed",
+        "discount_value": 5,
+        "start_date": "2026-01-01T00:00:00",
+        "end_date": "2030-01-01T00:00:00",
+    }
+    with mock.patch.object(coupons, "rebuild_filter") as rebuild:
+        response = client.post("/admin/coupons", json=coupon, headers=headers)
+        assert response.status_code == 201
+        assert coupons.might_exist("FILTER-NEW")
+
+        coupon_id = next(
+            row["coupon_id"]
+            for row in client.get("/admin/coupons", headers=headers).json()
+            if row["code"] == "FILTER-NEW"
+        )
+        response = client.put(
+            f"/admin/coupons/{coupon_id}",
+            json={"is_active": True},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert coupons.might_exist("FILTER-NEW")
+
+        response = client.delete(f"/admin/coupons/{coupon_id}", headers=headers)
+        assert response.status_code == 200
+    rebuild.assert_not_called()
+
+
+def test_bulk_create_counts_inserted_rows(client, db):
+    template = {
+        "discount_type": "fixed",
+        "discount_value": 1,
+        "min_order_amount": 0,
+        "usage_limit": 1,
+        "usage_per_user": 1,
+        "is_active": True,
+        "start_date": datetime(2026, 1, 1),
+        "end_date": datetime(2030, 1, 1),
+    }
+    # The same key twice: the second run's first codes all exist already and
+    # have to be made up from further permutation indices
+    with mock.patch.object(coupons, "COUPON_BULK_BATCH", 10), mock.patch.object(
+        coupons.secrets, "token_bytes", return_value=b"k" * 16
+    ):
+        assert coupons.bulk_create(db, "BULK-", 25, 6, template)[0] == 25
+        assert coupons.bulk_create(db, "BULK-", 25, 6, template)[0] == 25
+    codes = db.query(Coupon.code).filter(Coupon.code.startswith("BULK-")).count()
+    assert codes == 50
+
+
+def test_refresh_adds_new_codes_without_rebuilding(db):
+    template = {
+        "discount_type": "fixed",
+        "discount_value": 1,
+        "start_date": datetime(2026, 1, 1),
+        "end_date": datetime(2030, 1, 1),
+    }
+    db.add(Coupon(code="REFRESH-OLD", **template))
+    db.commit()
+    coupons.rebuild_filter(db)
+    capacity = coupons.code_filter.capacity
+    room = capacity - coupons.code_filter.count
+
+    db.add_all(
+        Coupon(code=f"REFRESH-{n}", is_active=False, **template) for n in range(room)
+    )
+    db.commit()
+    with mock.patch.object(coupons, "rebuild_filter") as rebuild:
+        coupons.extend_filter(db)
+    rebuild.assert_not_called()
+    assert all(coupons.might_exist(f"REFRESH-{n}") for n in range(room))
+
+    # One more code than the filter was sized for: rebuilt with room to spare
+    db.add(Coupon(code="REFRESH-OVER", **template))
+    db.commit()
+    coupons.extend_filter(db)
+    assert coupons.might_exist("REFRESH-OVER")
+    assert coupons.code_filter.capacity > capacity
@@ -0,0 +1,106 @@
+import json
+import time
+from datetime import datetime, timedelta
+import idempotency
+import reservations
+from database import SessionLocal
+from models import IdempotencyKey
+
+
+def add_to_cart(client, headers, product, variant, quantity, key):
+    return client.post(
+        "/cart",
+        json={
+            "product_id": product.product_id,
+            "variant_id": variant.variant_id,
+            "quantity": quantity,
+        },
+        headers={**headers, "Idempotency-Key": key},
+    )
+
+
+def test_retry_replays_the_stored_response(client, make_user, make_product):
+    product, (variant,) = make_product(stock=5)
+    _, headers = make_user()
+
+    first = add_to_cart(client, headers, product, variant, 2, "retry-1")
+    assert first.status_code == 201
+    idempotency.stored_responses.clear()
+    # Answered from the table the second time, without holding stock again
+    for _ in range(2):
+        again = add_to_cart(client, headers, product, variant, 2, "retry-1")
+        assert again.status_code == 201
+        assert again.json() == first.json()
+        assert again.headers["Idempotent-Replayed"] == "true"
+    assert reservations.hold_index.held_quantity(variant.variant_id) == 2
+
+
+def test_key_reused_for_a_different_request_is_rejected(
+    client, make_user, make_product
+):
+    product, (variant,) = make_product(stock=5)
+    _, headers = make_user()
+
+    assert (
+        add_to_cart(client, headers, product, variant, 1, "reuse-1").status_code == 201
+    )
+    response = add_to_cart(client, headers, product, variant, 3, "reuse-1")
+    assert response.status_code == 422
+    assert reservations.hold_index.held_quantity(variant.variant_id) == 1
+
+
+def test_concurrent_retry_answers_with_the_winners_response(db, make_user):
+    user, _ = make_user()
+    request_hash = idempotency.fingerprint({"quantity": 1})
+    # The other request got its row in between this one's lookup and commit
+    winner = SessionLocal()
+    try:
+        winner.add(
+            IdempotencyKey(
+                user_id=user.user_id,
+                endpoint="POST /test",
+                key="race-1",
+                request_hash=request_hash,
+                status_code=201,
+                response_body=json.dumps({"message": "winner"}),
+            )
+        )
+        winner.commit()
+    finally:
+        winner.close()
+
+    response = idempotency.commit(
+        db,
+        user.user_id,
+        "POST /test",
+        "race-1",
+        request_hash,
+        201,
+        {"message": "loser"},
+    )
+    assert response.status_code == 201
+    assert json.loads(response.body) == {"message": "winner"}
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+
+def test_cached_key_expires_with_its_row(db, make_user):
+    user, _ = make_user()
+    request_hash = idempotency.fingerprint({"quantity": 1})
+    created_at = datetime.utcnow() - timedelta(seconds=idempotency.IDEMPOTENCY_TTL - 60)
+    db.add(
+        IdempotencyKey(
+            user_id=user.user_id,
+            endpoint="POST /test",
+            key="old-1",
+            request_hash=request_hash,
+            status_code=201,
+            response_body=json.dumps({"message": "stored"}),
+            created_at=created_at,
+        )
+    )
+    db.commit()
+
+    assert idempotency.lookup(db, user.user_id, "POST /test", "old-1", request_hash)
+    cache_key = idempotency.entry_key(user.user_id, "POST /test", "old-1")
+    expires_at, _ = idempotency.stored_responses.entries[cache_key]
+    assert expires_at - time.monotonic() <= 60
@@ -0,0 +1,10 @@
+import passwords
+
+
+def test_pool_started_at_startup_hashes_and_verifies(client):
+    executor = passwords.password_pool.executor
+    assert executor is not None
+    assert executor._mp_context.get_start_method() in ("forkserver", "spawn")
+    hashed = passwords.hash_password("secret")
+    assert passwords.verify_password("secret", hashed) == (True, None)
+    assert passwords.verify_password("wrong", hashed)[0] is False
@@ -0,0 +1,31 @@
+from models import Attribute, ProductAssignment, Term
+
+
+def detail_statements(client, db, make_product, count_statements, variants: int) -> int:
+    product, _ = make_product(variants=variants)
+    attribute = Attribute(attribute_name="Color")
+    db.add(attribute)
+    db.flush()
+    for value in range(variants):
+        term = Term(value=f"color {value}", attribute_id=attribute.attribute_id)
+        db.add(term)
+        db.flush()
+        db.add(ProductAssignment(product_id=product.product_id, term_id=term.term_id))
+    db.commit()
+    url = f"/products/{product.product_id}"
+
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert len(response.json()["variants"]) == variants
+    return len(statements)
+
+
+def test_product_detail_query_count_does_not_grow_with_variants(
+    client, db, make_product, count_statements
+):
+    one = detail_statements(client, db, make_product, count_statements, variants=1)
+    many = detail_statements(client, db, make_product, count_statements, variants=25)
+    # Product with its taxonomy joined in, then one SELECT ... IN each for
+    # variants and for assignments with their terms and attributes
+    assert one == many == 3
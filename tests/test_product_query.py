@@ -0,0 +1,32 @@
+import price_index
+
+
+def test_cursor_from_another_sort_is_rejected(client, make_product):
+    for _ in range(3):
+        make_product()
+    page = client.get("/products/query", params={"sort": "name", "limit": 1}).json()
+    cursor = page["next_cursor"]
+    assert cursor
+
+    for sort in ("price_asc", "price_desc", "id"):
+        response = client.get(
+            "/products/query", params={"sort": sort, "limit": 1, "cursor": cursor}
+        )
+        assert response.status_code == 400
+
+    response = client.get(
+        "/products/query", params={"sort": "name", "limit": 1, "cursor": cursor}
+    )
+    assert response.status_code == 200
+
+
+def test_price_cursor_continues_on_the_price_index(client, db, make_product):
+    for _ in range(3):
+        make_product()
+    price_index.rebuild(db)
+    params = {"sort": "price_asc", "limit": 1}
+    first = client.get("/products/query", params=params).json()
+    second = client.get(
+        "/products/query", params={**params, "cursor": first["next_cursor"]}
+    ).json()
+    assert first["items"][0]["product_id"] != second["items"][0]["product_id"]
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+import reservations
+from models import StockReservation
+
+
+def add_to_cart(client, headers, product, variant, quantity):
+    return client.post(
+        "/cart",
+        json={
+            "product_id": product.product_id,
+            "variant_id": variant.variant_id,
+            "quantity": quantity,
+        },
+        headers=headers,
+    )
+
+
+def availability(client, variant):
+    return client.get(f"/variants/{variant.variant_id}/availability").json()
+
+
+def test_holds_are_shared_through_the_ledger(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=3)
+    _, first = make_user()
+    _, second = make_user()
+
+    assert add_to_cart(client, first, product, variant, 2).status_code == 201
+    assert availability(client, variant)["available"] == 1
+    # Read from the database, so any worker refuses the second cart
+    assert reservations.held_quantity(db, variant.variant_id) == 2
+    assert add_to_cart(client, second, product, variant, 2).status_code == 400
+    assert add_to_cart(client, second, product, variant, 1).status_code == 201
+    assert availability(client, variant)["available"] == 0
+
+
+def test_add_to_cart_rejects_non_positive_quantity(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=3)
+    _, headers = make_user()
+
+    for quantity in (0, -5):
+        assert (
+            add_to_cart(client, headers, product, variant, quantity).status_code == 400
+        )
+    assert availability(client, variant) == {
+        "variant_id": variant.variant_id,
+        "stock": 3,
+        "held": 0,
+        "available": 3,
+    }
+
+
+def test_expired_holds_lapse_and_are_closed_once(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=3)
+    user, headers = make_user()
+    assert add_to_cart(client, headers, product, variant, 3).status_code == 201
+    db.query(StockReservation).filter(
+        StockReservation.variant_id == variant.variant_id
+    ).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    # Other workers' index copies follow the ledger on their next sync
+    reservations.sync_once()
+
+    assert availability(client, variant)["available"] == 3
+    # Every worker runs the sweeper
+    reservations.sweep()
+    reservations.sweep()
+    expired = (
+        db.query(StockReservation)
+        .filter(
+            StockReservation.variant_id == variant.variant_id,
+            StockReservation.entry == "expire",
+        )
+        .count()
+    )
+    assert expired == 1
+
+
+def test_index_follows_commits_and_other_workers(
+    client, db, make_user, make_product, count_statements
+):
+    product, (variant,) = make_product(stock=5)
+    user, headers = make_user()
+    index = reservations.hold_index
+
+    # A rolled-back hold never reaches the index
+    reservations.hold(db, user.user_id, variant.variant_id, 2, 5)
+    db.rollback()
+    assert index.held_quantity(variant.variant_id) == 0
+
+    assert add_to_cart(client, headers, product, variant, 2).status_code == 201
+    assert index.held_quantity(variant.variant_id) == 2
+    assert index.held_quantity(variant.variant_id, exclude_user=user.user_id) == 0
+
+    # A hold written by another worker shows up after the next sync
+    other, _ = make_user()
+    db.add(
+        StockReservation(
+            hold_id="other-worker",
+            entry="hold",
+            variant_id=variant.variant_id,
+            user_id=other.user_id,
+            quantity=1,
+            expires_at=datetime.utcnow() + timedelta(minutes=5),
+        )
+    )
+    db.commit()
+    reservations.sync_once()
+    assert index.held_quantity(variant.variant_id) == 3
+
+    # Availability reads never touch the ledger
+    with count_statements() as statements:
+        assert availability(client, variant)["available"] == 2
+    assert not any("stock_reservations" in statement for statement in statements)
+
+
+def test_cart_items_statements_do_not_grow_with_lines(
+    client, make_user, make_product, count_statements
+):
+    def post_items(lines: int) -> int:
+        product, variants = make_product(variants=lines, stock=5)
+        _, headers = make_user()
+        items = [
+            {
+                "product_id": product.product_id,
+                "variant_id": variant.variant_id,
+                "quantity": 2,
+            }
+            for variant in variants
+        ]
+        with count_statements() as statements:
+            response = client.post(
+                "/cart/items", json={"items": items}, headers=headers
+            )
+        assert response.status_code == 201
+        assert all(
+            availability(client, variant)["available"] == 3 for variant in variants
+        )
+        return len(statements)
+
+    assert post_items(1) == post_items(30)
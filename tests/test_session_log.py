@@ -0,0 +1,38 @@
+import session_log
+from models import UserSession
+
+
+def login(user, headers):
+    token = headers["Authorization"].removeprefix("Bearer ")
+    session_log.record_login(user.user_id, token, None, None)
+    return token
+
+
+def test_logout_before_session_is_written_on_another_worker(client, db, make_user):
+    user, headers = make_user()
+    token = login(user, headers)
+    # The login was handled by another worker: its row is in that queue
+    with session_log.session_log.lock:
+        other_worker = list(session_log.session_log.queue)
+        session_log.session_log.queue.clear()
+
+    assert client.post("/admin/logout", headers=headers).status_code == 200
+    assert client.get("/cart/summary", headers=headers).status_code == 401
+
+    # The other worker flushes later; this worker's writer closes the row
+    with session_log.session_log.lock:
+        session_log.session_log.queue.extend(other_worker)
+    session_log.flush()
+    row = db.query(UserSession).filter(UserSession.token == token).one()
+    assert not row.is_active
+    assert row.logout_time is not None
+    assert token not in session_log.session_log.pending_logouts
+
+
+def test_logout_right_after_login_on_the_same_worker(client, db, make_user):
+    user, headers = make_user()
+    token = login(user, headers)
+
+    assert client.post("/admin/logout", headers=headers).status_code == 200
+    row = db.query(UserSession).filter(UserSession.token == token).one()
+    assert not row.is_active
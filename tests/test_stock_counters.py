@@ -0,0 +1,23 @@
+import stock_counters
+
+
+def test_cart_reads_shard_stock_not_snapshot(client, db, make_user, make_product):
+    product, (variant,) = make_product(stock=10)
+    _, headers = make_user()
+    stock_counters.enable(db, variant.variant_id, shards=2)
+    db.commit()
+    # Sold through the shards; Variant.stock still says 10 until a rebalance
+    assert stock_counters.reserve(db, variant.variant_id, 6)
+    db.commit()
+
+    availability = client.get(f"/variants/{variant.variant_id}/availability").json()
+    assert (availability["stock"], availability["available"]) == (4, 4)
+
+    line = {
+        "product_id": product.product_id,
+        "variant_id": variant.variant_id,
+        "quantity": 5,
+    }
+    assert client.post("/cart", json=line, headers=headers).status_code == 400
+    line["quantity"] = 4
+    assert client.post("/cart", json=line, headers=headers).status_code == 201
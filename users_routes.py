@@ -1,105 +1,682 @@
+import base64
 from datetime import datetime
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+import json
+import os
+from typing import List, Optional
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import and_, insert, or_, update
 from admin_schemas import AddressCreate, AddressOut, ProductOut
 from auth import get_current_user, user_required
-from database import get_db
+from catalog_cache import cache_key, catalog_cache, not_modified
+from database import SessionLocal, dialect_insert, get_db
+from facet_index import facet_index
+import cart_summary
+import coupons
+import idempotency
+import read_model
+import reservations
+import stock_counters
+from price_index import price_index
+from search_index import SUGGEST_MAX_LIMIT, product_index, suggest_index
 from models import (
+    Attribute,
     Brand,
     Cart,
     Category,
-    Coupon,
     Order,
     OrderItem,
     Product,
+    ProductAssignment,
+    ProductReadModel,
+    StockReservation,
     SubCategory,
+    Term,
     UserAddress,
     Variant,
     WishList,
 )
-from users_schemas import AddCart, OrderSchemaOut, OrderUpdateStatusSchema, ProductsList
-
+from users_schemas import (
+    AddCart,
+    AddCartItems,
+    FacetPage,
+    OrderSchemaOut,
+    OrderUpdateStatusSchema,
+    ProductDetail,
+    ProductPage,
+    ProductQueryPage,
+    ProductsList,
+)
 
 user_router = APIRouter()
 
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 50))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 500))
+CATALOG_STREAM_BATCH = 1000
+HYDRATE_BATCH = 500
+
+
+def product_list(products) -> list[dict]:
+    # Cache-friendly (plain data) form of a ProductsList response
+    return [ProductsList.model_validate(product).model_dump() for product in products]
+
+
+def stream_products(after: Optional[int]):
+    # Own session: the response body is produced after the request dependencies
+    # may already have been torn down. yield_per uses a server-side cursor so
+    # only one batch of rows is held in memory at a time.
+    db = SessionLocal()
+    try:
+        query = db.query(ProductReadModel).order_by(ProductReadModel.product_id)
+        if after is not None:
+            query = query.filter(ProductReadModel.product_id > after)
+        for product in query.yield_per(CATALOG_STREAM_BATCH):
+            yield ProductsList.model_validate(product).model_dump_json() + "\n"
+    finally:
+        db.close()
+
+
+@user_router.get("/", response_model=list[ProductsList] | ProductPage)
+def read_root(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    stream: bool = False,
+    db: Session = Depends(get_db),
+):
+    key = cache_key("read_root", limit=limit, after=after, stream=stream)
+    cached = not_modified(request, response, key, ["products"])
+    if cached:
+        return cached
+
+    # ?stream=true -> NDJSON, one product per line, flat memory
+    if stream:
+        return StreamingResponse(
+            stream_products(after),
+            media_type="application/x-ndjson",
+            headers={
+                name: response.headers[name] for name in ("etag", "last-modified")
+            },
+        )
+
+    # Legacy full listing when no pagination is asked for
+    if limit is None and after is None:
+        return catalog_cache.get_or_load(
+            key, ["products"], lambda: product_list(db.query(ProductReadModel).all())
+        )
+
+    # Keyset pagination on product_id; fetch one extra row to detect a next page
+    page_size = limit or CATALOG_PAGE_SIZE
+
+    def load_page():
+        query = db.query(ProductReadModel).order_by(ProductReadModel.product_id)
+        if after is not None:
+            query = query.filter(ProductReadModel.product_id > after)
+        products = query.limit(page_size + 1).all()
+
+        next_cursor = None
+        if len(products) > page_size:
+            products = products[:page_size]
+            next_cursor = products[-1].product_id
+        return ProductPage(items=products, next_cursor=next_cursor).model_dump()
 
-@user_router.get("/", response_model=list[ProductsList])
-def read_root(db: Session = Depends(get_db)):
-    products = db.query(Product).all()
-    return products
+    return catalog_cache.get_or_load(key, ["products"], load_page)
 
 
 @user_router.get("/getproduct/{id}", response_model=ProductOut)
 def get_all_products(
-    id: int, current_user=Depends(user_required), db: Session = Depends(get_db)
+    id: int,
+    request: Request,
+    response: Response,
+    current_user=Depends(user_required),
+    db: Session = Depends(get_db),
 ):
-    found_product = db.query(Product).filter(Product.product_id == id).first()
-    if not found_product:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Product Not Found"
+    key = cache_key("getproduct", id=id)
+    cached = not_modified(request, response, key, [f"product:{id}"])
+    if cached:
+        return cached
+
+    def load_product():
+        found_product = db.query(Product).filter(Product.product_id == id).first()
+        if not found_product:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Product Not Found"
+            )
+        return ProductOut.model_validate(
+            found_product, from_attributes=True
+        ).model_dump()
+
+    return catalog_cache.get_or_load(key, [f"product:{id}"], load_product)
+
+
+# sort name -> (column, descending)
+PRODUCT_SORTS = {
+    "id": (ProductReadModel.product_id, False),
+    "price_asc": (ProductReadModel.product_price, False),
+    "price_desc": (ProductReadModel.product_price, True),
+    "name": (ProductReadModel.product_name, False),
+}
+
+
+def encode_cursor(sort: str, sort_value, product_id: int) -> str:
+    raw = json.dumps([sort, sort_value, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str, sort: str):
+    # A cursor only continues the sort it was issued for: another sort's
+    # value (a name under a price sort, say) would not compare
+    try:
+        cursor_sort, sort_value, product_id = json.loads(
+            base64.urlsafe_b64decode(cursor)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort")
+    value_type = str if sort == "name" else (int, float)
+    if not isinstance(product_id, int) or not isinstance(sort_value, value_type):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, product_id
+
+
+def build_product_query(
+    db: Session,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    brand_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    sub_category_id: Optional[int] = None,
+    q: Optional[str] = None,
+    sort: str = "id",
+    cursor: Optional[str] = None,
+):
+    column, descending = PRODUCT_SORTS[sort]
+
+    query = db.query(ProductReadModel)
+    if brand_id is not None:
+        query = query.filter(ProductReadModel.brand_id == brand_id)
+    if category_id is not None:
+        query = query.filter(ProductReadModel.category_id == category_id)
+    if sub_category_id is not None:
+        query = query.filter(ProductReadModel.sub_category_id == sub_category_id)
+    if min_price is not None:
+        query = query.filter(ProductReadModel.product_price >= min_price)
+    if max_price is not None:
+        query = query.filter(ProductReadModel.product_price <= max_price)
+    if q and q.strip():
+        term = f"%{q.strip()}%"
+        query = query.filter(
+            or_(
+                ProductReadModel.product_name.ilike(term),
+                ProductReadModel.product_description.ilike(term),
+            )
         )
-    return found_product
 
+    # Keyset on (sort column, product_id) so deep pages cost the same as page one
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort)
+        if column is ProductReadModel.product_id:
+            query = query.filter(
+                ProductReadModel.product_id < last_id
+                if descending
+                else ProductReadModel.product_id > last_id
+            )
+        elif descending:
+            query = query.filter(
+                or_(
+                    column < sort_value,
+                    and_(column == sort_value, ProductReadModel.product_id < last_id),
+                )
+            )
+        else:
+            query = query.filter(
+                or_(
+                    column > sort_value,
+                    and_(column == sort_value, ProductReadModel.product_id > last_id),
+                )
+            )
 
-@user_router.get("/products/filter/price", response_model=list[ProductsList])
-def filter_by_price(min_price: float, max_price: float, db: Session = Depends(get_db)):
-    products = (
-        db.query(Product)
-        .filter(Product.product_price >= min_price, Product.product_price <= max_price)
-        .all()
+    if descending:
+        return query.order_by(column.desc(), ProductReadModel.product_id.desc())
+    return query.order_by(column, ProductReadModel.product_id)
+
+
+def hydrate(db: Session, product_ids: list[int]) -> list[ProductReadModel]:
+    # Read-model rows for ids resolved in memory, in the order given
+    rows = {}
+    for start in range(0, len(product_ids), HYDRATE_BATCH):
+        batch = product_ids[start : start + HYDRATE_BATCH]
+        for row in db.query(ProductReadModel).filter(
+            ProductReadModel.product_id.in_(batch)
+        ):
+            rows[row.product_id] = row
+    return [rows[product_id] for product_id in product_ids if product_id in rows]
+
+
+def price_index_page(
+    db: Session,
+    min_price: Optional[float],
+    max_price: Optional[float],
+    sort: str,
+    cursor: Optional[str],
+    limit: int,
+):
+    # Range, order and keyset position come from the in-memory price index;
+    # the database is only asked for the page's rows by primary key. Cursors
+    # are interchangeable with the SQL path's (price, product_id) cursors.
+    after = decode_cursor(cursor, sort) if cursor else None
+    entries = price_index.page(
+        min_price, max_price, limit + 1, after, descending=sort == "price_desc"
     )
-    return products
+    page = entries[:limit]
+    products = hydrate(db, [product_id for _, product_id in page])
+    next_cursor = encode_cursor(sort, *page[-1]) if len(entries) > limit else None
+    return products, next_cursor
+
+
+@user_router.get("/products/query", response_model=ProductQueryPage)
+def query_products(
+    request: Request,
+    response: Response,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    brand_id: Optional[int] = None,
+    category_id: Optional[int] = None,
+    sub_category_id: Optional[int] = None,
+    q: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|price_asc|price_desc|name)$"),
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    filters = dict(
+        min_price=min_price,
+        max_price=max_price,
+        brand_id=brand_id,
+        category_id=category_id,
+        sub_category_id=sub_category_id,
+        q=q,
+        sort=sort,
+        cursor=cursor,
+    )
+    key = cache_key("products_query", limit=limit, **filters)
+    cached = not_modified(request, response, key, ["products"])
+    if cached:
+        return cached
+
+    price_only = (brand_id, category_id, sub_category_id) == (None, None, None)
+    price_only = price_only and not (q and q.strip())
+
+    def load_page():
+        if price_only and sort in ("price_asc", "price_desc"):
+            products, next_cursor = price_index_page(
+                db, min_price, max_price, sort, cursor, limit
+            )
+            return ProductQueryPage(
+                items=products, next_cursor=next_cursor
+            ).model_dump()
+
+        products = build_product_query(db, **filters).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            column = PRODUCT_SORTS[sort][0]
+            next_cursor = encode_cursor(
+                sort, getattr(last, column.key), last.product_id
+            )
+        return ProductQueryPage(items=products, next_cursor=next_cursor).model_dump()
+
+    return catalog_cache.get_or_load(key, ["products"], load_page)
+
+
+# facet -> (id column, name column) used to label the counts
+FACET_LABELS = {
+    "brand": (Brand.brand_id, Brand.brand_name),
+    "category": (Category.category_id, Category.category_name),
+    "subcategory": (SubCategory.sub_category_id, SubCategory.sub_category_name),
+}
+
+
+def facet_values(db: Session, counts: dict[str, dict[int, int]]) -> dict:
+    # One small IN query per facet for the labels of the values that matched;
+    # values whose brand/category/term has since been deleted are dropped
+    facets = {}
+    for name, facet_counts in counts.items():
+        if name == "term":
+            labels = {
+                term_id: (value, attribute_name)
+                for term_id, value, attribute_name in db.query(
+                    Term.term_id, Term.value, Attribute.attribute_name
+                )
+                .outerjoin(Attribute, Attribute.attribute_id == Term.attribute_id)
+                .filter(Term.term_id.in_(facet_counts))
+            }
+        else:
+            pk, label = FACET_LABELS[name]
+            labels = {
+                ref_id: (ref_name, None)
+                for ref_id, ref_name in db.query(pk, label).filter(pk.in_(facet_counts))
+            }
+        values = [
+            {
+                "id": value,
+                "name": labels[value][0],
+                "count": count,
+                "attribute_name": labels[value][1],
+            }
+            for value, count in facet_counts.items()
+            if value in labels
+        ]
+        facets[name] = sorted(values, key=lambda item: (-item["count"], item["name"]))
+    return facets
+
+
+@user_router.get("/products/facets", response_model=FacetPage)
+def facet_products(
+    request: Request,
+    response: Response,
+    brand_id: List[int] = Query([]),
+    category_id: List[int] = Query([]),
+    sub_category_id: List[int] = Query([]),
+    term_id: List[int] = Query([]),
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    after: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    # Values within a facet are ORed, facets are ANDed. The matching ids and
+    # every facet count come from the in-memory bitsets; only the page of
+    # products and the facet labels are read from the database.
+    selected = {
+        "brand": sorted(set(brand_id)),
+        "category": sorted(set(category_id)),
+        "subcategory": sorted(set(sub_category_id)),
+        "term": sorted(set(term_id)),
+    }
+    tags = [
+        "products",
+        "brands",
+        "categories",
+        "subcategories",
+        "attributes",
+        "assignments",
+    ]
+    key = cache_key("facets", limit=limit, after=after, **selected)
+    cached = not_modified(request, response, key, tags)
+    if cached:
+        return cached
+
+    def load_facets():
+        product_ids, counts = facet_index.search(selected)
+        start = 0 if after is None else int(product_ids.searchsorted(after, "right"))
+        page = product_ids[start : start + limit].tolist()
+        products = (
+            db.query(ProductReadModel)
+            .filter(ProductReadModel.product_id.in_(page))
+            .order_by(ProductReadModel.product_id)
+            .all()
+        )
+        next_cursor = page[-1] if start + limit < len(product_ids) else None
+        return FacetPage(
+            total=len(product_ids),
+            items=products,
+            next_cursor=next_cursor,
+            facets=facet_values(db, counts),
+        ).model_dump()
+
+    return catalog_cache.get_or_load(key, tags, load_facets)
+
+
+def attribute_matrix(assignments) -> list[dict]:
+    # ProductAssignment rows -> one entry per attribute with its assigned terms
+    matrix = {}
+    for assignment in assignments:
+        term = assignment.term
+        if term is None:  # assignment left behind by a term delete
+            continue
+        attribute = term.attribute
+        entry = matrix.setdefault(
+            term.attribute_id,
+            {
+                "attribute_id": term.attribute_id,
+                "attribute_name": attribute.attribute_name if attribute else None,
+                "terms": [],
+            },
+        )
+        if all(known["term_id"] != term.term_id for known in entry["terms"]):
+            entry["terms"].append({"term_id": term.term_id, "value": term.value})
+    return sorted(matrix.values(), key=lambda entry: entry["attribute_id"] or 0)
+
+
+@user_router.get("/products/{id}", response_model=ProductDetail)
+def get_product_detail(
+    id: int, request: Request, response: Response, db: Session = Depends(get_db)
+):
+    # Fixed query count whatever the number of variants/terms: the product with
+    # its brand/category/subcategory joined in, then one SELECT ... IN each for
+    # variants and for assignments (with term and attribute joined in)
+    tags = [f"product:{id}", "brands", "categories", "subcategories", "attributes"]
+    key = cache_key("product_detail", id=id)
+    cached = not_modified(request, response, key, tags)
+    if cached:
+        return cached
+
+    def load_detail():
+        product = (
+            db.query(Product)
+            .options(
+                joinedload(Product.brand),
+                joinedload(Product.category),
+                joinedload(Product.sub_category),
+                selectinload(Product.variants),
+                selectinload(Product.assignments)
+                .joinedload(ProductAssignment.term)
+                .joinedload(Term.attribute),
+            )
+            .filter(Product.product_id == id)
+            .first()
+        )
+        if not product:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Product Not Found"
+            )
+        return ProductDetail(
+            product_id=product.product_id,
+            product_name=product.product_name,
+            prod_image=product.prod_image,
+            product_price=product.product_price,
+            product_description=product.product_description,
+            brand_id=product.brand_id,
+            brand_name=product.brand.brand_name if product.brand else None,
+            category_id=product.category_id,
+            category_name=product.category.category_name if product.category else None,
+            sub_category_id=product.sub_category_id,
+            sub_category_name=(
+                product.sub_category.sub_category_name if product.sub_category else None
+            ),
+            variants=sorted(product.variants, key=lambda variant: variant.variant_id),
+            attributes=attribute_matrix(product.assignments),
+        ).model_dump()
+
+    return catalog_cache.get_or_load(key, tags, load_detail)
+
+
+@user_router.get("/variants/{variant_id}/availability")
+def variant_availability(variant_id: int, db: Session = Depends(get_db)):
+    # stock - active holds, with the holds read from this worker's index
+    variant = db.get(Variant, variant_id)
+    if not variant:
+        return JSONResponse(status_code=404, content={"detail": "Variant Not Found"})
+    stock = stock_counters.current(db, {variant_id: variant.stock})[variant_id]
+    held = reservations.hold_index.held_quantity(variant_id)
+    return {
+        "variant_id": variant_id,
+        "stock": stock,
+        "held": held,
+        "available": max(stock - held, 0),
+    }
+
+
+@user_router.get(
+    "/products/filter/price", response_model=list[ProductsList], deprecated=True
+)
+def filter_by_price(
+    min_price: float,
+    max_price: float,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    key = cache_key("filter_price", min_price=min_price, max_price=max_price)
+    cached = not_modified(request, response, key, ["products"])
+    if cached:
+        return cached
+
+    def load_products():
+        entries = price_index.page(min_price, max_price, len(price_index))
+        return product_list(hydrate(db, [product_id for _, product_id in entries]))
+
+    return catalog_cache.get_or_load(key, ["products"], load_products)
 
 
 @user_router.get(
-    "/products/filter/category/{category_id}", response_model=list[ProductsList]
+    "/products/filter/category/{category_id}",
+    response_model=list[ProductsList],
+    deprecated=True,
 )
-def filter_by_category(category_id: int, db: Session = Depends(get_db)):
-    products = db.query(Product).filter(Product.category_id == category_id).all()
-    return products
+def filter_by_category(
+    category_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    key = cache_key("filter_category", category_id=category_id)
+    cached = not_modified(request, response, key, ["products"])
+    if cached:
+        return cached
+
+    return catalog_cache.get_or_load(
+        key,
+        ["products"],
+        lambda: product_list(
+            db.query(ProductReadModel)
+            .filter(ProductReadModel.category_id == category_id)
+            .all()
+        ),
+    )
 
 
-@user_router.get("/products/filter/brand/{brand_id}", response_model=list[ProductsList])
-def filter_by_brand(brand_id: int, db: Session = Depends(get_db)):
-    products = db.query(Product).filter(Product.brand_id == brand_id).all()
-    return products
+@user_router.get(
+    "/products/filter/brand/{brand_id}",
+    response_model=list[ProductsList],
+    deprecated=True,
+)
+def filter_by_brand(
+    brand_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    key = cache_key("filter_brand", brand_id=brand_id)
+    cached = not_modified(request, response, key, ["products"])
+    if cached:
+        return cached
+
+    return catalog_cache.get_or_load(
+        key,
+        ["products"],
+        lambda: product_list(
+            db.query(ProductReadModel)
+            .filter(ProductReadModel.brand_id == brand_id)
+            .all()
+        ),
+    )
+
+
+@user_router.get("/search/suggest")
+def suggest_products(prefix: str, limit: int = Query(10, ge=1, le=SUGGEST_MAX_LIMIT)):
+    # Served entirely from memory: no session, no auth lookup per keystroke
+    return suggest_index.suggest(prefix, limit=limit)
 
 
 @user_router.get("/search")
 def search_product(
-    query: str, db: Session = Depends(get_db), current_user=Depends(user_required)
+    query: str,
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+    fuzzy: bool = False,
+    db: Session = Depends(get_db),
+    current_user=Depends(user_required),
 ):
-    search_term = f"%{query.strip()}%"
-
-    results = (
-        db.query(Product)
-        .outerjoin(Brand, Product.brand_id == Brand.brand_id)
-        .outerjoin(Category, Product.category_id == Category.category_id)
-        .outerjoin(SubCategory, Product.sub_category_id == SubCategory.sub_category_id)
-        .filter(
-            or_(
-                func.lower(Product.product_name).like(search_term.lower()),
-                func.lower(Product.product_description).like(search_term.lower()),
-                func.lower(Brand.brand_name).like(search_term.lower()),
-                func.lower(Category.category_name).like(search_term.lower()),
-                func.lower(SubCategory.sub_category_name).like(search_term.lower()),
-            )
-        )
+    # Ranked ids come from the in-memory inverted index; only the top hits
+    # are loaded, by primary key. A query with no exact hits falls back to
+    # typo-tolerant matching instead of making the client retry.
+    ranked = product_index.search(query, limit=limit, fuzzy=fuzzy)
+    if not ranked and not fuzzy:
+        ranked = product_index.search(query, limit=limit, fuzzy=True)
+    if not ranked:
+        return []
+
+    ids = [product_id for product_id, _ in ranked]
+    found = {
+        product.product_id: product
+        for product in db.query(ProductReadModel)
+        .filter(ProductReadModel.product_id.in_(ids))
         .all()
-    )
+    }
+    return [found[product_id] for product_id in ids if product_id in found]
 
-    return results
+
+def upsert_cart_lines(db: Session, lines: list[dict]):
+    # One INSERT ... ON CONFLICT for all lines: new variants are inserted,
+    # variants already in the cart have the quantity added
+    now = datetime.utcnow()
+    statement = dialect_insert(db)(Cart).values(
+        [dict(line, updated_at=now) for line in lines]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[Cart.user_id, Cart.variant_id],
+        set_={
+            "quantity": Cart.quantity + statement.excluded.quantity,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    db.execute(statement)
 
 
 @user_router.post("/cart")
 def add_to_cart(
-    request: AddCart, current_user=Depends(user_required), db: Session = Depends(get_db)
+    request: AddCart,
+    current_user=Depends(user_required),
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
     cuser_id = current_user.user_id
 
+    request_hash = idempotency.fingerprint(request.model_dump())
+    replayed = idempotency.lookup(
+        db, cuser_id, "POST /cart", idempotency_key, request_hash
+    )
+    if replayed:
+        return replayed
+
+    if request.quantity <= 0:
+        return JSONResponse(
+            status_code=400, content={"detail": "Quantity must be positive"}
+        )
+
     found_product = (
         db.query(Product).filter(Product.product_id == request.product_id).first()
     )
@@ -117,33 +694,142 @@ def add_to_cart(
             status_code=400, content={"detail": "Variant Not belong to the product"}
         )
 
-    if found_variant.stock < request.quantity:
+    # Holds the quantity for RESERVATION_TTL; expired holds are swept and
+    # their units offered to other carts again
+    variant_id = request.variant_id
+    stock = stock_counters.current(db, {variant_id: found_variant.stock})[variant_id]
+    if not reservations.hold(db, cuser_id, variant_id, request.quantity, stock):
         return JSONResponse(status_code=400, content={"detail": "No stock"})
 
-    cart_item = (
-        db.query(Cart)
-        .filter_by(
-            user_id=cuser_id,
-            variant_id=request.variant_id,
-            product_id=request.product_id,
-        )
-        .first()
+    upsert_cart_lines(
+        db,
+        [
+            {
+                "user_id": cuser_id,
+                "product_id": request.product_id,
+                "variant_id": request.variant_id,
+                "quantity": request.quantity,
+            }
+        ],
+    )
+    cart_summary.refresh(db, cuser_id)
+
+    response = idempotency.commit(
+        db,
+        cuser_id,
+        "POST /cart",
+        idempotency_key,
+        request_hash,
+        201,
+        {"message": "Item added to the cart"},
+    )
+    cart_summary.invalidate(cuser_id)
+    return response
+
+
+@user_router.post("/cart/items")
+def add_items_to_cart(
+    request: AddCartItems,
+    current_user=Depends(user_required),
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    user_id = current_user.user_id
+
+    request_hash = idempotency.fingerprint(request.model_dump())
+    replayed = idempotency.lookup(
+        db, user_id, "POST /cart/items", idempotency_key, request_hash
     )
+    if replayed:
+        return replayed
+
+    # Repeated variants in the list are merged into one line
+    wanted = {}
+    for item in request.items:
+        if item.quantity <= 0:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "detail": "Quantity must be positive",
+                    "variant_id": item.variant_id,
+                },
+            )
+        product_id, quantity = wanted.get(item.variant_id, (item.product_id, 0))
+        if product_id != item.product_id:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "detail": "Variant Not belong to the product",
+                    "variant_id": item.variant_id,
+                },
+            )
+        wanted[item.variant_id] = (product_id, quantity + item.quantity)
+
+    # Every variant validated in one query
+    variants = {
+        variant.variant_id: variant
+        for variant in db.query(
+            Variant.variant_id, Variant.product_id, Variant.stock, Variant.available
+        ).filter(Variant.variant_id.in_(list(wanted)))
+    }
+    for variant_id, (product_id, _) in wanted.items():
+        variant = variants.get(variant_id)
+        if not variant:
+            return JSONResponse(
+                status_code=404,
+                content={"detail": "Variant Not Found", "variant_id": variant_id},
+            )
+        if variant.product_id != product_id:
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "detail": "Variant Not belong to the product",
+                    "variant_id": variant_id,
+                },
+            )
 
-    if cart_item:
-        cart_item.quantity += request.quantity
-    else:
-        cart_item = Cart(
-            user_id=cuser_id,
-            product_id=request.product_id,
-            variant_id=request.variant_id,
-            quantity=request.quantity,
+    # All lines are held or none are, in one batch of statements
+    short = next(
+        (variant_id for variant_id in wanted if not variants[variant_id].available),
+        None,
+    )
+    if short is None:
+        stocks = stock_counters.current(
+            db, {variant_id: variant.stock for variant_id, variant in variants.items()}
+        )
+        lines = {variant_id: quantity for variant_id, (_, quantity) in wanted.items()}
+        short = reservations.hold_lines(db, user_id, lines, stocks)
+    if short is not None:
+        db.rollback()
+        return JSONResponse(
+            status_code=400,
+            content={"detail": "No stock", "variant_id": short},
         )
-        db.add(cart_item)
 
-    db.commit()
-    db.refresh(cart_item)
-    return JSONResponse(status_code=201, content={"message": "Item added to the cart"})
+    upsert_cart_lines(
+        db,
+        [
+            {
+                "user_id": user_id,
+                "product_id": product_id,
+                "variant_id": variant_id,
+                "quantity": quantity,
+            }
+            for variant_id, (product_id, quantity) in wanted.items()
+        ],
+    )
+    cart_summary.refresh(db, user_id)
+    response = idempotency.commit(
+        db,
+        user_id,
+        "POST /cart/items",
+        idempotency_key,
+        request_hash,
+        201,
+        {"message": "Items added to the cart", "items": len(wanted)},
+    )
+    cart_summary.invalidate(user_id)
+    return response
 
 
 @user_router.get("/cart")
@@ -190,6 +876,16 @@ def show_cart(current_user=Depends(user_required), db: Session = Depends(get_db)
     )
 
 
+@user_router.get("/cart/summary")
+def show_cart_summary(
+    current_user=Depends(user_required), db: Session = Depends(get_db)
+):
+    # Badge data: one cached lookup, no join over the cart
+    return JSONResponse(
+        status_code=200, content=cart_summary.get(db, current_user.user_id)
+    )
+
+
 @user_router.put("/cart/{product_id}")
 def update_cart(
     product_id: int,
@@ -208,14 +904,38 @@ def update_cart(
         return JSONResponse(status_code=404, content={"detail": "Product not found"})
 
     if quantity <= 0:
+        reservations.close_holds(
+            db,
+            "release",
+            StockReservation.user_id == user_id,
+            StockReservation.variant_id == fetch_product.variant_id,
+        )
         db.delete(fetch_product)
+        cart_summary.refresh(db, user_id)
         db.commit()
+        cart_summary.invalidate(user_id)
         return JSONResponse(
             status_code=200, content={"message": "Product removed from the Cart"}
         )
 
+    # One hold for the new quantity replaces the line's previous holds
+    variant = db.get(Variant, fetch_product.variant_id)
+    reservations.close_holds(
+        db,
+        "release",
+        StockReservation.user_id == user_id,
+        StockReservation.variant_id == fetch_product.variant_id,
+    )
+    variant_id = variant.variant_id
+    stock = stock_counters.current(db, {variant_id: variant.stock})[variant_id]
+    if not reservations.hold(db, user_id, variant_id, quantity, stock):
+        db.rollback()
+        return JSONResponse(status_code=400, content={"detail": "No stock"})
+
     fetch_product.quantity = quantity
+    cart_summary.refresh(db, user_id)
     db.commit()
+    cart_summary.invalidate(user_id)
     db.refresh(fetch_product)
 
     return JSONResponse(
@@ -241,8 +961,16 @@ def delete_product(
     if not fetch_product:
         return JSONResponse(status_code=404, content={"detail": "Product Not Found"})
 
+    reservations.close_holds(
+        db,
+        "release",
+        StockReservation.user_id == user_id,
+        StockReservation.variant_id == fetch_product.variant_id,
+    )
     db.delete(fetch_product)
+    cart_summary.refresh(db, user_id)
     db.commit()
+    cart_summary.invalidate(user_id)
     return JSONResponse(
         status_code=200, content={"message": "Product deleted successfully"}
     )
@@ -331,12 +1059,12 @@ def remove_product(
 
 @user_router.post("/apply-coupon")
 def apply_coupon(
-    code: str,
     order_amount: float,
+    code: str = Depends(coupons.known_code),
     db: Session = Depends(get_db),
     current_user=Depends(user_required),
 ):
-    coupon = db.query(Coupon).filter(Coupon.code == code).first()
+    coupon = coupons.get(db, code)
 
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
@@ -353,31 +1081,18 @@ def apply_coupon(
             detail=f"Minimum order amount should be {coupon.min_order_amount}",
         )
 
-    # Check usage limit (overall)
-    if coupon.usage_limit is not None:
-        total_used = db.query(Order).filter(Order.coupon_id == coupon.coupon_id).count()
-        if total_used >= coupon.usage_limit:
-            raise HTTPException(status_code=400, detail="Coupon usage limit reached")
+    # Check usage limit (overall), then per user, from the usage counters
+    total_used, user_used = coupons.usage(db, coupon.coupon_id, current_user.user_id)
+    if coupon.usage_limit is not None and total_used >= coupon.usage_limit:
+        raise HTTPException(status_code=400, detail="Coupon usage limit reached")
 
-    # Check usage per user
-    user_used = (
-        db.query(Order)
-        .filter(
-            Order.coupon_id == coupon.coupon_id, Order.user_id == current_user.user_id
-        )
-        .count()
-    )
-    if user_used >= coupon.usage_per_user:
+    if coupon.usage_per_user is not None and user_used >= coupon.usage_per_user:
         raise HTTPException(
             status_code=400,
             detail="You have already used this coupon the maximum allowed times",
         )
 
-    # Calculate discount
-    if coupon.discount_type == "percentage":
-        discount = (coupon.discount_value / 100) * order_amount
-    else:  # fixed amount
-        discount = coupon.discount_value
+    discount = coupon_discount(coupon, order_amount)
 
     return {
         "message": "Coupon applied successfully",
@@ -387,11 +1102,18 @@ def apply_coupon(
     }
 
 
+def coupon_discount(coupon: coupons.CompiledCoupon, order_amount: float) -> float:
+    if coupon.discount_type == "percentage":
+        return (coupon.discount_value / 100) * order_amount
+    # fixed amount
+    return coupon.discount_value
+
+
 def validate_coupon(
     coupon_code: str, user_id: int, total_amount: float, db: Session
-) -> Coupon:
+) -> coupons.CompiledCoupon:
     # 1. Check if coupon exists
-    coupon = db.query(Coupon).filter(Coupon.code == coupon_code).first()
+    coupon = coupons.get(db, coupon_code)
     if not coupon:
         raise HTTPException(status_code=404, detail="Coupon not found")
 
@@ -405,23 +1127,19 @@ def validate_coupon(
         raise HTTPException(status_code=400, detail="Coupon is inactive")
 
     # 3. Check min purchase requirement
-    if coupon.min_purchase_amount and total_amount < coupon.min_purchase_amount:
+    if coupon.min_order_amount and total_amount < coupon.min_order_amount:
         raise HTTPException(
             status_code=400,
-            detail=f"Minimum purchase of {coupon.min_purchase_amount} required",
+            detail=f"Minimum purchase of {coupon.min_order_amount} required",
         )
 
     # 4. Check usage limits
-    if coupon.usage_limit and coupon.times_used >= coupon.usage_limit:
+    times_used, user_used = coupons.usage(db, coupon.coupon_id, user_id)
+    if coupon.usage_limit is not None and times_used >= coupon.usage_limit:
         raise HTTPException(status_code=400, detail="Coupon usage limit reached")
 
     # 5. Check if user already used this coupon
-    user_used_coupon = (
-        db.query(Order)
-        .filter(Order.user_id == user_id, Order.coupon_id == coupon.coupon_id)
-        .first()
-    )
-    if user_used_coupon:
+    if coupon.usage_per_user is not None and user_used >= coupon.usage_per_user:
         raise HTTPException(status_code=400, detail="You have already used this coupon")
 
     return coupon
@@ -429,27 +1147,91 @@ def validate_coupon(
 
 @user_router.post("/order")
 def create_order(
-    current_user=Depends(user_required), coupon_code=None, db: Session = Depends(get_db)
+    current_user=Depends(user_required),
+    coupon_code=None,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
     user_id = current_user.user_id
 
-    # 1. Fetch cart items
-    cart_items = db.query(Cart).filter(Cart.user_id == user_id).all()
+    # A retried checkout returns the stored order before any cart or coupon work
+    request_hash = idempotency.fingerprint({"coupon_code": coupon_code})
+    replayed = idempotency.lookup(
+        db, user_id, "POST /order", idempotency_key, request_hash
+    )
+    if replayed:
+        return replayed
+
+    # 1. Cart lines with their variant price in one query, in variant order so
+    # concurrent checkouts lock variant rows in the same order
+    cart_items = (
+        db.query(
+            Cart.cart_id,
+            Cart.product_id,
+            Cart.variant_id,
+            Cart.quantity,
+            Variant.price,
+            Variant.available,
+        )
+        .join(Variant, Variant.variant_id == Cart.variant_id)
+        .filter(Cart.user_id == user_id)
+        .order_by(Cart.variant_id)
+        .all()
+    )
     if not cart_items:
         return JSONResponse(status_code=400, content={"detail": "Cart is empty"})
 
     # 2. Calculate total
-    total_amount = sum(item.product.price * item.quantity for item in cart_items)
+    total_amount = sum(float(item.price) * item.quantity for item in cart_items)
 
     # 3. Apply coupon if provided
     discount_amount = 0
     coupon_id = None
     if coupon_code:
-        coupon = validate_coupon(coupon_code, user_id, total_amount)
-        discount_amount = coupon.discount_amount
+        coupon = validate_coupon(coupon_code, user_id, total_amount, db)
+        discount_amount = coupon_discount(coupon, total_amount)
         coupon_id = coupon.coupon_id
 
-    # 4. Create order
+    # 4. Reserve stock: the conditional UPDATE only succeeds while enough stock
+    # is left, so parallel checkouts can never take a variant below zero.
+    # Units held by other users' carts are not for sale; this user's own
+    # holds are what they are buying. Variants in sharded-counter mode
+    # decrement one of their shard rows.
+    reserved = {}
+    for item in cart_items:
+        reserved[item.variant_id] = reserved.get(item.variant_id, 0) + item.quantity
+    sharded = stock_counters.sharded(db, reserved)
+    shard_stock = stock_counters.available(db, sharded) if sharded else {}
+    unavailable = {item.variant_id for item in cart_items if not item.available}
+    held_by_others = reservations.held_quantities(db, reserved, exclude_user=user_id)
+    for variant_id, quantity in reserved.items():
+        held = held_by_others.get(variant_id, 0)
+        if variant_id in unavailable:
+            taken = False
+        elif variant_id in sharded:
+            taken = shard_stock.get(variant_id, 0) - held >= quantity
+            taken = taken and stock_counters.reserve(db, variant_id, quantity)
+        else:
+            result = db.execute(
+                update(Variant)
+                .where(
+                    Variant.variant_id == variant_id,
+                    Variant.stock >= quantity + held,
+                    Variant.available.is_(True),
+                )
+                .values(stock=Variant.stock - quantity)
+                .execution_options(synchronize_session=False)
+            )
+            taken = result.rowcount == 1
+        if not taken:
+            db.rollback()
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "Insufficient stock", "variant_id": variant_id},
+            )
+
+    # 5. Order, all of its items in one INSERT, and the cart lines that were
+    # bought, committed together
     order = Order(
         user_id=user_id,
         coupon_id=coupon_id,
@@ -458,25 +1240,74 @@ def create_order(
         status="pending",
     )
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.flush()
+    items = [
+        {
+            "order_id": order.order_id,
+            "product_id": item.product_id,
+            "variant_id": item.variant_id,
+            "quantity": item.quantity,
+            "price": float(item.price),
+        }
+        for item in cart_items
+    ]
+    db.execute(insert(OrderItem), items)
+    db.query(Cart).filter(
+        Cart.cart_id.in_([item.cart_id for item in cart_items])
+    ).delete(synchronize_session=False)
+    reservations.close_holds(
+        db,
+        "checkout",
+        StockReservation.user_id == user_id,
+        StockReservation.variant_id.in_(list(reserved)),
+    )
 
-    # 5. Create OrderItems
+    # Listing stock figures follow through the read model; listings and the
+    # product pages are invalidated below.
+    # Sharded variants skip this (it would put the hot row back) and reach
+    # the read model on the next rebalance.
+    sold = {}
     for item in cart_items:
-        order_item = OrderItem(
-            order_id=order.order_id,
-            product_id=item.product_id,
-            variant_id=item.variant_id,
-            quantity=item.quantity,
-            price=item.product.price,
+        quantity = 0 if item.variant_id in sharded else item.quantity
+        sold[item.product_id] = sold.get(item.product_id, 0) + quantity
+    for product_id, quantity in sold.items():
+        if not quantity:
+            continue
+        db.execute(
+            update(ProductReadModel)
+            .where(ProductReadModel.product_id == product_id)
+            .values(total_stock=ProductReadModel.total_stock - quantity)
+            .execution_options(synchronize_session=False)
         )
-        db.add(order_item)
-
-    # 6. Clear cart
-    db.query(Cart).filter(Cart.user_id == user_id).delete()
-    db.commit()
-
-    return JSONResponse(status_code=201, content={"order": order.__dict__})
+    content = {
+        "order": {
+            "order_id": order.order_id,
+            "user_id": user_id,
+            "coupon_id": coupon_id,
+            "totol_amount": total_amount,
+            "discount_amount": discount_amount,
+            "status": "pending",
+            "items": [
+                {key: value for key, value in item.items() if key != "order_id"}
+                for item in items
+            ],
+        }
+    }
+    # The usage counters are the authority under concurrent checkouts; the
+    # validate_coupon check above only turns most rejections away early
+    if coupon_id and not coupons.count_use(db, coupon, user_id):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Coupon usage limit reached")
+    cart_summary.refresh(db, user_id)
+    response = idempotency.commit(
+        db, user_id, "POST /order", idempotency_key, request_hash, 201, content
+    )
+    cart_summary.invalidate(user_id)
+    # Listings carry total_stock too, so their validators must change with it
+    changed = [f"product:{product_id}" for product_id in sold if sold[product_id]]
+    if changed:
+        catalog_cache.invalidate("products", *changed)
+    return response
 
 
 @user_router.get("/order", response_model=List[OrderSchemaOut])
@@ -523,9 +1354,11 @@ def update_order_status(
 def delete_order(
     order_id: int, db: Session = Depends(get_db), current_user=Depends(user_required)
 ):
+    # Locked, so two deletes of one order cannot both return its stock
     order = (
         db.query(Order)
         .filter(Order.order_id == order_id, Order.user_id == current_user.user_id)
+        .with_for_update()
         .first()
     )
     if not order:
@@ -536,8 +1369,34 @@ def delete_order(
             status_code=400, content={"detail": "Only pending orders can be deleted"}
         )
 
+    # The order's units go back on sale, in variant order like checkout's
+    # decrements; sharded variants get them on a shard
+    returned, products = {}, set()
+    for item in order.items:
+        returned[item.variant_id] = returned.get(item.variant_id, 0) + item.quantity
+        products.add(item.product_id)
+    sharded = stock_counters.sharded(db, returned) if returned else set()
+    for variant_id in sorted(returned):
+        if variant_id in sharded:
+            stock_counters.restock(db, variant_id, returned[variant_id])
+            continue
+        db.execute(
+            update(Variant)
+            .where(Variant.variant_id == variant_id)
+            .values(stock=Variant.stock + returned[variant_id])
+            .execution_options(synchronize_session=False)
+        )
+    if products:
+        read_model.sync_products(db, Product.product_id.in_(products))
+
+    if order.coupon_id:
+        coupons.release_use(db, order.coupon_id, order.user_id)
     db.delete(order)
     db.commit()
+    if products:
+        catalog_cache.invalidate(
+            "products", *(f"product:{product_id}" for product_id in products)
+        )
     return JSONResponse(
         status_code=200, content={"message": "Order deleted successfully"}
     )
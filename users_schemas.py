@@ -1,11 +1,27 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
 
 
 class ProductsList(BaseModel):
+    product_id: int
     product_name: str
     prod_image: str
     product_price: float
     product_description: str
+    brand_name: Optional[str] = None
+    category_name: Optional[str] = None
+    sub_category_name: Optional[str] = None
+    min_variant_price: Optional[float] = None
+    max_variant_price: Optional[float] = None
+    total_stock: int = 0
+
+    class Config:
+        from_attributes = True
+
+
+class ProductPage(BaseModel):
+    items: list[ProductsList]
+    next_cursor: Optional[int] = None
 
 
 class AddCart(BaseModel):
@@ -14,6 +30,10 @@ class AddCart(BaseModel):
     quantity: int
 
 
+class AddCartItems(BaseModel):
+    items: list[AddCart] = Field(min_length=1, max_length=100)
+
+
 class CartOut(BaseModel):
     product_name: str
 
@@ -33,3 +53,61 @@ class OrderSchemaOut(BaseModel):
 
 class OrderUpdateStatusSchema(BaseModel):
     status: str
+
+
+class ProductQueryPage(BaseModel):
+    items: list[ProductsList]
+    next_cursor: Optional[str] = None
+
+
+class VariantDetail(BaseModel):
+    variant_id: int
+    name: str
+    sku: str
+    price: float
+    stock: int
+    available: bool
+
+    class Config:
+        from_attributes = True
+
+
+class TermDetail(BaseModel):
+    term_id: int
+    value: str
+
+
+class AttributeTerms(BaseModel):
+    attribute_id: Optional[int] = None
+    attribute_name: Optional[str] = None
+    terms: list[TermDetail]
+
+
+class ProductDetail(BaseModel):
+    product_id: int
+    product_name: str
+    prod_image: str
+    product_price: float
+    product_description: str
+    brand_id: Optional[int] = None
+    brand_name: Optional[str] = None
+    category_id: Optional[int] = None
+    category_name: Optional[str] = None
+    sub_category_id: Optional[int] = None
+    sub_category_name: Optional[str] = None
+    variants: list[VariantDetail]
+    attributes: list[AttributeTerms]
+
+
+class FacetValue(BaseModel):
+    id: int
+    name: str
+    count: int
+    attribute_name: Optional[str] = None
+
+
+class FacetPage(BaseModel):
+    total: int
+    items: list[ProductsList]
+    next_cursor: Optional[int] = None
+    facets: dict[str, list[FacetValue]]